@@ -1,55 +1,175 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, abort, current_app
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
 import os
-
-# Initialize Flask application
-app = Flask(__name__)
-
-# Configuration settings
-
-# Security configuration
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'calcuingo-secret-key-2024-dev-only')
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
-
-# Database configuration
-database_url = os.environ.get('DATABASE_URL', 'sqlite:///calcuingo.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Production settings
-app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
-app.config['TESTING'] = False
+from config import SHARD_CONFIG
+from services.database import ShardMoving, binds, engine_options, init_shards, read_only, remember_write
 
 # Import database models first (required before db initialization)
-from models import db, User, Lesson, Exercise, Progress
-
-# Initialize SQLAlchemy database with Flask app
-db.init_app(app)
+from models import db, Exercise, Progress, UserBadge
+from services.analytics import analytics_cli
+from services.assets import asset_urls
+from services.backup import data_cli
+from services.badges import badges_cli
+from services.catalog import get_catalog
+from services.content import content_cli
+from services import metrics, ratelimit, startup
+from services.identity import current_user
+from services.maintenance import maintenance_cli
+from services.pagecache import conditional_page, page_validators, render_fragment
+from services.prerequisites import LOCKED
+from services.ratelimit import RATE_LIMITS, RateLimited, rate_limit_store
+from services.reviews import reviews_cli
+from services.schema import db_cli
+from services.sessions import session_interface, sessions_cli
+from services.shards import shards_cli
+from services.startup import templates_cli
+from services.stats import get_user_stats, stats_cli
+from services.variants import variants_cli
 
 # Import route blueprints (modular route organization)
 from routes.auth import auth_bp      # Authentication routes (login, register, logout)
 from routes.lessons import lessons_bp  # Lesson-related routes (view lessons, exercises)
 from routes.progress import progress_bp  # User progress tracking routes
+from routes.leaderboard import leaderboard_bp  # XP leaderboards
+from routes.api import api_bp  # Versioned JSON API
+from routes.assets import assets_bp  # Fingerprinted static assets
+
 
-# Register route blueprints with URL prefixes
-app.register_blueprint(auth_bp, url_prefix='/auth')      # Routes: /auth/login, /auth/register, etc.
-app.register_blueprint(lessons_bp, url_prefix='/lessons')  # Routes: /lessons/1, /lessons/1/exercises, etc.
-app.register_blueprint(progress_bp, url_prefix='/progress')  # Routes: /progress/save, /progress/update, etc.
+def create_app(config=None):
+    """
+    Application factory: build and configure a Calcuingo app
+    The environment is read here, not when this module is imported. `config`
+    overrides any setting (tools and tests point SQLALCHEMY_DATABASE_URI elsewhere).
+    Nothing here touches the database: run `flask db setup` to create or upgrade
+    the schema, and see wsgi.py for the production entry point.
+    """
+    # Initialize Flask application
+    app = Flask(__name__)
+
+    # Configuration settings
+
+    # Security configuration
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'calcuingo-secret-key-2024-dev-only')
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
+
+    # Database configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///calcuingo.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Optional read replica, and extra databases for the per-user tables (space-separated URLs)
+    app.config['SQLALCHEMY_BINDS'] = binds(os.environ.get('DATABASE_REPLICA_URL'),
+                                           os.environ.get('DATABASE_SHARD_URLS', '').split())
+
+    # Sessions live in the signed cookie unless SESSION_BACKEND selects a server-side store
+    app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND')
+    # Rate limit buckets are per worker unless RATE_LIMIT_BACKEND=sqlite shares them on the host (off: no limits)
+    app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND')
+    # /metrics needs this bearer token when set; without one it only answers requests from the host itself
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+    # Production settings
+    app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
+    app.config['TESTING'] = False
+
+    app.config.update(config or {})
+    # Pooling and SQLite pragmas for the database actually configured
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    # Initialize SQLAlchemy database with Flask app
+    db.init_app(app)
+    init_shards(app)
+    app.session_interface = session_interface(app, app.config['SESSION_BACKEND'])
+    app.extensions[RATE_LIMITS] = rate_limit_store(app, app.config['RATE_LIMIT_BACKEND'])
+
+    # Template bytecode cache, and per-process state reset in workers forked from this process
+    startup.init_app(app)
+
+    # Register route blueprints with URL prefixes
+    app.register_blueprint(auth_bp, url_prefix='/auth')      # Routes: /auth/login, /auth/register, etc.
+    app.register_blueprint(lessons_bp, url_prefix='/lessons')  # Routes: /lessons/1, /lessons/1/exercises, etc.
+    app.register_blueprint(progress_bp, url_prefix='/progress')  # Routes: /progress/save, /progress/update, etc.
+    app.register_blueprint(leaderboard_bp, url_prefix='/leaderboard')  # Routes: /leaderboard/global, /leaderboard/weekly/me, etc.
+    app.register_blueprint(api_bp, url_prefix='/api/v1')  # Routes: /api/v1/lessons/1, /api/v1/lessons/1/submissions, etc.
+    app.register_blueprint(assets_bp, url_prefix='/assets')  # Routes: /assets/app.3f9c2a1b7d4e.css, etc.
+
+    # Pages served by this module
+    app.add_url_rule('/metrics', view_func=metrics_endpoint)
+    app.add_url_rule('/', view_func=index)
+    app.add_url_rule('/learning-path', view_func=learning_path)
+    app.add_url_rule('/profile', view_func=profile)
+
+    # Error handlers
+    app.register_error_handler(404, not_found_error)
+    app.register_error_handler(500, internal_error)
+    app.register_error_handler(403, forbidden_error)
+    app.register_error_handler(ShardMoving, shard_moving_error)
+    app.register_error_handler(RateLimited, rate_limited_error)
+
+    # Templates link CSS/JS bundles through the asset manifest
+    app.jinja_env.globals['asset_urls'] = asset_urls
+
+    # Register maintenance commands (run with `flask <group> <command>`)
+    app.cli.add_command(stats_cli)  # flask stats rebuild
+    app.cli.add_command(badges_cli)  # flask badges backfill
+    app.cli.add_command(content_cli)  # flask content import
+    app.cli.add_command(db_cli)  # flask db setup / upgrade / status
+    app.cli.add_command(reviews_cli)  # flask reviews rebuild
+    app.cli.add_command(variants_cli)  # flask variants generate
+    app.cli.add_command(maintenance_cli)  # flask maintenance run / status
+    app.cli.add_command(analytics_cli)  # flask analytics export / report
+    app.cli.add_command(sessions_cli)  # flask sessions revoke / prune
+    app.cli.add_command(templates_cli)  # flask templates compile
+    app.cli.add_command(data_cli)  # flask data export / import
+    app.cli.add_command(shards_cli)  # flask shards status / move
+
+    # Request instrumentation: per-endpoint latency, SQL counts and N+1 warnings (see /metrics)
+    app.before_request(metrics.start_request)
+    app.after_request(metrics.finish_response)
+    app.teardown_request(metrics.finish_request)
+
+    # Rate limits and write admission for the endpoints in RATE_LIMIT_CONFIG (429 with Retry-After)
+    app.before_request(ratelimit.admit)
+    app.teardown_request(ratelimit.release)
+
+    # Read-your-writes: users who just wrote keep reading from the primary database
+    app.after_request(remember_write)
+
+    return app
+
+
+_default_app = None
+
+
+def __getattr__(name):
+    # `from app import app` and `flask --app app` get one app built from the environment on first use
+    global _default_app
+    if name == 'app':
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+# Views (registered by create_app)
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's request and SQL metrics (404 unless the scrape is allowed)"""
+    if not metrics.scrape_allowed(request.remote_addr, request.headers.get('X-Forwarded-For'),
+                                  request.headers.get('Authorization'), current_app.config['METRICS_TOKEN']):
+        abort(404)
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
-@app.route('/')
 def index():
     """Home page - redirects to learning path"""
     return redirect(url_for('learning_path'))
 
-@app.route('/learning-path')
+@read_only
 def learning_path():
     """
     Main learning path page with Duolingo-style nodes
     Displays all lessons in order and user progress if logged in
     """
-    # Get all lessons ordered by their sequence
-    lessons = Lesson.query.order_by(Lesson.order).all()
+    # Get all lessons ordered by their sequence (from the in-memory catalog)
+    catalog = get_catalog()
     
     # Get user progress if logged in (for showing completion status)
     user_progress = {}
@@ -58,58 +178,70 @@ def learning_path():
         progress_records = Progress.query.filter_by(user_id=user_id).all()
         # Create a dictionary mapping lesson_id to progress record for easy lookup
         user_progress = {p.lesson_id: p for p in progress_records}
+        # Unlock states come from the prerequisite graph, computed in one pass
+        completed_ids = {lesson_id for lesson_id, p in user_progress.items() if p.completed}
+        states = catalog.graph.node_states(completed_ids)
+    else:
+        # Visitors see the whole path locked until they sign up
+        states = dict.fromkeys(catalog.lessons_by_id, LOCKED)
     
-    return render_template('learning_path.html', lessons=lessons, user_progress=user_progress)
+    def render():
+        # Cards only depend on the lesson, its state and the score, so they are rendered once per content version
+        cards = []
+        for lesson in catalog.lessons:
+            progress = user_progress.get(lesson.id)
+            key = (catalog.version, lesson.id, states[lesson.id], progress.score if progress else None)
+            cards.append(render_fragment('_lesson_card.html', key,
+                                         lesson=lesson, state=states[lesson.id], progress=progress))
+        return render_template('learning_path.html', cards=cards)
+    
+    # 304 when neither the content nor this user's progress changed since the client's copy
+    return conditional_page(page_validators(catalog, 'learning-path', user_progress.values()), render)
 
-@app.route('/profile')
+@read_only
 def profile():
     """
     User profile page showing XP, streak, badges, and learning statistics
     Requires user to be logged in
     """
-    # Check if user is logged in
-    if 'user_id' not in session:
-        return redirect(url_for('auth.login'))
-    
-    # Get user from database
-    user = User.query.get(session['user_id'])
+    # Logged-in user (cached snapshot); visitors and deleted accounts go to the login page
+    user = current_user()
     if not user:
-        # User doesn't exist (session invalid), redirect to login
         return redirect(url_for('auth.login'))
     
     # Calculate user's learning statistics
-    completed_lessons = Progress.query.filter_by(user_id=user.id, completed=True).count()
-    total_lessons = Lesson.query.count()
+    completed_lessons = get_user_stats(user.id).completed_lessons
+    total_lessons = len(get_catalog().lessons)
     
     return render_template('profile.html', 
                          user=user, 
+                         badges=UserBadge.names(user.id),
                          completed_lessons=completed_lessons,
                          total_lessons=total_lessons)
 
 # Error handlers
-@app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return render_template('errors/500.html'), 500
 
-@app.errorhandler(403)
 def forbidden_error(error):
     return render_template('errors/403.html'), 403
 
-if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        
-        # Create dummy data if no lessons exist
-        if Lesson.query.count() == 0:
-            from dummy_data import create_dummy_data
-            create_dummy_data()
-    
-    # Use environment variable for debug mode
-    debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
-    app.run(debug=debug_mode, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
+def shard_moving_error(error):
+    # The user's rows are being copied to another shard (flask shards move); the pause is brief
+    db.session.rollback()
+    return jsonify({'error': 'Your progress is being moved, please retry shortly'}), 503, \
+        {'Retry-After': str(SHARD_CONFIG['retry_after_seconds'])}
 
+def rate_limited_error(error):
+    # Too many requests from this user or address, or too many writes in flight (services/ratelimit.py)
+    return jsonify({'error': 'Too many requests, please retry shortly'}), 429, \
+        {'Retry-After': str(error.retry_after)}
+
+if __name__ == '__main__':
+    # The schema is not checked here: run `flask --app app db setup` once first
+    app = create_app()
+    app.run(debug=app.config['DEBUG'], host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
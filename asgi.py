@@ -0,0 +1,375 @@
+"""
+ASGI entry point (optional async serving mode)
+The JSON endpoints that clients poll (/progress/user-stats and /api/v1/lessons...)
+run on the event loop with the async engine from services/asyncdb.py, so one
+worker holds hundreds of open connections while their queries are in flight.
+Every other request (pages, auth, leaderboards, assets) is passed to the Flask
+app, which runs in a thread pool of ASYNC_CONFIG['wsgi_threads'] threads.
+
+The async endpoints return the same JSON, read the same Flask session cookie and
+share the grading and write-path code with routes/api.py and routes/progress.py.
+The submissions endpoint is rate limited like its Flask twin (services/ratelimit.py).
+
+Run with (needs uvicorn plus aiosqlite or asyncpg):
+    uvicorn asgi:application --workers 2
+    gunicorn -k uvicorn.workers.UvicornWorker -w 2 asgi:application
+"""
+
+import asyncio
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+
+from sqlalchemy import select
+from werkzeug.http import dump_cookie, parse_cookie
+
+from app import app, db
+from config import ASYNC_CONFIG
+from models import Progress, User, UserBadge, UserStats
+from routes.api import grade_answers, lesson_json, lesson_summary_json, parse_answers, serve_lesson, submission_json
+from routes.progress import stats_json
+from services import metrics
+from services.asyncdb import adb
+from services.badges import on_completion
+from services.catalog import fresh_catalog, get_catalog
+from services.database import LAST_WRITE_KEY, SHARD_MAP
+from services.identity import UserSnapshot, snapshot_query, users
+from services.prerequisites import LOCKED
+from services.ratelimit import RATE_LIMITS, RateLimited, admit_request, client_ip, endpoint_limits
+from services.sessions import load_cookie_session, session_cookie_value
+from services.stats import blank_user_stats
+from services.submissions import record_submissions
+from services.variants import VARIANTS_KEY
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(ASYNC_CONFIG['wsgi_threads'], thread_name_prefix='wsgi')
+_connect_lock = asyncio.Lock()
+
+
+def in_thread(func, *args):
+    """Run a blocking call in the thread pool"""
+    return asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+def _with_app_context(func):
+    with app.app_context():
+        return func()
+
+
+async def ensure_connected():
+    """Create the async engine on first use (or at lifespan startup)"""
+    if adb.engine is not None:
+        return
+    if SHARD_MAP in app.extensions:
+        raise RuntimeError('The async endpoints read one database: serve a sharded deployment with wsgi.py')
+    async with _connect_lock:
+        if adb.engine is None:
+            url = await in_thread(_with_app_context, lambda: db.engine.url)
+            adb.connect(url)
+
+
+async def current_catalog():
+    """The lesson catalog; only a stale snapshot costs a trip to the thread pool"""
+    return fresh_catalog() or await in_thread(_with_app_context, get_catalog)
+
+
+class Request:
+    """The parts of an ASGI request the async endpoints need"""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        self.session = load_session(self.headers.get('cookie', ''))
+        self.session_modified = False
+
+    def json(self):
+        """Parsed JSON body, or None (like Flask's request.get_json(silent=True))"""
+        content_type = self.headers.get('content-type', '').split(';')[0].strip()
+        if content_type != 'application/json' and not content_type.endswith('+json'):
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+    def write_session(self, key, value):
+        self.session[key] = value
+        self.session_modified = True
+
+
+def load_session(cookie_header):
+    """The Flask session the cookie carries or refers to ({} if missing or tampered with)"""
+    return load_cookie_session(app, parse_cookie(cookie_header).get(app.config['SESSION_COOKIE_NAME']))
+
+
+def session_cookie(session):
+    """Set-Cookie value for a changed session, with the attributes Flask would use"""
+    expires = None
+    if session.get('_permanent'):
+        expires = datetime.now(timezone.utc) + app.permanent_session_lifetime
+    return dump_cookie(
+        app.config['SESSION_COOKIE_NAME'], session_cookie_value(app, session), expires=expires,
+        domain=app.config['SESSION_COOKIE_DOMAIN'] or None, path=app.config['SESSION_COOKIE_PATH'] or '/',
+        secure=app.config['SESSION_COOKIE_SECURE'], httponly=app.config['SESSION_COOKIE_HTTPONLY'],
+        samesite=app.config['SESSION_COOKIE_SAMESITE']
+    )
+
+
+# Async endpoints: each returns (status, JSON body)
+
+async def user_stats(request):
+    """Same response as progress.user_stats"""
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return 401, {'error': 'Not logged in'}
+
+    user = users.get(user_id, request.session.get(LAST_WRITE_KEY))
+    async with adb.session() as session:
+        if user is None:
+            loaded_at = time.time()
+            row = (await session.execute(snapshot_query(user_id))).first()
+            if row is None:
+                return 404, {'error': 'User not found'}
+            user = UserSnapshot(*row)
+            users.put(user, loaded_at)
+        stats = await session.get(UserStats, user_id) or blank_user_stats(user_id)
+        badges = await session.scalars(
+            select(UserBadge.badge).where(UserBadge.user_id == user_id).order_by(UserBadge.id))
+        return 200, stats_json(user, stats, list(badges))
+
+
+async def lessons(request):
+    """Same response as api.lessons"""
+    catalog = await current_catalog()
+    user_id = request.session.get('user_id')
+    if user_id:
+        async with adb.session() as session:
+            completed_ids = set(await session.scalars(select(Progress.lesson_id).where(
+                Progress.user_id == user_id, Progress.completed.is_(True))))
+        states = catalog.graph.node_states(completed_ids)
+    else:
+        states = dict.fromkeys(catalog.lessons_by_id, LOCKED)
+    return 200, {'lessons': [lesson_summary_json(lesson, states[lesson.id]) for lesson in catalog.lessons]}
+
+
+async def lesson(request, lesson_id):
+    """Same response as api.lesson"""
+    catalog = await current_catalog()
+    lesson = catalog.get_lesson(lesson_id)
+    if lesson is None:
+        return 404, {'error': 'Lesson not found'}
+
+    progress = None
+    user_id = request.session.get('user_id')
+    if user_id:
+        async with adb.session() as session:
+            progress = await session.scalar(select(Progress).where(
+                Progress.user_id == user_id, Progress.lesson_id == lesson_id))
+
+    exercises, served = serve_lesson(catalog, lesson, user_id, progress)
+    if served is not None:
+        request.write_session(VARIANTS_KEY, served)
+    return 200, lesson_json(lesson, progress, exercises)
+
+
+async def submit_answers(request, lesson_id):
+    """Same response as api.submit_answers; the shared write path runs through run_sync()"""
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return 401, {'error': 'Not logged in'}
+
+    catalog = await current_catalog()
+    lesson = catalog.get_lesson(lesson_id)
+    if lesson is None:
+        return 404, {'error': 'Lesson not found'}
+
+    answers, error = parse_answers(request.json(), lesson, catalog, request.session.get(VARIANTS_KEY))
+    if error:
+        return 400, {'error': error}
+    graded = grade_answers(answers)
+    rows = [(exercise.id, correct, latency_ms) for exercise, correct, latency_ms in graded]
+
+    def write(session):
+        result = record_submissions(user_id, lesson, rows, session)
+        return result, on_completion(user_id, result, session)
+
+    async with adb.session() as session:
+        result, new_badges = await session.run_sync(write)
+        await session.commit()
+        total_xp = await session.scalar(select(User.xp).where(User.id == user_id))
+        completed = result.first_completion or await session.scalar(select(Progress.completed).where(
+            Progress.user_id == user_id, Progress.lesson_id == lesson_id))
+
+    # Read-your-writes: keep this user's Flask reads on the primary for a while
+    request.write_session(LAST_WRITE_KEY, time.time())
+    return 200, submission_json(graded, result, total_xp, completed, new_badges)
+
+
+# (method, path pattern, handler, endpoint name for /metrics)
+ROUTES = [
+    ('GET', re.compile(r'/progress/user-stats'), user_stats, 'async.progress.user_stats'),
+    ('GET', re.compile(r'/api/v1/lessons'), lessons, 'async.api.lessons'),
+    ('GET', re.compile(r'/api/v1/lessons/(?P<lesson_id>\d+)'), lesson, 'async.api.lesson'),
+    ('POST', re.compile(r'/api/v1/lessons/(?P<lesson_id>\d+)/submissions'), submit_answers,
+     'async.api.submit_answers'),
+]
+
+
+def match_route(method, path):
+    for route_method, pattern, handler, endpoint in ROUTES:
+        found = pattern.fullmatch(path)
+        if found and method == route_method:
+            return handler, {name: int(value) for name, value in found.groupdict().items()}, endpoint
+    return None, None, None
+
+
+async def admitted(handler, params, endpoint, request):
+    """Run an endpoint under the rate limits of its Flask twin (RATE_LIMIT_CONFIG); raises RateLimited"""
+    flask_endpoint = endpoint.removeprefix('async.')
+    store = app.extensions[RATE_LIMITS]
+    limits = endpoint_limits(request.scope['method'], flask_endpoint)
+    if store is None or limits is None:
+        return await handler(request, **params)
+    ip = client_ip((request.scope.get('client') or (None,))[0], request.headers.get('x-forwarded-for'))
+    # The checks may wait for a write slot (or the shared store's lock): not on the event loop
+    slot = await in_thread(admit_request, store, flask_endpoint, limits, request.session.get('user_id'), ip)
+    try:
+        return await handler(request, **params)
+    finally:
+        await in_thread(store.release_slot, slot)
+
+
+async def call_async(handler, params, endpoint, request):
+    """Run an async endpoint; returns (status, headers, body)"""
+    retry_after = None
+    with metrics.track_request(endpoint) as tracked:
+        try:
+            status, payload = await admitted(handler, params, endpoint, request)
+        except RateLimited as error:
+            status, payload = 429, {'error': 'Too many requests, please retry shortly'}
+            retry_after = error.retry_after
+        except Exception:
+            logger.exception('Unhandled error in %s', endpoint)
+            status, payload = 500, {'error': 'Internal server error'}
+        if tracked is not None:
+            tracked.status = status
+
+    body = app.json.dumps(payload).encode('utf-8')
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    if retry_after is not None:
+        headers.append((b'retry-after', str(retry_after).encode()))
+    if request.session_modified:
+        headers.append((b'set-cookie', session_cookie(request.session).encode('latin-1')))
+    return status, headers, body
+
+
+# Everything else goes to Flask (WSGI) in the thread pool
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': BytesIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    """Run the Flask app on one request; returns (status, headers, body)"""
+    response = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response['status'], response['headers'] = status, headers
+        return chunks.append
+
+    result = app(environ, start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response['headers']]
+    return int(response['status'].split(' ', 1)[0]), headers, b''.join(chunks)
+
+
+async def read_body(receive):
+    """The request body, or None if it exceeds ASYNC_CONFIG['max_body_bytes']"""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return bytes(body)
+        body += message.get('body', b'')
+        if len(body) > ASYNC_CONFIG['max_body_bytes']:
+            return None
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await ensure_connected()
+            except Exception as error:
+                await send({'type': 'lifespan.startup.failed', 'message': str(error)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await adb.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """The ASGI application"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return  # No websockets
+
+    body = await read_body(receive)
+    if body is None:
+        status, headers, content = 413, [(b'content-type', b'text/plain')], b'Request body too large'
+    else:
+        handler, params, endpoint = match_route(scope['method'], scope['path'])
+        if handler is None:
+            status, headers, content = await in_thread(call_wsgi, wsgi_environ(scope, body))
+        else:
+            await ensure_connected()
+            status, headers, content = await call_async(handler, params, endpoint, Request(scope, body))
+
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': content if scope['method'] != 'HEAD' else b''})
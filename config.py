@@ -58,13 +58,15 @@ EXERCISE_TEMPLATES = {
             'question': 'What is the domain of f(x) = √(x-2)?',
             'answer': '[2, ∞)',
             'options': ['[2, ∞)', '(-∞, 2]', '(-∞, ∞)', '[0, ∞)'],
-            'hint': 'Remember: square root functions are defined when the expression inside is ≥ 0'
+            'hint': 'Remember: square root functions are defined when the expression inside is ≥ 0',
+            'generator': 'sqrt_domain'
         },
         {
             'type': 'fill_blank',
             'question': 'If f(x) = 2x + 3, then f(5) = ___',
             'answer': '13',
-            'hint': 'Substitute x = 5 into the function'
+            'hint': 'Substitute x = 5 into the function',
+            'generator': 'linear_value'
         }
     ],
     2: [  # Limits
@@ -73,13 +75,15 @@ EXERCISE_TEMPLATES = {
             'question': 'What is lim(x→2) (x² - 4)/(x - 2)?',
             'answer': '4',
             'options': ['2', '4', '0', 'undefined'],
-            'hint': 'Factor the numerator and cancel common terms'
+            'hint': 'Factor the numerator and cancel common terms',
+            'generator': 'factor_limit'
         },
         {
             'type': 'fill_blank',
             'question': 'lim(x→0) sin(x)/x = ___',
             'answer': '1',
-            'hint': 'This is a fundamental limit in calculus'
+            'hint': 'This is a fundamental limit in calculus',
+            'generator': 'sine_limit'
         }
     ],
     3: [  # Derivatives
@@ -88,13 +92,15 @@ EXERCISE_TEMPLATES = {
             'question': 'What is the derivative of x³?',
             'answer': '3x²',
             'options': ['3x²', 'x²', '3x', 'x³'],
-            'hint': 'Use the power rule: d/dx(xⁿ) = nxⁿ⁻¹'
+            'hint': 'Use the power rule: d/dx(xⁿ) = nxⁿ⁻¹',
+            'generator': 'power_rule_choice'
         },
         {
             'type': 'fill_blank',
             'question': 'If f(x) = 5x², then f\'(x) = ___',
             'answer': '10x',
-            'hint': 'Apply the power rule: d/dx(5x²) = 5·2x = 10x'
+            'hint': 'Apply the power rule: d/dx(5x²) = 5·2x = 10x',
+            'generator': 'power_rule_value'
         }
     ],
     4: [  # Product & Chain Rule
@@ -112,7 +118,8 @@ EXERCISE_TEMPLATES = {
             'question': 'What is ∫(2x + 3)dx?',
             'answer': 'x² + 3x + C',
             'options': ['x² + 3x + C', '2x² + 3x + C', 'x² + 3x', '2x + 3'],
-            'hint': 'Integrate term by term and don\'t forget the constant of integration'
+            'hint': 'Integrate term by term and don\'t forget the constant of integration',
+            'generator': 'linear_integral'
         }
     ],
     6: [  # Series & Sequences
@@ -138,3 +145,228 @@ APP_CONFIG = {
     ]
 }
 
+
+# Answer Grading Configuration
+# Controls how submitted answers are compared to Exercise.answer
+GRADING_CONFIG = {
+    'sample_points': 16,            # Random points used to compare math expressions
+    'sample_ranges': [(-3.0, 3.0), (0.5, 10.0)],  # Points are split evenly across these intervals
+    'sample_seed': 2024,            # Fixed seed so grading is deterministic
+    'min_valid_points': 4,          # Points where both sides must be defined
+    'rel_tolerance': 1e-6,          # Relative tolerance for numeric comparison
+    'abs_tolerance': 1e-9,          # Absolute tolerance for numeric comparison
+    'submission_cache_size': 4096,  # Normalized submissions kept per worker
+    'max_answer_length': 200        # Longer answers are compared as plain text
+}
+
+# Lesson Catalog Cache Configuration
+# Lessons and exercises are cached in memory by every worker
+CATALOG_CONFIG = {
+    'version_check_interval': 2.0  # Seconds between checks of the content version in the DB
+}
+
+# Leaderboard Configuration
+LEADERBOARD_CONFIG = {
+    'sync_interval': 1.0,      # Seconds between reads of new XP events by each worker
+    'sync_lookback': 100,      # Event ids re-checked below the last one seen
+    'default_limit': 10,       # Entries returned by the top-N endpoints
+    'max_limit': 100,          # Upper bound for ?limit=
+    'default_radius': 3,       # Neighbours shown above and below the current user
+    'max_radius': 25
+}
+
+# Badge Rules
+# Each rule awards `name` once `metric` reaches `threshold`. Rules are only checked
+# when one of their `events` fires and that event can have moved the rule's metric.
+# Events: 'completion' (a correct answer: xp and correct_attempts are checked on every one,
+# completed_lessons on a first lesson completion, perfect_lessons on a first-try answer), 'login'
+# Metrics: xp, completed_lessons, correct_attempts, perfect_lessons, streak
+BADGE_RULES = [
+    {'name': 'First Steps', 'events': ['completion'], 'metric': 'completed_lessons', 'threshold': 1},
+    {'name': 'Quick Learner', 'events': ['completion'], 'metric': 'completed_lessons', 'threshold': 3},
+    {'name': 'Math Master', 'events': ['completion'], 'metric': 'xp', 'threshold': 100},
+    {'name': 'Calculus Champion', 'events': ['completion'], 'metric': 'completed_lessons', 'threshold': 6},
+    {'name': 'Perfect Score', 'events': ['completion'], 'metric': 'perfect_lessons', 'threshold': 1},
+    {'name': 'Streak Master', 'events': ['login'], 'metric': 'streak', 'threshold': 7}
+]
+
+# Parametric Exercises
+# Exercises with a 'generator' are shown as pregenerated variants (services/variants.py).
+# `flask variants generate` builds the pools; pool_size seeds are tried per generator.
+VARIANT_CONFIG = {
+    'pool_size': 1000,
+    'chunk_size': 250,    # Seeds per task handed to a pool process
+    'workers': None       # Generator processes (None: one per CPU)
+}
+
+# Spaced Repetition
+# Every graded answer reschedules its exercise for the user with SM-2 (services/reviews.py).
+# Answer quality (0-5): wrong 2, correct 5 within fast_answer_ms, 3 beyond slow_answer_ms, else 4.
+REVIEW_CONFIG = {
+    'initial_ease': 2.5,
+    'min_ease': 1.3,
+    'first_intervals': (1, 6),     # Days until the first and second review after a correct answer
+    'max_interval_days': 365,
+    'fast_answer_ms': 15000,
+    'slow_answer_ms': 60000,
+    'default_limit': 10,           # Items returned by /api/v1/reviews/due
+    'max_limit': 100
+}
+
+# Maintenance Jobs
+# `flask maintenance run` (see services/maintenance.py); schedule it nightly with cron
+MAINTENANCE_CONFIG = {
+    'chunk_size': 10000,     # Ids per set-based statement and transaction
+    'settle_seconds': 60     # Log rows younger than this are left for the next run
+}
+
+# Analytics
+# `flask analytics export` writes column files; `flask analytics report` aggregates them
+# (see services/analytics.py). Memory use is bounded by chunk_size and slice_rows.
+ANALYTICS_CONFIG = {
+    'chunk_size': 100000,     # Rows per server-side cursor fetch, appended to the column files
+    'slice_rows': 5000000,    # Attempt rows per vectorized pass of the report (cut at user boundaries)
+    'attempts_cap': 50,       # Attempts-to-completion histogram: longer runs share the last bucket
+    'top_exercises': 20       # Hardest exercises listed by the report
+}
+
+# Backup and Restore
+# `flask data export` / `flask data import` (see services/backup.py). Memory use is
+# bounded by chunk_size on export and batch_size on import, whatever the table size.
+BACKUP_CONFIG = {
+    'chunk_size': 50000,    # Rows per server-side cursor fetch and per gzip member (the export resume unit)
+    'batch_size': 5000,     # Rows per upsert statement and transaction on import (the import resume unit)
+    'compress_level': 6     # gzip level: 1 is fastest, 9 smallest
+}
+
+# Request Metrics
+# Per-request SQL and latency instrumentation exposed on /metrics (see services/metrics.py)
+METRICS_CONFIG = {
+    'enabled': True,
+    'latency_buckets': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),  # Seconds
+    'query_count_buckets': (1, 2, 5, 10, 20, 50, 100),
+    'n_plus_one_threshold': 10,  # Warn when one statement shape runs more often in a request
+    'slow_statements': 10,       # Distinct slowest statements kept per worker
+    'max_statement_length': 300  # Statement text is truncated to this many characters
+}
+
+# Page Caching
+# Rendered fragments of lesson pages and the learning path, per worker (see services/pagecache.py)
+PAGE_CACHE_CONFIG = {
+    'fragment_cache_bytes': 8 * 1024 * 1024  # Memory cap for cached HTML; least recently used is evicted
+}
+
+# Static Assets
+# `python tools/build_assets.py` concatenates, minifies and fingerprints each bundle
+# into static/dist and writes gzip/brotli copies; templates link them with asset_urls().
+# Paths are relative to static/. Vendor files are downloaded once with --vendor, so
+# no CDN is needed at runtime; until they are, templates fall back to the CDN URLs.
+ASSETS_CONFIG = {
+    'bundles': {
+        'vendor.css': ['vendor/bootstrap/bootstrap.min.css', 'vendor/fontawesome/css/all.min.css'],
+        'app.css': ['css/style.css'],
+        'vendor.js': ['vendor/bootstrap/bootstrap.bundle.min.js'],
+        'app.js': ['js/app.js']
+    },
+    'vendor': {
+        'vendor/bootstrap/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css',
+        'vendor/bootstrap/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js',
+        'vendor/fontawesome/css/all.min.css': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css'
+    },
+    'output_dir': 'dist',          # Under static/, served at /assets
+    'compress_min_bytes': 512,     # Smaller files are not precompressed
+    'max_age': 365 * 24 * 3600     # Fingerprinted files never change, so clients keep them a year
+}
+
+# JSON API
+# Limits for the versioned JSON API under /api/v1 (see routes/api.py)
+API_CONFIG = {
+    'max_batch_size': 50,        # Answers accepted in one batch submission
+    'max_answer_length': 1000    # Longer answers are rejected instead of graded
+}
+
+# Async Serving
+# Settings for asgi.py, which serves the JSON endpoints on an event loop and the
+# rest of the app through Flask in a thread pool
+ASYNC_CONFIG = {
+    'wsgi_threads': 16,              # Threads running Flask views (pages, auth, leaderboards)
+    'max_body_bytes': 1024 * 1024    # Larger request bodies are rejected with 413
+}
+
+# Identity and Sessions
+# The logged-in user is loaded once per request through a per-worker cache of user
+# snapshots (services/identity.py). Set SESSION_BACKEND=sqlite to keep sessions
+# server-side, where `flask sessions revoke` can end them (services/sessions.py).
+IDENTITY_CONFIG = {
+    'user_cache_size': 10000,   # Snapshots kept per worker; the least recently used are evicted
+    'user_cache_ttl': 30        # Seconds a snapshot is trusted (picks up changes made by other workers)
+}
+
+SESSION_CONFIG = {
+    'sqlite_file': 'sessions.db'  # Session store in the instance folder, shared by the workers on a host
+}
+
+# Rate Limiting
+# Token buckets per user and per client IP for the endpoints that write, plus a cap on
+# how many of those requests write at once; over a limit the client gets a 429 with
+# Retry-After (services/ratelimit.py). Buckets live in each worker unless
+# RATE_LIMIT_BACKEND=sqlite shares them (and the write cap) between a host's workers.
+RATE_LIMIT_CONFIG = {
+    'enabled': True,
+    # Endpoint -> {'user' / 'ip': (burst, tokens refilled per second)}; GET requests are never limited
+    'limits': {
+        'lessons.submit_exercise': {'user': (20, 1.0), 'ip': (120, 10.0)},
+        'progress.update_lesson_status': {'user': (10, 0.5), 'ip': (60, 5.0)},
+        'api.submit_answers': {'user': (20, 1.0), 'ip': (120, 10.0)},
+        'auth.login': {'ip': (20, 0.5)},
+        'auth.register': {'ip': (5, 0.05)},
+    },
+    'max_concurrent_writes': 8,      # Limited requests in flight at once (per worker, or per host with sqlite)
+    'write_wait_seconds': 0.25,      # How long a request may wait for a write slot before its 429
+    'busy_retry_after_seconds': 1,   # Retry-After when all write slots are taken
+    'trusted_proxies': 0,            # Proxies in front of the app (1 behind nginx): the client IP is read
+                                     # from X-Forwarded-For, that many hops back
+    'max_buckets': 100000,           # Buckets kept per worker (memory backend); least recently used are dropped
+    'sqlite_file': 'ratelimit.db',   # Shared store in the instance folder (RATE_LIMIT_BACKEND=sqlite)
+    'slot_lease_seconds': 60,        # A shared write slot a crashed worker never gave back expires after this
+    'prune_interval_seconds': 60     # How often a worker deletes idle buckets from the shared store
+}
+
+# Worker Startup
+# Compiled templates are cached on disk, so a new worker loads them instead of running
+# the Jinja compiler. wsgi.py warms the app up before gunicorn forks its workers (--preload).
+STARTUP_CONFIG = {
+    'bytecode_cache_dir': 'jinja_cache',  # In the instance folder; `flask templates compile` fills it
+    'precompile_templates': True,  # Compile every template while warming up, not on first requests
+    'warm_catalog': True,          # Load the lesson catalog while warming up
+    'budget_ms': 500               # tools/bench_startup.py fails if a worker's first response takes longer
+}
+
+# Database Engine
+# Pool settings apply to every engine; pragmas are set on each new SQLite connection.
+# Set DATABASE_REPLICA_URL to serve read-only pages from a replica.
+DATABASE_CONFIG = {
+    'pool_size': 10,              # Connections kept open per worker process
+    'max_overflow': 20,           # Extra connections allowed under bursts
+    'pool_pre_ping': True,        # Test connections before use (survives DB restarts)
+    'pool_recycle': 1800,         # Seconds before a connection is replaced (not SQLite)
+    'read_your_writes_seconds': 10,  # A user who just wrote reads from the primary this long
+    'sqlite_pragmas': {
+        'journal_mode': 'WAL',    # Readers no longer block the writer (and vice versa)
+        'busy_timeout': 30000,    # Milliseconds a writer waits for the lock before failing
+        'synchronous': 'NORMAL',  # Safe with WAL; fsync on checkpoint instead of every commit
+        'mmap_size': 268435456    # 256 MB of the database memory-mapped for reads
+    }
+}
+
+# User-ID Sharding
+# Set DATABASE_SHARD_URLS to spread the per-user tables (progress, attempts, stats, badges,
+# review schedules, daily activity) over more databases; the primary is shard 0. Users
+# are assigned to shards by id range with `flask shards move` (see services/shards.py).
+SHARD_CONFIG = {
+    'map_refresh_seconds': 1,   # How stale a worker's copy of the shard map may get
+    'move_grace_seconds': 3,    # Wait after each map change in a move; must exceed map_refresh_seconds
+    'move_chunk_users': 10000,  # Users moved per step; only these users wait while their rows are copied
+    'copy_batch_size': 5000,    # Rows per INSERT batch while copying to the target shard
+    'retry_after_seconds': 5    # Retry-After sent to users whose writes hit a range being moved
+}
@@ -1,42 +1,50 @@
-from models import db, Lesson, Exercise, User
-import json
+from models import db
 from config import LEARNING_TOPICS, EXERCISE_TEMPLATES
+from services.content import exercise_key, import_content, slugify
 
-def create_dummy_data():
-    """Create dummy lessons and exercises for testing using configuration"""
-    
-    # Create lessons from configuration
-    for topic in LEARNING_TOPICS:
-        lesson_data = {
+def topic_records():
+    """
+    Lesson and exercise records for the content importer, built from configuration
+    Prerequisites and EXERCISE_TEMPLATES keys refer to topics by their 1-based
+    position in LEARNING_TOPICS, not by database ID.
+    """
+    slugs = {number: slugify(topic['title']) for number, topic in enumerate(LEARNING_TOPICS, 1)}
+
+    lessons = [
+        {
+            'slug': slugs[number],
             'title': topic['title'],
             'description': topic['description'],
             'order': topic['order'],
             'xp_reward': topic['xp_reward'],
-            'prerequisites': json.dumps(topic['prerequisites'])
+            'prerequisites': [slugs[prerequisite] for prerequisite in topic['prerequisites']]
         }
-        lesson = Lesson(**lesson_data)
-        db.session.add(lesson)
-    
-    db.session.commit()
-    
-    # Create exercises for each lesson using templates
-    for lesson_id, exercises in EXERCISE_TEMPLATES.items():
-        for i, exercise_template in enumerate(exercises, 1):
-            exercise_data = {
-                'lesson_id': lesson_id,
-                'type': exercise_template['type'],
-                'question': exercise_template['question'],
-                'answer': exercise_template['answer'],
-                'hint': exercise_template['hint'],
-                'order': i
-            }
-            
-            # Add options for multiple choice questions
-            if exercise_template['type'] == 'multiple_choice':
-                exercise_data['options'] = json.dumps(exercise_template['options'])
-            
-            exercise = Exercise(**exercise_data)
-            db.session.add(exercise)
-    
+        for number, topic in enumerate(LEARNING_TOPICS, 1)
+    ]
+
+    exercises = [
+        {
+            'key': exercise_key(slugs[number], i),
+            'lesson': slugs[number],
+            'type': template['type'],
+            'question': template['question'],
+            'answer': template['answer'],
+            'options': template.get('options'),
+            'hint': template['hint'],
+            'order': i,
+            'generator': template.get('generator')
+        }
+        for number, templates in EXERCISE_TEMPLATES.items()
+        for i, template in enumerate(templates, 1)
+    ]
+    return lessons, exercises
+
+def create_dummy_data():
+    """
+    Create (or update) the lessons and exercises defined in configuration
+    Uses the content importer, so running it again does not duplicate rows
+    """
+    lessons, exercises = topic_records()
+    import_content(lessons, exercises)
     db.session.commit()
-    print("Dummy data created successfully from configuration!")
\ No newline at end of file
+    print("Dummy data created successfully from configuration!")
@@ -1,9 +1,19 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 import json
 
-# Initialize SQLAlchemy database instance
-db = SQLAlchemy()
+from services.database import RoutingSession
+
+# Initialize SQLAlchemy database instance (its session can route reads to a replica)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def utcnow():
+    """
+    Current time as naive UTC, the form every DateTime column stores
+    Aware values would be shifted by the session time zone on PostgreSQL and
+    cannot be compared with the naive values read back from SQLite.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 class User(db.Model):
     """
@@ -15,39 +25,36 @@ class User(db.Model):
     password = db.Column(db.String(120), nullable=False)  # Hashed password (not plain text)
     xp = db.Column(db.Integer, default=0)  # Experience points earned from completing lessons
     streak = db.Column(db.Integer, default=0)  # Daily login streak counter
-    last_login = db.Column(db.DateTime, default=datetime.utcnow)  # Track last login for streak calculation
-    badges = db.Column(db.Text, default='[]')  # JSON string storing earned badge names
+    last_login = db.Column(db.DateTime, default=utcnow)  # Track last login for streak calculation
+    badges = db.Column(db.Text, default='[]')  # Legacy JSON badge list; awards now live in user_badge
     
     def __repr__(self):
         return f'<User {self.username}>'
     
     def get_badges(self):
-        """Convert JSON string badges to Python list"""
-        try:
-            return json.loads(self.badges)
-        except:
-            return []  # Return empty list if JSON is invalid
+        """Names of the user's earned badges, in the order they were awarded"""
+        return UserBadge.names(self.id)
     
     def add_badge(self, badge_name):
-        """Add a new badge to user's collection (prevents duplicates)"""
-        badges = self.get_badges()
-        if badge_name not in badges:
-            badges.append(badge_name)
-            self.badges = json.dumps(badges)
+        """Award a badge (no-op if the user already has it)"""
+        from services.dbutil import insert_ignore
+        insert_ignore(db.session, UserBadge, [{'user_id': self.id, 'badge': badge_name}],
+                      ['user_id', 'badge'])
     
     def update_streak(self):
         """
-        Update daily login streak based on last login date
-        - Increments streak if logged in yesterday
-        - Resets to 1 if gap is more than 1 day
+        Update daily login streak based on last login date (UTC calendar days)
+        - Increments streak if the last login was yesterday
+        - Resets to 1 if a day or more was missed (or the streak already decayed)
         - Sets to 1 if first login
+        `flask maintenance run streak-decay` resets the streaks of users who stopped logging in.
         """
-        now = datetime.utcnow()
+        now = utcnow()
         if self.last_login:
-            days_diff = (now - self.last_login).days
+            days_diff = (now.date() - self.last_login.date()).days
             if days_diff == 1:
-                self.streak += 1  # Perfect streak continuation
-            elif days_diff > 1:
+                self.streak = (self.streak or 0) + 1  # Perfect streak continuation
+            elif days_diff > 1 or not self.streak:
                 self.streak = 1   # Streak broken, start over
         else:
             self.streak = 1       # First login
@@ -59,7 +66,13 @@ class Lesson(db.Model):
     Lesson model representing individual calculus lessons
     Each lesson has exercises and can have prerequisites
     """
+    # Content imports upsert on the slug
+    __table_args__ = (
+        db.Index('uq_lesson_slug', 'slug', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    slug = db.Column(db.String(120))  # Stable content key (e.g. "limits"), survives re-imports
     title = db.Column(db.String(200), nullable=False)  # Lesson title (e.g., "Introduction to Limits")
     description = db.Column(db.Text)  # Detailed lesson description
     status = db.Column(db.String(20), default='locked')  # locked, in-progress, completed
@@ -82,7 +95,14 @@ class Exercise(db.Model):
     Exercise model representing individual questions within lessons
     Supports different question types: multiple choice, fill-in-blank, etc.
     """
+    # Content imports upsert on the key; lessons load their exercises in order
+    __table_args__ = (
+        db.Index('uq_exercise_key', 'key', unique=True),
+        db.Index('ix_exercise_lesson_order', 'lesson_id', 'order'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(120))  # Stable content key (e.g. "limits-2"), survives re-imports
     lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), nullable=False)  # Parent lesson
     type = db.Column(db.String(50), nullable=False)  # multiple_choice, fill_blank, drag_drop, graph
     question = db.Column(db.Text, nullable=False)  # The exercise question/prompt
@@ -90,6 +110,7 @@ class Exercise(db.Model):
     options = db.Column(db.Text)  # JSON string for multiple choice options
     hint = db.Column(db.Text)  # Optional hint for students
     order = db.Column(db.Integer, default=0)  # Order within the lesson
+    generator = db.Column(db.String(80))  # Parametric exercises: name in services/variants.py GENERATORS
     
     def __repr__(self):
         return f'<Exercise {self.id}>'
@@ -102,14 +123,207 @@ class Exercise(db.Model):
             return []
 
 class Progress(db.Model):
+    # One row per user and lesson; submissions upsert on this key, which also
+    # serves lookups by user_id. Per-lesson lookups get their own index.
+    __table_args__ = (
+        db.Index('uq_progress_user_lesson', 'user_id', 'lesson_id', unique=True),
+        db.Index('ix_progress_lesson_id', 'lesson_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), nullable=False)
     completed = db.Column(db.Boolean, nullable=False, default=False)
     score = db.Column(db.Float, nullable=False, default=0.0)
     attempts = db.Column(db.Integer, nullable=False, default=0)
-    last_attempt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_attempt = db.Column(db.DateTime, nullable=False, default=utcnow)
     
     def __repr__(self):
         return f'<Progress {self.user_id}-{self.lesson_id}>'
 
+class ContentVersion(db.Model):
+    """
+    Single-row counter bumped whenever lessons or exercises are edited
+    Workers compare it with their cached catalog to know when to reload
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f'<ContentVersion {self.version}>'
+
+class Attempt(db.Model):
+    """
+    Append-only log of every answer submission
+    Kept narrow (integers, a flag and a timestamp) since it grows with every answer
+    """
+    __table_args__ = (
+        db.Index('ix_attempt_user_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id'), nullable=False)
+    correct = db.Column(db.Boolean, nullable=False)
+    latency_ms = db.Column(db.Integer)  # Time from showing the lesson to answering, if known
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f'<Attempt {self.user_id}-{self.exercise_id}>'
+
+class UserStats(db.Model):
+    """
+    Per-user aggregates of the attempt log
+    Updated in the same transaction as each submission so reads are a primary-key lookup
+    """
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_attempts = db.Column(db.Integer, nullable=False, default=0)
+    correct_attempts = db.Column(db.Integer, nullable=False, default=0)
+    completed_lessons = db.Column(db.Integer, nullable=False, default=0)
+    perfect_lessons = db.Column(db.Integer, nullable=False, default=0)  # Completed on the first attempt
+    last_attempt_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<UserStats {self.user_id}>'
+
+class XpEvent(db.Model):
+    """
+    Ledger of XP awards, one row per award
+    Leaderboards tail it by id and sum it by week
+    """
+    __tablename__ = 'xp_event'
+    __table_args__ = (
+        db.Index('ix_xp_event_created_at', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f'<XpEvent {self.user_id} +{self.amount}>'
+
+class UserBadge(db.Model):
+    """
+    One row per badge a user has earned
+    The unique key makes awarding idempotent, even from concurrent requests
+    """
+    __tablename__ = 'user_badge'
+    __table_args__ = (
+        db.Index('uq_user_badge', 'user_id', 'badge', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    badge = db.Column(db.String(80), nullable=False)
+    awarded_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    @classmethod
+    def names(cls, user_id):
+        """Names of a user's earned badges, in the order they were awarded"""
+        return [name for (name,) in db.session.query(cls.badge).filter_by(user_id=user_id).order_by(cls.id)]
+
+    def __repr__(self):
+        return f'<UserBadge {self.user_id} {self.badge}>'
+
+class ExerciseVariant(db.Model):
+    """
+    One pregenerated variant of a parametric exercise, keyed by (generator, seed)
+    Filled by `flask variants generate`; workers keep the pools in their catalog snapshot
+    """
+    __tablename__ = 'exercise_variant'
+
+    generator = db.Column(db.String(80), primary_key=True)
+    seed = db.Column(db.Integer, primary_key=True)
+    question = db.Column(db.Text, nullable=False)
+    answer = db.Column(db.Text, nullable=False)
+    options = db.Column(db.Text)  # JSON list for multiple choice
+    hint = db.Column(db.Text)  # Overrides the exercise hint when the numbers appear in it
+
+    def __repr__(self):
+        return f'<ExerciseVariant {self.generator}:{self.seed}>'
+
+class ReviewItem(db.Model):
+    """
+    Spaced-repetition schedule of one exercise for one user (SM-2)
+    Updated with every graded answer; ix_review_item_due makes "the next K items due
+    for a user" an index range scan
+    """
+    __tablename__ = 'review_item'
+    __table_args__ = (
+        db.Index('ix_review_item_due', 'user_id', 'next_due'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id'), primary_key=True)
+    ease = db.Column(db.Float, nullable=False, default=2.5)  # SM-2 easiness factor
+    interval_days = db.Column(db.Integer, nullable=False, default=0)
+    repetitions = db.Column(db.Integer, nullable=False, default=0)  # Correct reviews in a row
+    lapses = db.Column(db.Integer, nullable=False, default=0)  # Times it was forgotten
+    last_reviewed_at = db.Column(db.DateTime, nullable=False)
+    next_due = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<ReviewItem {self.user_id}-{self.exercise_id}>'
+
+class DailyActivity(db.Model):
+    """
+    Per-user activity for one UTC day, rolled up from the attempt log and the XP ledger
+    Filled incrementally by `flask maintenance run activity-rollup`
+    """
+    __tablename__ = 'daily_activity'
+
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    correct_attempts = db.Column(db.Integer, nullable=False, default=0)
+    xp_earned = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DailyActivity {self.day} {self.user_id}>'
+
+class MaintenanceCheckpoint(db.Model):
+    """Progress of a maintenance job, committed with each chunk so an interrupted run resumes"""
+    __tablename__ = 'maintenance_checkpoint'
+
+    job = db.Column(db.String(80), primary_key=True)
+    run_key = db.Column(db.String(40), nullable=False)  # e.g. the day a daily job is running for
+    position = db.Column(db.Integer, nullable=False, default=0)  # Last id processed
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f'<MaintenanceCheckpoint {self.job} {self.position}>'
+
+class SchemaMigration(db.Model):
+    """
+    Migrations from services/schema.py that have been applied to this database
+    """
+    __tablename__ = 'schema_migration'
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f'<SchemaMigration {self.version}>'
+
+class ShardRange(db.Model):
+    """
+    A range of user ids whose per-user rows are not on shard 0 (see services/shards.py)
+    Ranges never overlap; `flask shards move` rewrites them as it moves users.
+    """
+    __tablename__ = 'shard_range'
+
+    first_user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_user_id = db.Column(db.Integer, nullable=False)
+    shard = db.Column(db.Integer, nullable=False)  # Where reads (and writes, unless moving) go
+    moving_to = db.Column(db.Integer)  # Set while the rows are copied there; writes are refused meanwhile
+    moved_from = db.Column(db.Integer)  # Shard still holding a stale copy, deleted after the move
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f'<ShardRange {self.first_user_id}-{self.last_user_id} on {self.shard}>'
@@ -0,0 +1,256 @@
+"""
+Versioned JSON API (mounted at /api/v1)
+A client loads a whole lesson with its exercises in one request and submits all
+of its answers for the lesson in one batch, which is graded and written in a
+single transaction. Answers are never included in lesson payloads.
+"""
+
+from flask import Blueprint, jsonify, request, session
+from config import API_CONFIG, REVIEW_CONFIG
+from models import Progress, User, db
+from routes.lessons import MAX_ANSWER_SECONDS
+from services.badges import on_completion
+from services.catalog import get_catalog
+from services.database import read_only
+from services.grading import grade
+from services.identity import current_user
+from services.prerequisites import LOCKED
+from services.reviews import due_reviews
+from services.submissions import record_submissions
+from services.variants import VARIANTS_KEY, answered_exercise, remember_served, serve_exercises
+
+api_bp = Blueprint('api', __name__)
+
+
+def exercise_json(exercise):
+    return {
+        'id': exercise.id,
+        'type': exercise.type,
+        'question': exercise.question,
+        'options': list(exercise.options),
+        'order': exercise.order
+    }
+
+
+def progress_json(progress):
+    if progress is None:
+        return None
+    return {
+        'completed': bool(progress.completed),
+        'score': progress.score,
+        'attempts': progress.attempts or 0,
+        'last_attempt': progress.last_attempt.isoformat() if progress.last_attempt else None
+    }
+
+
+def lesson_summary_json(lesson, state):
+    return {
+        'id': lesson.id,
+        'title': lesson.title,
+        'description': lesson.description,
+        'order': lesson.order,
+        'xp_reward': lesson.xp_reward,
+        'prerequisites': list(lesson.prerequisites),
+        'exercise_count': len(lesson.exercises),
+        'state': state
+    }
+
+
+def lesson_json(lesson, progress, exercises=None):
+    """exercises: the lesson's exercises as served (variants applied), default as stored"""
+    exercises = lesson.exercises if exercises is None else exercises
+    return {
+        'id': lesson.id,
+        'title': lesson.title,
+        'description': lesson.description,
+        'order': lesson.order,
+        'xp_reward': lesson.xp_reward,
+        'prerequisites': list(lesson.prerequisites),
+        'exercises': [exercise_json(exercise) for exercise in exercises],
+        'progress': progress_json(progress)
+    }
+
+
+def review_json(item, exercise):
+    return {
+        'lesson_id': exercise.lesson_id,
+        'exercise': exercise_json(exercise),
+        'due': item.next_due.isoformat(),
+        'interval_days': item.interval_days,
+        'repetitions': item.repetitions,
+        'lapses': item.lapses
+    }
+
+
+def submission_json(graded, result, total_xp, completed, new_badges):
+    """Response body for a graded batch; graded is a list of (exercise, correct, latency_ms)"""
+    return {
+        'results': [{
+            'exercise_id': exercise.id,
+            'correct': correct,
+            'hint': None if correct else exercise.hint
+        } for exercise, correct, _ in graded],
+        'correct_count': sum(1 for _, correct, _ in graded if correct),
+        'completed': bool(completed),
+        'xp_earned': result.xp_earned,
+        'total_xp': total_xp,
+        'new_badges': new_badges
+    }
+
+
+def parse_answers(payload, lesson, catalog, served):
+    """
+    Validate a batch submission body against the lesson
+    served: the session's {exercise id: seed} of parametric variants shown
+    Returns (answers, error): answers is a list of (exercise, answer, latency_ms),
+    each exercise being the variant that was served
+    """
+    items = payload.get('answers') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, 'Body must be a JSON object with a non-empty "answers" list'
+    if len(items) > API_CONFIG['max_batch_size']:
+        return None, f"At most {API_CONFIG['max_batch_size']} answers per request"
+
+    exercises = {exercise.id: exercise for exercise in lesson.exercises}
+    answers = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            return None, f'answers[{index}] must be an object'
+        exercise_id = item.get('exercise_id')
+        if not isinstance(exercise_id, int) or isinstance(exercise_id, bool):
+            return None, f'answers[{index}].exercise_id must be an integer'
+        exercise = exercises.get(exercise_id)
+        if exercise is None:
+            return None, f'answers[{index}].exercise_id is not an exercise of this lesson'
+        exercise = answered_exercise(catalog, exercise, served)
+        if exercise is None:
+            return None, f'answers[{index}]: this exercise has new numbers, load the lesson again'
+        answer = item.get('answer')
+        if not isinstance(answer, (str, int, float)) or isinstance(answer, bool) or not str(answer).strip():
+            return None, f'answers[{index}].answer must be a non-empty string or number'
+        if len(str(answer)) > API_CONFIG['max_answer_length']:
+            return None, f'answers[{index}].answer is too long'
+        latency_ms = item.get('latency_ms')
+        if not isinstance(latency_ms, int) or isinstance(latency_ms, bool) \
+                or not 0 <= latency_ms <= MAX_ANSWER_SECONDS * 1000:
+            latency_ms = None  # Missing or implausible latencies are logged as unknown
+        answers.append((exercise, str(answer), latency_ms))
+    return answers, None
+
+
+def serve_lesson(catalog, lesson, user_id, progress):
+    """
+    (exercises as served, session variants value) for a logged-in user's lesson read
+    The session value is None when it does not change (guests, no parametric exercises).
+    """
+    exercises, issued = serve_exercises(catalog, lesson.exercises, user_id or 0,
+                                        progress.attempts or 0 if progress else 0)
+    return exercises, remember_served(issued) if issued and user_id else None
+
+
+def grade_answers(answers):
+    """[(exercise, answer, latency_ms)] -> [(exercise, correct, latency_ms)]"""
+    return [(exercise, grade(exercise, answer), latency_ms) for exercise, answer, latency_ms in answers]
+
+
+@api_bp.route('/lessons')
+@read_only
+def lessons():
+    """All lessons in path order with the current user's unlock state"""
+    catalog = get_catalog()
+    if 'user_id' in session:
+        completed_ids = {lesson_id for (lesson_id,) in db.session.query(Progress.lesson_id).filter_by(
+            user_id=session['user_id'], completed=True)}
+        states = catalog.graph.node_states(completed_ids)
+    else:
+        states = dict.fromkeys(catalog.lessons_by_id, LOCKED)
+
+    return jsonify({'lessons': [lesson_summary_json(lesson, states[lesson.id]) for lesson in catalog.lessons]})
+
+
+@api_bp.route('/lessons/<int:lesson_id>')
+@read_only
+def lesson(lesson_id):
+    """A lesson with all of its exercises and the current user's progress, in one response"""
+    catalog = get_catalog()
+    lesson = catalog.get_lesson(lesson_id)
+    if lesson is None:
+        return jsonify({'error': 'Lesson not found'}), 404
+
+    progress = None
+    if 'user_id' in session:
+        progress = Progress.query.filter_by(user_id=session['user_id'], lesson_id=lesson_id).first()
+
+    exercises, served = serve_lesson(catalog, lesson, session.get('user_id'), progress)
+    if served is not None:
+        session[VARIANTS_KEY] = served
+    return jsonify(lesson_json(lesson, progress, exercises))
+
+
+@api_bp.route('/lessons/<int:lesson_id>/submissions', methods=['POST'])
+def submit_answers(lesson_id):
+    """
+    Grade a batch of answers for one lesson and record them in one transaction
+    Body: {"answers": [{"exercise_id": 1, "answer": "2x", "latency_ms": 5300}, ...]}
+    The batch is rejected as a whole (400) if any item is invalid.
+    """
+    user = current_user()
+    if not user:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    catalog = get_catalog()
+    lesson = catalog.get_lesson(lesson_id)
+    if lesson is None:
+        return jsonify({'error': 'Lesson not found'}), 404
+
+    answers, error = parse_answers(request.get_json(silent=True), lesson, catalog, session.get(VARIANTS_KEY))
+    if error:
+        return jsonify({'error': error}), 400
+
+    user_id = user.id
+    graded = grade_answers(answers)
+
+    # Attempts, progress, XP and stats for the whole batch are written together
+    result = record_submissions(user_id, lesson, [
+        (exercise.id, correct, latency_ms) for exercise, correct, latency_ms in graded
+    ])
+    new_badges = on_completion(user_id, result)
+    db.session.commit()
+
+    total_xp = db.session.query(User.xp).filter_by(id=user_id).scalar()
+    completed = result.first_completion or db.session.query(Progress.completed).filter_by(
+        user_id=user_id, lesson_id=lesson_id).scalar()
+
+    return jsonify(submission_json(graded, result, total_xp, completed, new_badges))
+
+
+@api_bp.route('/reviews/due')
+@read_only
+def reviews_due():
+    """
+    The current user's most overdue exercises, oldest first
+    ?limit= caps the count (REVIEW_CONFIG default_limit / max_limit). Answers go
+    through the lesson's submissions endpoint, which reschedules them.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    limit = request.args.get('limit', REVIEW_CONFIG['default_limit'], type=int)
+    if limit < 1:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+
+    catalog = get_catalog()
+    user_id = session['user_id']
+    reviews, issued = [], {}
+    for item in due_reviews(user_id, min(limit, REVIEW_CONFIG['max_limit'])):
+        exercise = catalog.get_exercise(item.exercise_id)
+        if exercise is None:
+            continue  # The exercise was removed; `flask reviews rebuild` deletes the row
+        # Every review of a parametric exercise brings new numbers
+        (exercise,), served = serve_exercises(catalog, [exercise], user_id, item.repetitions + item.lapses)
+        issued.update(served)
+        reviews.append(review_json(item, exercise))
+
+    if issued:
+        session[VARIANTS_KEY] = remember_served(issued)
+    return jsonify({'reviews': reviews})
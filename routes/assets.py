@@ -0,0 +1,19 @@
+import os
+
+from flask import Blueprint, abort
+from werkzeug.security import safe_join
+
+from services.assets import ENCODINGS, MANIFEST, output_dir, send_asset
+
+assets_bp = Blueprint('assets', __name__)
+
+
+@assets_bp.route('/<path:filename>')
+def asset(filename):
+    """Serve a fingerprinted file from static/dist (see tools/build_assets.py)"""
+    path = safe_join(output_dir(), filename)
+    if path is None or filename == MANIFEST or filename.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+    return send_asset(path)
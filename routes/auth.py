@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
 from models import User, db
+from services.badges import on_login
 from werkzeug.security import generate_password_hash, check_password_hash
 
 auth_bp = Blueprint('auth', __name__)
@@ -15,8 +16,11 @@ def login():
         if user and check_password_hash(user.password, password):
             session['user_id'] = user.id
             user.update_streak()
+            new_badges = on_login(user)
             db.session.commit()
             flash('Welcome back! 🔥', 'success')
+            for badge in new_badges:
+                flash(f'New badge unlocked: {badge} 🏆', 'success')
             return redirect(url_for('learning_path'))
         else:
             flash('Invalid username or password', 'error')
@@ -0,0 +1,49 @@
+from flask import Blueprint, jsonify, request, session
+from config import LEADERBOARD_CONFIG
+from models import User, db
+from services.leaderboard import get_leaderboard
+
+leaderboard_bp = Blueprint('leaderboard', __name__)
+
+BOARDS = ('global', 'weekly')
+
+def _limit(name, default, maximum):
+    """Read a positive integer query parameter, clamped to a maximum"""
+    value = request.args.get(name, default, type=int)
+    return max(1, min(value, maximum))
+
+def _serialize(entries):
+    """Attach usernames (one query for the whole page) to (rank, user_id, xp) tuples"""
+    user_ids = [user_id for _, user_id, _ in entries]
+    names = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids))) if user_ids else {}
+    return [
+        {'rank': rank, 'user_id': user_id, 'username': names.get(user_id), 'xp': xp}
+        for rank, user_id, xp in entries
+    ]
+
+@leaderboard_bp.route('/<board>')
+def top(board):
+    """Top users of the global or weekly leaderboard"""
+    if board not in BOARDS:
+        return jsonify({'error': 'Unknown leaderboard'}), 404
+    
+    limit = _limit('limit', LEADERBOARD_CONFIG['default_limit'], LEADERBOARD_CONFIG['max_limit'])
+    entries = get_leaderboard().top(board, limit)
+    return jsonify({'board': board, 'entries': _serialize(entries)})
+
+@leaderboard_bp.route('/<board>/me')
+def my_standing(board):
+    """Current user's rank and the users around them"""
+    if board not in BOARDS:
+        return jsonify({'error': 'Unknown leaderboard'}), 404
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    user_id = session['user_id']
+    xp = db.session.query(User.xp).filter_by(id=user_id).scalar()
+    if xp is None:
+        return jsonify({'error': 'User not found'}), 404
+    
+    radius = _limit('radius', LEADERBOARD_CONFIG['default_radius'], LEADERBOARD_CONFIG['max_radius'])
+    rank, entries = get_leaderboard().standing(board, user_id, xp, radius)
+    return jsonify({'board': board, 'rank': rank, 'entries': _serialize(entries)})
@@ -1,14 +1,26 @@
-from flask import Blueprint, render_template, request, session, redirect, url_for, flash
-from models import Lesson, Exercise, Progress, User, db
-from datetime import datetime, timezone
+from flask import Blueprint, render_template, request, session, redirect, url_for, flash, abort
+from models import Progress, db
+from services.catalog import get_catalog
+from services.grading import grade
+from services.identity import current_user
+from services.pagecache import conditional_page, page_validators, render_fragment
+from services.badges import on_completion
+from services.submissions import record_submission
+from services.variants import VARIANTS_KEY, answered_exercise, remember_served, serve_exercises
+import time
 
 lessons_bp = Blueprint('lessons', __name__)
 
+# Answers slower than this are logged without a latency (the learner walked away)
+MAX_ANSWER_SECONDS = 60 * 60
+
 @lessons_bp.route('/<int:lesson_id>')
 def lesson_detail(lesson_id):
     """Display a specific lesson with its exercises"""
-    lesson = Lesson.query.get_or_404(lesson_id)
-    exercises = Exercise.query.filter_by(lesson_id=lesson_id).order_by(Exercise.order).all()
+    catalog = get_catalog()
+    lesson = catalog.get_lesson(lesson_id)
+    if lesson is None:
+        abort(404)
     
     # Get user progress for this lesson
     user_progress = None
@@ -17,72 +29,95 @@ def lesson_detail(lesson_id):
             user_id=session['user_id'], 
             lesson_id=lesson_id
         ).first()
+        # Start the answer timer used for attempt latency
+        session['lesson_started'] = [lesson_id, time.time()]
+
+    # Parametric exercises show a pregenerated variant that changes with every attempt
+    exercises, issued = serve_exercises(catalog, lesson.exercises, session.get('user_id', 0),
+                                        user_progress.attempts or 0 if user_progress else 0)
+    if issued and 'user_id' in session:
+        session[VARIANTS_KEY] = remember_served(issued)
     
-    return render_template('lessons/lesson_detail.html', 
-                         lesson=lesson, 
-                         exercises=exercises,
-                         user_progress=user_progress)
+    def render():
+        # The exercise list only depends on content and the variants shown, so it is rendered once per combination
+        exercises_html = render_fragment('lessons/_exercises.html', (catalog.version, lesson.id, *issued.values()),
+                                         lesson=lesson, exercises=exercises)
+        return render_template('lessons/lesson_detail.html', 
+                             lesson=lesson, 
+                             exercises=exercises,
+                             exercises_html=exercises_html,
+                             user_progress=user_progress)
+    
+    # 304 when neither the lesson nor this user's progress on it changed since the client's copy
+    validators = page_validators(catalog, f'lesson-{lesson_id}', [user_progress] if user_progress else ())
+    return conditional_page(validators, render)
 
 @lessons_bp.route('/<int:lesson_id>/exercise/<int:exercise_id>')
 def exercise_detail(lesson_id, exercise_id):
     """Display a specific exercise"""
-    lesson = Lesson.query.get_or_404(lesson_id)
-    exercise = Exercise.query.get_or_404(exercise_id)
+    catalog = get_catalog()
+    lesson = catalog.get_lesson(lesson_id)
+    exercise = catalog.get_exercise(exercise_id)
+    if lesson is None or exercise is None or exercise.lesson_id != lesson.id:
+        abort(404)
     
     return render_template('lessons/exercise_detail.html', 
                          lesson=lesson, 
                          exercise=exercise)
 
+def answer_latency_ms(lesson_id):
+    """Milliseconds since this lesson page was shown, or None if unknown or implausible"""
+    started = session.get('lesson_started')
+    if not started or started[0] != lesson_id:
+        return None
+    elapsed = time.time() - started[1]
+    if not 0 <= elapsed <= MAX_ANSWER_SECONDS:
+        return None
+    return int(elapsed * 1000)
+
 @lessons_bp.route('/<int:lesson_id>/submit', methods=['POST'])
 def submit_exercise(lesson_id):
     """Submit an exercise answer and get feedback"""
-    if 'user_id' not in session:
+    user = current_user()
+    if not user:
         flash('Please log in to submit answers', 'error')
         return redirect(url_for('auth.login'))
     
-    exercise_id = request.form.get('exercise_id')
+    exercise_id = request.form.get('exercise_id', type=int)
     user_answer = request.form.get('answer')
     
     if not exercise_id or not user_answer:
         flash('Please provide an answer', 'error')
         return redirect(url_for('lessons.lesson_detail', lesson_id=lesson_id)) # Might need to change this cause we getting an error when we submit an answer. Redirect error. CD out and then into the current directory
     
-    exercise = Exercise.query.get_or_404(exercise_id)
-    lesson = Lesson.query.get_or_404(lesson_id)
-    user_id = session['user_id']
-    
-    # Check if answer is correct
-    is_correct = str(user_answer).strip().lower() == str(exercise.answer).strip().lower()
+    catalog = get_catalog()
+    exercise = catalog.get_exercise(exercise_id)
+    lesson = catalog.get_lesson(lesson_id)
+    if lesson is None or exercise is None or exercise.lesson_id != lesson.id:
+        abort(404)
+    user_id = user.id
+
+    # Grade against the variant this session was shown
+    exercise = answered_exercise(catalog, exercise, session.get(VARIANTS_KEY))
+    if exercise is None:
+        flash('This exercise has new numbers now. Please answer the version shown below.', 'warning')
+        return redirect(url_for('lessons.lesson_detail', lesson_id=lesson_id))
     
-    # Update or create progress record
-    progress = Progress.query.filter_by(
-        user_id=user_id, 
-        lesson_id=lesson_id
-    ).first()
+    # Check if answer is correct (math-aware, so '10x' and 'x*10' are equivalent)
+    is_correct = grade(exercise, user_answer)
     
-    if not progress:
-        progress = Progress(user_id=user_id, lesson_id=lesson_id)
-        db.session.add(progress)
-
-    # Ensure numeric fields are initialized to avoid TypeError when None
-    progress.attempts = (progress.attempts or 0) + 1
-    # Use timezone-aware UTC datetime
-    progress.last_attempt = datetime.now(timezone.utc)
-
-    if is_correct:
-        # Ensure score is not None before comparing
-        current_score = float(progress.score or 0.0)
-        progress.score = max(current_score, 1.0)  # Full points for correct answer
-        progress.completed = True
-
-        # Award XP to user
-        user = User.query.get(user_id)
-        if user is not None:
-            user.xp = (user.xp or 0) + lesson.xp_reward
+    # Log the attempt, upsert progress and award XP in the database (only on the first completion)
+    result = record_submission(user_id, lesson, exercise, is_correct, answer_latency_ms(lesson_id))
+    new_badges = on_completion(user_id, result)
 
-        flash(f'Great job! 🎉 You earned {lesson.xp_reward} XP!', 'success')
+    if result.xp_earned:
+        flash(f'Great job! 🎉 You earned {result.xp_earned} XP!', 'success')
+    elif is_correct:
+        flash('Correct! 🎉 You already earned the XP for this lesson.', 'success')
     else:
         flash(f'Not quite right. {exercise.hint or "Try again!"}', 'warning')
+    for badge in new_badges:
+        flash(f'New badge unlocked: {badge} 🏆', 'success')
 
     # Commit all changes (progress, user XP, etc.) together
     db.session.commit()
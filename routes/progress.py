@@ -1,63 +1,62 @@
 from flask import Blueprint, jsonify, session
-from models import Progress, User, db
+from models import User, UserBadge, db
+from services.badges import on_completion
+from services.catalog import get_catalog
+from services.database import read_only
+from services.identity import current_user
+from services.stats import get_user_stats
+from services.submissions import complete_lesson
 
 progress_bp = Blueprint('progress', __name__)
 
+def stats_json(user, stats, badges):
+    return {
+        'xp': user.xp,
+        'streak': user.streak,
+        'badges': badges,
+        'completed_lessons': stats.completed_lessons,
+        'total_attempts': stats.total_attempts,
+        'correct_attempts': stats.correct_attempts
+    }
+
 @progress_bp.route('/user-stats')
+@read_only
 def user_stats():
     """Get current user's progress statistics"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
-    user_id = session['user_id']
-    user = User.query.get(user_id)
-    
+    user = current_user()
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    # Get progress statistics
-    completed_lessons = Progress.query.filter_by(user_id=user_id, completed=True).count()
-    total_attempts = db.session.query(db.func.sum(Progress.attempts)).filter_by(user_id=user_id).scalar() or 0
+    # Get progress statistics (one primary-key lookup on the summary row)
+    stats = get_user_stats(user.id)
     
-    return jsonify({
-        'xp': user.xp,
-        'streak': user.streak,
-        'badges': user.get_badges(),
-        'completed_lessons': completed_lessons,
-        'total_attempts': total_attempts
-    })
+    return jsonify(stats_json(user, stats, UserBadge.names(user.id)))
 
 @progress_bp.route('/update-lesson-status/<int:lesson_id>', methods=['POST'])
 def update_lesson_status(lesson_id):
     """Update lesson completion status"""
-    if 'user_id' not in session:
+    user = current_user()
+    if not user:
         return jsonify({'error': 'Not logged in'}), 401
     
-    user_id = session['user_id']
-    
-    # Get or create progress record
-    progress = Progress.query.filter_by(
-        user_id=user_id, 
-        lesson_id=lesson_id
-    ).first()
-    
-    if not progress:
-        progress = Progress(user_id=user_id, lesson_id=lesson_id)
-        db.session.add(progress)
-    
-    progress.completed = True
-    progress.score = 1.0
-    
-    # Award XP
-    from models import Lesson
-    lesson = Lesson.query.get(lesson_id)
-    user = User.query.get(user_id)
-    user.xp += lesson.xp_reward
+    user_id = user.id
+    lesson = get_catalog().get_lesson(lesson_id)
+    if lesson is None:
+        return jsonify({'error': 'Lesson not found'}), 404
     
+    # Upsert progress and award XP in the database (only on the first completion)
+    result = complete_lesson(user_id, lesson)
+    new_badges = on_completion(user_id, result)
     db.session.commit()
     
+    total_xp = db.session.query(User.xp).filter_by(id=user_id).scalar()
+    
     return jsonify({
         'success': True,
-        'xp_earned': lesson.xp_reward,
-        'total_xp': user.xp
+        'xp_earned': result.xp_earned,
+        'total_xp': total_xp,
+        'new_badges': new_badges
     })
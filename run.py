@@ -1,31 +1,20 @@
 #!/usr/bin/env python3
 """
 Calcuingo - Duolingo-style Calculus Learning App
-Startup script to run the Flask application - USE THIS TO RUN THE APP
+Startup script to run the Flask development server - USE THIS TO RUN THE APP
+The database is not checked here; set it up once with `flask --app app db setup`.
+For production use gunicorn with wsgi.py (see DEPLOYMENT.md).
 """
 
-import os
-import sys
-from app import app, db
+from app import create_app
 
 def main():
     """Main function to start the Calcuingo app"""
     print("Starting Calcuingo - Duolingo-style Calculus Learning App")
     print("=" * 60)
     
-    # Create database tables
-    with app.app_context():
-        db.create_all()
-        print("Database initialized")
-        
-        # Create dummy data if no lessons exist
-        from models import Lesson
-        if Lesson.query.count() == 0:
-            from dummy_data import create_dummy_data
-            create_dummy_data()
-            print("Dummy data created")
-        else:
-            print("Database already has data")
+    app = create_app()
+    print("First run? Create the database with: flask --app app db setup")
     
     print("\nStarting Flask development server...")
     print("Open your browser to: http://localhost:5000")
@@ -37,4 +26,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,420 @@
+"""
+Analytics export and reports
+`flask analytics export DIR` streams the attempt log, progress and the lesson and
+exercise tables out through a server-side cursor, one chunk at a time, into one
+NumPy .npy file per column. It reads from the replica when one is configured, so
+analysis never competes with live traffic on the primary, and memory stays at one
+chunk whatever the table size. On a sharded database the per-user tables are read
+from each shard in turn, range by range, so attempts stay grouped by user.
+
+`flask analytics report DIR` works from those files alone. They are memory-mapped
+and aggregated with vectorized NumPy (bincount, stable sorts, reduceat) in slices
+of whole users:
+
+    difficulty  per exercise: attempts, success rate, first-try success, mean latency
+    funnel      per lesson in path order: learners who started and completed it,
+                drop-off from the previous lesson and attempts to completion
+"""
+
+import json
+import os
+import shutil
+import struct
+import time
+from contextlib import ExitStack
+
+import click
+import numpy as np
+from flask.cli import AppGroup
+from sqlalchemy import Integer, String, cast, func, select
+
+from config import ANALYTICS_CONFIG
+from models import Attempt, Exercise, Lesson, Progress, db, utcnow
+from services.database import REPLICA, SHARDED_TABLES, shard_count, shard_key, user_shards
+
+analytics_cli = AppGroup('analytics', help='Export columnar data and compute learning reports.')
+
+# Exported tables: name -> (ORDER BY, [(column, dtype, SQL expression)])
+# Attempts are exported grouped by user (the ix_attempt_user_id order) so the
+# report can cut them into slices of whole users. Flags and timestamps are
+# selected as plain integers and text, which skips SQLAlchemy's per-row type
+# conversion; NumPy parses them a chunk at a time instead.
+EXPORTS = {
+    'lesson': ((Lesson.id,), [
+        ('id', '<i4', Lesson.id),
+        ('order', '<i4', Lesson.order),
+    ]),
+    'exercise': ((Exercise.id,), [
+        ('id', '<i4', Exercise.id),
+        ('lesson_id', '<i4', Exercise.lesson_id),
+        ('order', '<i4', Exercise.order),
+    ]),
+    'progress': ((Progress.id,), [
+        ('user_id', '<i4', Progress.user_id),
+        ('lesson_id', '<i4', Progress.lesson_id),
+        ('completed', '?', cast(Progress.completed, Integer)),
+        ('attempts', '<i4', Progress.attempts),
+    ]),
+    'attempt': ((Attempt.user_id, Attempt.id), [
+        ('id', '<i8', Attempt.id),
+        ('user_id', '<i4', Attempt.user_id),
+        ('exercise_id', '<i4', Attempt.exercise_id),
+        ('correct', '?', cast(Attempt.correct, Integer)),
+        ('latency_ms', '<i4', func.coalesce(Attempt.latency_ms, -1)),  # -1: not measured
+        ('created_at', '<M8[us]', cast(Attempt.created_at, String)),
+    ]),
+}
+
+MANIFEST = 'manifest.json'
+
+MAX_USER_ID = 2 ** 31 - 1
+
+
+class ColumnWriter:
+    """
+    A .npy file written one chunk at a time
+    The header is written with room to spare and rewritten with the final length
+    on close, so the data streams straight to disk and np.load can memory-map it.
+    """
+    HEADER_BYTES = 128  # Magic, version, length and the padded header dict; a multiple of 64
+
+    def __init__(self, path, dtype):
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.file = open(path, 'wb')
+        self.file.write(self._header())
+
+    def _header(self):
+        header = repr({'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False,
+                       'shape': (self.length,)})
+        header = header.ljust(self.HEADER_BYTES - 11) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        self.file.write(values.tobytes())
+        self.length += len(values)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(self._header())
+        self.file.close()
+
+
+def source_engine(primary=False):
+    """The replica engine when one is configured (and not overridden), else the primary"""
+    if not primary and REPLICA in db.engines:
+        return REPLICA, db.engines[REPLICA]
+    return 'primary', db.engine
+
+
+def export_table(sources, directory, name, chunk_size):
+    """
+    Stream one table into directory/name/<column>.npy; returns the row count
+    sources: [(connection, WHERE condition or None)], read one after the other
+    """
+    order_by, columns = EXPORTS[name]
+    dtype = np.dtype([(column, column_dtype) for column, column_dtype, _ in columns])
+    os.makedirs(os.path.join(directory, name))
+    writers = {column: ColumnWriter(os.path.join(directory, name, f'{column}.npy'), dtype[column])
+               for column in dtype.names}
+
+    # stream_results: a server-side cursor where the driver has one (psycopg2), so
+    # the table is never buffered in full on either side
+    for connection, condition in sources:
+        query = select(*(expression for _, _, expression in columns)).order_by(*order_by)
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            query if condition is None else query.where(condition))
+        for rows in result.partitions():
+            chunk = np.array([tuple(row) for row in rows], dtype=dtype)
+            for column, writer in writers.items():
+                writer.append(chunk[column])
+
+    for writer in writers.values():
+        writer.close()
+    return writers[dtype.names[0]].length
+
+
+def export(directory, chunk_size, primary=False):
+    """
+    Write every table of EXPORTS and a manifest to `directory`; returns the manifest
+    The files are built in a sibling .partial directory and renamed into place, so
+    a reader never sees a half-written export.
+    """
+    partial = directory.rstrip(os.sep) + '.partial'
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+
+    source, engine = source_engine(primary)
+    manifest = {'exported_at': utcnow().isoformat(timespec='seconds'), 'source': source, 'tables': {}}
+    with ExitStack() as stack:
+        def open_connection(engine):
+            connection = stack.enter_context(engine.connect())
+            if engine.dialect.name == 'postgresql':
+                # One snapshot for all tables: no attempt without its exercise
+                connection = connection.execution_options(isolation_level='REPEATABLE READ')
+            stack.enter_context(connection.begin())
+            return connection
+
+        connection = open_connection(engine)
+        shards = {0: connection}
+        for name, (_, columns) in EXPORTS.items():
+            sources = [(connection, None)]
+            if name in SHARDED_TABLES and shard_count() > 1:
+                user_id = db.metadata.tables[name].c.user_id
+                sources = []
+                for shard, first, last in user_shards(0, MAX_USER_ID):
+                    if shard not in shards:
+                        shards[shard] = open_connection(db.engines[shard_key(shard)])
+                    sources.append((shards[shard], user_id.between(first, last)))
+            manifest['tables'][name] = {
+                'rows': export_table(sources, partial, name, chunk_size),
+                'columns': {column: np.dtype(column_dtype).str for column, column_dtype, _ in columns}
+            }
+        # Labels for the reports; small enough for the manifest
+        manifest['lessons'] = {str(lesson_id): title for lesson_id, title in
+                               connection.execute(select(Lesson.id, Lesson.title))}
+        manifest['exercises'] = {str(exercise_id): key or f'exercise {exercise_id}' for exercise_id, key in
+                                 connection.execute(select(Exercise.id, Exercise.key))}
+
+    with open(os.path.join(partial, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(partial, directory)
+    return manifest
+
+
+def load_export(directory):
+    """(manifest, {table: {column: memory-mapped array}}) of an export"""
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    tables = {
+        name: {column: np.load(os.path.join(directory, name, f'{column}.npy'), mmap_mode='r')
+               for column in table['columns']}
+        for name, table in manifest['tables'].items()
+    }
+    return manifest, tables
+
+
+def lookup(sorted_ids, ids):
+    """Position of each id in `sorted_ids`, -1 for ids that are not there"""
+    positions = np.searchsorted(sorted_ids, ids)
+    positions[positions == len(sorted_ids)] = 0
+    found = len(sorted_ids) > 0 and sorted_ids[positions] == ids
+    return np.where(found, positions, -1)
+
+
+def row_slices(count, size):
+    for start in range(0, count, size):
+        yield start, min(start + size, count)
+
+
+def user_slices(user_ids, size):
+    """(start, end) row ranges of about `size` rows that never split a user's rows"""
+    start = 0
+    while start < len(user_ids):
+        end = start + size
+        if end >= len(user_ids):
+            end = len(user_ids)
+        else:
+            # Back up to the first row of the user at the cut (or, for a user with
+            # more than `size` rows, move past all of them)
+            boundary = int(np.searchsorted(user_ids, user_ids[end], 'left'))
+            end = boundary if boundary > start else int(np.searchsorted(user_ids, user_ids[end], 'right'))
+        yield start, end
+        start = end
+
+
+def first_success(keys, correct):
+    """
+    For each distinct key: how many rows it took to get a correct one, in row order
+    Returns (keys, attempts) with attempts 0 for keys never answered correctly.
+    """
+    if not len(keys):
+        return keys, np.zeros(0, dtype=np.int64)
+    order = np.argsort(keys, kind='stable')  # Stable: rows keep their (chronological) order within a key
+    keys, correct = keys[order], correct[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    position = np.arange(len(keys)) - np.repeat(starts, np.diff(np.r_[starts, len(keys)]))
+    never = len(keys)
+    first = np.minimum.reduceat(np.where(correct, position, never), starts)
+    return keys[starts], np.where(first < never, first + 1, 0)
+
+
+def histogram_median(histogram):
+    """Median bucket of each row of a (groups, buckets) count histogram (-1 for empty rows)"""
+    totals = histogram.sum(axis=1)
+    cumulative = histogram.cumsum(axis=1)
+    medians = (cumulative < ((totals + 1) // 2)[:, None]).sum(axis=1)
+    return np.where(totals > 0, medians, -1)
+
+
+def difficulty_report(tables, slice_rows, cap):
+    """
+    Per-exercise and per-lesson aggregates over the attempt log, in slices of whole users
+    Returns a dict of arrays indexed like tables['exercise'] / tables['lesson'].
+    """
+    exercise_ids, lesson_ids = tables['exercise']['id'], tables['lesson']['id']
+    exercise_lesson = lookup(lesson_ids, tables['exercise']['lesson_id'])
+    exercises, lessons = len(exercise_ids), len(lesson_ids)
+
+    def counts(values, weights=None, size=exercises):
+        return np.bincount(values, weights=weights, minlength=size)
+
+    totals = {name: np.zeros(exercises) for name in
+              ('attempts', 'correct', 'latency_sum', 'latency_count', 'learners', 'first_try')}
+    completions = np.zeros((lessons, cap + 1))
+    attempts_to_complete = np.zeros(lessons)
+
+    log = tables['attempt']
+    for start, end in user_slices(log['user_id'], slice_rows):
+        exercise = lookup(exercise_ids, log['exercise_id'][start:end])
+        known = exercise >= 0  # Attempts on exercises deleted since are left out
+        exercise = exercise[known]
+        user = log['user_id'][start:end][known].astype(np.int64)
+        correct = log['correct'][start:end][known]
+        latency = log['latency_ms'][start:end][known]
+
+        totals['attempts'] += counts(exercise)
+        totals['correct'] += counts(exercise, correct)
+        timed = latency >= 0
+        totals['latency_sum'] += counts(exercise[timed], latency[timed])
+        totals['latency_count'] += counts(exercise[timed])
+
+        pairs, tries = first_success(user * exercises + exercise, correct)
+        totals['learners'] += counts(pairs % exercises)
+        totals['first_try'] += counts(pairs % exercises, tries == 1)
+
+        lesson = exercise_lesson[exercise]
+        in_lesson = lesson >= 0
+        pairs, tries = first_success(user[in_lesson] * lessons + lesson[in_lesson], correct[in_lesson])
+        completed = tries > 0
+        lesson, tries = pairs[completed] % lessons, tries[completed]
+        completions += counts(lesson * (cap + 1) + np.minimum(tries, cap), size=lessons * (cap + 1)).reshape(
+            lessons, cap + 1)
+        attempts_to_complete += counts(lesson, tries, size=lessons)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'attempts': totals['attempts'].astype(np.int64),
+            'success_rate': totals['correct'] / totals['attempts'],
+            'first_try_rate': totals['first_try'] / totals['learners'],
+            'mean_latency_ms': totals['latency_sum'] / totals['latency_count'],
+            'completions': completions.sum(axis=1).astype(np.int64),
+            'mean_attempts_to_complete': attempts_to_complete / completions.sum(axis=1),
+            'median_attempts_to_complete': histogram_median(completions),
+        }
+
+
+def funnel_report(tables, slice_rows):
+    """Learners who started and completed each lesson, from progress; arrays indexed like tables['lesson']"""
+    lesson_ids = tables['lesson']['id']
+    started, completed = np.zeros(len(lesson_ids)), np.zeros(len(lesson_ids))
+    progress = tables['progress']
+    for start, end in row_slices(len(progress['lesson_id']), slice_rows):
+        lesson = lookup(lesson_ids, progress['lesson_id'][start:end])
+        known = lesson >= 0
+        started += np.bincount(lesson[known], minlength=len(lesson_ids))
+        completed += np.bincount(lesson[known], weights=progress['completed'][start:end][known],
+                                 minlength=len(lesson_ids))
+    return {'started': started.astype(np.int64), 'completed': completed.astype(np.int64)}
+
+
+def build_report(directory, slice_rows, cap, top):
+    """Funnel (lessons in path order) and hardest exercises of an export, as plain data"""
+    manifest, tables = load_export(directory)
+    difficulty = difficulty_report(tables, slice_rows, cap)
+    funnel = funnel_report(tables, slice_rows)
+
+    lessons = tables['lesson']
+    path = np.lexsort((lessons['id'], lessons['order']))
+    previous = None
+    funnel_rows = []
+    for index in path:
+        started, completed = int(funnel['started'][index]), int(funnel['completed'][index])
+        median = int(difficulty['median_attempts_to_complete'][index])
+        funnel_rows.append({
+            'lesson_id': int(lessons['id'][index]),
+            'title': manifest['lessons'].get(str(lessons['id'][index]), ''),
+            'started': started,
+            'completed': completed,
+            'completion_rate': completed / started if started else None,
+            # Share of the previous lesson's finishers who did not finish this one
+            'drop_off': 1 - completed / previous if previous else None,
+            'mean_attempts_to_complete': _number(difficulty['mean_attempts_to_complete'][index]),
+            'median_attempts_to_complete': None if median < 0 else f'{cap}+' if median == cap else median,
+        })
+        previous = completed
+
+    exercises = tables['exercise']
+    attempted = np.flatnonzero(difficulty['attempts'] > 0)
+    hardest = attempted[np.lexsort((-difficulty['attempts'][attempted], difficulty['success_rate'][attempted]))]
+    exercise_rows = [{
+        'exercise_id': int(exercises['id'][index]),
+        'label': manifest['exercises'].get(str(exercises['id'][index]), ''),
+        'attempts': int(difficulty['attempts'][index]),
+        'success_rate': _number(difficulty['success_rate'][index]),
+        'first_try_rate': _number(difficulty['first_try_rate'][index]),
+        'mean_latency_ms': _number(difficulty['mean_latency_ms'][index]),
+    } for index in hardest[:top]]
+
+    return {'exported_at': manifest['exported_at'], 'attempts': manifest['tables']['attempt']['rows'],
+            'funnel': funnel_rows, 'hardest_exercises': exercise_rows}
+
+
+def _number(value):
+    return None if np.isnan(value) else round(float(value), 4)
+
+
+def _percent(value):
+    return '-' if value is None else f'{value:.1%}'
+
+
+@analytics_cli.command('export')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--chunk-size', default=ANALYTICS_CONFIG['chunk_size'], show_default=True,
+              help='Rows fetched per round trip.')
+@click.option('--primary', is_flag=True, help='Read from the primary even when a replica is configured.')
+def export_command(directory, chunk_size, primary):
+    """Stream the attempt log, progress and catalog into column files in DIRECTORY."""
+    if os.path.exists(directory):
+        raise click.BadParameter(f'{directory} already exists', param_hint='DIRECTORY')
+    started = time.perf_counter()
+    manifest = export(directory, chunk_size, primary)
+    elapsed = time.perf_counter() - started
+    rows = sum(table['rows'] for table in manifest['tables'].values())
+    click.echo(f"{rows:,} rows ({manifest['tables']['attempt']['rows']:,} attempts) exported from the "
+               f"{manifest['source']} in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:,.0f} rows/s)")
+
+
+@analytics_cli.command('report')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--top', default=ANALYTICS_CONFIG['top_exercises'], show_default=True,
+              help='Hardest exercises listed.')
+@click.option('--slice-rows', default=ANALYTICS_CONFIG['slice_rows'], show_default=True,
+              help='Attempt rows aggregated per pass; bounds memory.')
+@click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON.')
+def report_command(directory, top, slice_rows, as_json):
+    """Lesson funnel and exercise difficulty from an export in DIRECTORY."""
+    started = time.perf_counter()
+    report = build_report(directory, slice_rows, ANALYTICS_CONFIG['attempts_cap'], top)
+    elapsed = time.perf_counter() - started
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+
+    click.echo(f"Export of {report['exported_at']} UTC, {report['attempts']:,} attempts, "
+               f"aggregated in {elapsed:.1f}s\n")
+    click.echo(f"{'Lesson':<32} {'Started':>9} {'Completed':>9} {'Rate':>7} {'Drop-off':>8} "
+               f"{'Mean':>6} {'Median':>6}")
+    for row in report['funnel']:
+        mean = row['mean_attempts_to_complete']
+        click.echo(f"{row['title'][:32]:<32} {row['started']:>9,} {row['completed']:>9,} "
+                   f"{_percent(row['completion_rate']):>7} {_percent(row['drop_off']):>8} "
+                   f"{'-' if mean is None else f'{mean:.1f}':>6} {str(row['median_attempts_to_complete'] or '-'):>6}")
+
+    click.echo(f"\n{'Hardest exercises':<32} {'Attempts':>9} {'Success':>8} {'1st try':>8} {'Latency':>9}")
+    for row in report['hardest_exercises']:
+        latency = row['mean_latency_ms']
+        click.echo(f"{row['label'][:32]:<32} {row['attempts']:>9,} {_percent(row['success_rate']):>8} "
+                   f"{_percent(row['first_try_rate']):>8} "
+                   f"{'-' if latency is None else f'{latency / 1000:.1f}s':>9}")
@@ -0,0 +1,85 @@
+"""
+Fingerprinted static assets
+tools/build_assets.py writes every bundle in ASSETS_CONFIG to static/dist under a
+content-hashed name (app.3f9c2a1b7d4e.css), next to .gz/.br precompressed copies,
+and records the names in static/dist/manifest.json.
+
+asset_urls() maps a bundle name to the URL of its built file; without a build it
+falls back to the source files (and the CDN for vendor files that were never
+downloaded), so a fresh checkout still works. Built files are served from /assets
+with a one-year immutable Cache-Control, picking the precompressed copy the client
+accepts.
+"""
+
+import json
+import mimetypes
+import os
+
+from flask import current_app, request, send_file, url_for
+
+from config import ASSETS_CONFIG
+
+MANIFEST = 'manifest.json'
+
+# (Content-Encoding, file suffix) in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_manifest = None
+
+
+def output_dir(app=None):
+    app = app or current_app
+    return os.path.join(app.static_folder, ASSETS_CONFIG['output_dir'])
+
+
+def load_manifest():
+    """Bundle name -> built file name; empty when assets were never built"""
+    path = os.path.join(output_dir(), MANIFEST)
+    try:
+        with open(path, encoding='utf-8') as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {}
+
+
+def get_manifest():
+    """The manifest, read once per worker (re-read on every call in debug mode)"""
+    global _manifest
+    if _manifest is None or current_app.debug:
+        _manifest = load_manifest()
+    return _manifest
+
+
+def asset_urls(bundle):
+    """URLs to include for a bundle: its fingerprinted file, or the unbuilt sources"""
+    built = get_manifest().get(bundle)
+    if built:
+        return [url_for('assets.asset', filename=built)]
+
+    urls = []
+    for source in ASSETS_CONFIG['bundles'][bundle]:
+        if source in ASSETS_CONFIG['vendor'] and not os.path.exists(os.path.join(current_app.static_folder, source)):
+            urls.append(ASSETS_CONFIG['vendor'][source])
+        else:
+            urls.append(url_for('static', filename=source))
+    return urls
+
+
+def precompressed(path):
+    """(path, Content-Encoding) of the best precompressed copy the client accepts"""
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def send_asset(path):
+    """Response for a built asset, precompressed when possible and cacheable forever"""
+    body, encoding = precompressed(path)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response = send_file(body, mimetype=mimetype, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f"public, max-age={ASSETS_CONFIG['max_age']}, immutable"
+    return response
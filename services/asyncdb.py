@@ -0,0 +1,65 @@
+"""
+Async database access for the ASGI serving mode (asgi.py)
+The async engine points at the same database as the Flask app and uses the same
+models.py tables. Only the driver changes: aiosqlite for SQLite, asyncpg for
+PostgreSQL (both optional, see requirements.txt). The write-path functions in
+services/ are shared through AsyncSession.run_sync(), which hands them a regular
+Session, so the upsert logic is not duplicated.
+
+Reads always go to the primary; the replica and shard routing in
+services/database.py applies to the Flask views only, so asgi.py refuses to start
+on a sharded database (DATABASE_SHARD_URLS).
+"""
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from services.database import apply_sqlite_pragmas, engine_options
+
+# Sync driver backend -> async driver
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg'
+}
+
+
+def async_url(url):
+    """The same database URL with its async driver"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver configured for {backend} databases')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class AsyncDatabase:
+    """Async engine and session factory, created when the ASGI app starts"""
+
+    def __init__(self):
+        self.engine = None
+        self.sessions = None
+
+    def connect(self, url):
+        """
+        url: the Flask app's resolved SQLAlchemy URL (db.engine.url), so relative
+        SQLite paths point at the same file as the sync engine
+        """
+        url = async_url(url)
+        self.engine = create_async_engine(url, **engine_options(url.render_as_string(hide_password=False)))
+        if url.get_backend_name() == 'sqlite':
+            event.listen(self.engine.sync_engine, 'connect', apply_sqlite_pragmas)
+        # expire_on_commit=False: results stay readable after the commit, without a refresh query
+        self.sessions = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def dispose(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = self.sessions = None
+
+    def session(self):
+        """`async with adb.session() as session:`"""
+        return self.sessions()
+
+
+adb = AsyncDatabase()
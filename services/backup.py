@@ -0,0 +1,369 @@
+"""
+Learner data backup and restore
+`flask data export DIR` writes lessons, exercises, users and progress as
+gzip-compressed NDJSON, one file per table (DIR/user.ndjson.gz, ...), so it works
+the same for SQLite and PostgreSQL deployments and the files can be read with
+zcat. Each table is read in primary-key order through a server-side cursor
+(yield_per) and written in chunks of BACKUP_CONFIG['chunk_size'] rows, every
+chunk its own gzip member: memory stays at one chunk whatever the table size.
+
+DIR/manifest.json lists the finished chunks of each table (byte offset, rows,
+last id) and is rewritten after every chunk. Running an interrupted export again
+with the same arguments drops the unfinished chunk and continues after the last
+id written.
+
+`flask data import DIR` upserts the rows by primary key in batches, one
+transaction per batch, and saves the last imported id in maintenance_checkpoint
+with each batch. An interrupted import run again resumes at the chunk holding that
+id; importing the same export twice just rewrites the same values.
+
+Filters select a cohort: --users 1000-1999 (a user id range) and --active-since /
+--active-until (users with progress in that period). Their progress rows go with
+them; lessons and exercises are always exported in full.
+
+Progress ids are only unique within a shard, so on a sharded database progress is
+left to each shard's own database backups; the other tables export as usual.
+"""
+
+import gzip
+import io
+import json
+import os
+import secrets
+import time
+from datetime import date, datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Date, DateTime, String, cast, select, text
+from sqlalchemy.orm import aliased
+
+from config import BACKUP_CONFIG
+from models import Exercise, Lesson, Progress, User, db, utcnow
+from services.catalog import bump_content_version
+from services.database import SHARDED_TABLES, shard_count
+from services.dbutil import upsert_rows
+from services.maintenance import load_checkpoint, save_checkpoint
+
+data_cli = AppGroup('data', help='Back up and restore learner data.')
+
+MANIFEST = 'manifest.json'
+FORMAT = 1
+
+# Tables in export and import order (parents before the rows referencing them)
+TABLES = {
+    'lesson': Lesson,
+    'exercise': Exercise,
+    'user': User,
+    'progress': Progress,
+}
+
+
+class BackupError(ValueError):
+    """Raised for an export that cannot be imported into this database"""
+
+
+def table_file(name):
+    return f'{name}.ndjson.gz'
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def write_manifest(directory, manifest):
+    """Replace the manifest atomically: a crash leaves the previous version, never half a file"""
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def new_manifest(tables, filters):
+    return {
+        'format': FORMAT,
+        'export_id': secrets.token_hex(8),  # Import checkpoints are kept per export
+        'started_at': utcnow().isoformat(timespec='seconds'),
+        'finished_at': None,
+        'filters': filters,
+        'tables': {name: {'file': table_file(name), 'columns': [column.name for column in TABLES[name].__table__.c],
+                          'rows': 0, 'last_id': 0, 'size': 0, 'chunks': [], 'done': False} for name in tables}
+    }
+
+
+def cohort_conditions(user_id, filters):
+    """WHERE conditions on a user id column selecting the users matched by `filters`"""
+    conditions = []
+    if filters['users']:
+        conditions.append(user_id.between(*filters['users']))
+    if filters['active_since'] or filters['active_until']:
+        activity = aliased(Progress)
+        active = select(activity.id).where(activity.user_id == user_id)
+        if filters['active_since']:
+            active = active.where(activity.last_attempt >= datetime.fromisoformat(filters['active_since']))
+        if filters['active_until']:
+            active = active.where(activity.last_attempt < datetime.fromisoformat(filters['active_until']))
+        conditions.append(active.exists())
+    return conditions
+
+
+def exported_columns(model):
+    """The table's columns, with dates and times as the database's text (parsed back by fromisoformat)"""
+    return [cast(column, String).label(column.name) if isinstance(column.type, (Date, DateTime)) else column
+            for column in model.__table__.c]
+
+
+def table_query(name, after_id, filters):
+    """The rows of a table still to export, in primary-key order"""
+    model = TABLES[name]
+    query = select(*exported_columns(model)).where(model.id > after_id).order_by(model.id)
+    if model is User:
+        query = query.where(*cohort_conditions(User.id, filters))
+    elif model is Progress:
+        query = query.where(*cohort_conditions(Progress.user_id, filters))
+    return query
+
+
+def export_table(connection, directory, name, state, filters, chunk_size):
+    """
+    Append the rows after state['last_id'] to the table's file, one gzip member per chunk
+    Yields the row count of each chunk once it is on disk and recorded in `state`;
+    the caller saves the manifest then.
+    """
+    encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+    path = os.path.join(directory, state['file'])
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        f.truncate(state['size'])  # Drops a chunk an interrupted run did not finish
+        f.seek(state['size'])
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            table_query(name, state['last_id'], filters))
+        names = list(result.keys())
+        for rows in result.partitions():
+            lines = ''.join([encode(dict(zip(names, row))) + '\n' for row in rows])
+            f.write(gzip.compress(lines.encode(), compresslevel=BACKUP_CONFIG['compress_level'], mtime=0))
+            f.flush()
+            os.fsync(f.fileno())
+            state['chunks'].append([state['size'], len(rows), rows[-1].id])
+            state['size'] = f.tell()
+            state['rows'] += len(rows)
+            state['last_id'] = rows[-1].id
+            yield len(rows)
+    state['done'] = True
+
+
+def export(directory, manifest, chunk_size):
+    """
+    Export the tables of `manifest` that are not done yet, saving it after every chunk
+    Yields (table, rows) per chunk.
+    """
+    with db.engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            # One snapshot for all tables of this run: no progress row without its user
+            connection = connection.execution_options(isolation_level='REPEATABLE READ')
+        with connection.begin():
+            for name, state in manifest['tables'].items():
+                if state['done']:
+                    continue
+                for rows in export_table(connection, directory, name, state, manifest['filters'], chunk_size):
+                    write_manifest(directory, manifest)
+                    yield name, rows
+                write_manifest(directory, manifest)
+    manifest['finished_at'] = utcnow().isoformat(timespec='seconds')
+    write_manifest(directory, manifest)
+
+
+def row_decoder(model, columns):
+    """Function turning an exported record back into column values"""
+    table = model.__table__.c
+    missing = [name for name in columns if name not in table]
+    if missing:
+        raise BackupError(f"{model.__tablename__}: the database has no column {', '.join(missing)}; "
+                          'run `flask db upgrade` first')
+    datetimes = [name for name in columns if isinstance(table[name].type, DateTime)]
+    dates = [name for name in columns if isinstance(table[name].type, Date) and name not in datetimes]
+
+    def decode(record):
+        for name in datetimes:
+            if record[name] is not None:
+                record[name] = datetime.fromisoformat(record[name])
+        for name in dates:
+            if record[name] is not None:
+                record[name] = date.fromisoformat(record[name])
+        return record
+    return decode
+
+
+def read_records(directory, state, after_id):
+    """Records of a table with an id above `after_id`, starting at the chunk that holds the first one"""
+    chunks = [chunk for chunk in state['chunks'] if chunk[2] > after_id]
+    if not chunks:
+        return
+    with open(os.path.join(directory, state['file']), 'rb') as f:
+        f.seek(chunks[0][0])  # Every chunk is a complete gzip member, readable on its own
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=f, mode='rb'), encoding='utf-8') as stream:
+            for line in stream:
+                record = json.loads(line)
+                if record['id'] > after_id:
+                    yield record
+
+
+def reset_sequence(model):
+    """PostgreSQL: move the id sequence past the imported ids, so new rows do not collide with them"""
+    if db.session.get_bind(mapper=model).dialect.name != 'postgresql':
+        return
+    table = db.engine.dialect.identifier_preparer.quote(model.__tablename__)
+    db.session.execute(text(f"SELECT setval(pg_get_serial_sequence(:table, 'id'), coalesce(max(id), 0) + 1, false) "
+                            f'FROM {table}'), {'table': table})
+
+
+def import_job(name):
+    """maintenance_checkpoint job recording how far the import of a table got"""
+    return f'data-import:{name}'
+
+
+def import_table(directory, manifest, name, batch_size, after_id):
+    """
+    Upsert the rows of one table with an id above `after_id`, in batches
+    Yields the row count of each committed batch.
+    """
+    model = TABLES[name]
+    state = manifest['tables'][name]
+    decode = row_decoder(model, state['columns'])
+    job, run_key = import_job(name), manifest['export_id']
+    batch = []
+    for record in read_records(directory, state, after_id):
+        batch.append(decode(record))
+        if len(batch) == batch_size:
+            yield write_batch(model, job, run_key, batch)
+            batch = []
+    if batch:
+        yield write_batch(model, job, run_key, batch)
+    reset_sequence(model)
+    db.session.commit()
+
+
+def write_batch(model, job, run_key, batch):
+    upsert_rows(db.session, model, batch, ['id'])
+    save_checkpoint(job, run_key, batch[-1]['id'])  # Same transaction: a batch is imported once
+    db.session.commit()
+    return len(batch)
+
+
+def parse_user_range(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        first, last = (int(part) for part in value.split('-'))
+    except ValueError:
+        raise click.BadParameter('expected FIRST-LAST, e.g. 1000-1999') from None
+    return [first, last]
+
+
+def _rate(rows, seconds):
+    return f'{rows / seconds if seconds else 0:,.0f} rows/s'
+
+
+def check_unsharded(tables, activity_filter=False):
+    """Refuse per-user tables on a sharded database (their ids are only unique within a shard)"""
+    if shard_count() == 1:
+        return
+    sharded = [name for name in tables if name in SHARDED_TABLES]
+    if sharded:
+        raise click.ClickException(f"{', '.join(sharded)} is split over {shard_count()} shards: back up each "
+                                   f"shard's database, and pick the other tables with --table")
+    if activity_filter:
+        raise click.ClickException('--active-since/--active-until read progress, which is split over the shards')
+
+
+@data_cli.command('export')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--users', callback=parse_user_range, metavar='FIRST-LAST', help='Only users in this id range.')
+@click.option('--active-since', type=click.DateTime(['%Y-%m-%d']),
+              help='Only users with progress on or after this day (UTC).')
+@click.option('--active-until', type=click.DateTime(['%Y-%m-%d']), help='Only users with progress before this day.')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(list(TABLES)),
+              help='Export only this table (repeatable; default: all).')
+@click.option('--chunk-size', default=BACKUP_CONFIG['chunk_size'], show_default=True,
+              help='Rows per server-side cursor fetch and per gzip member.')
+def export_command(directory, users, active_since, active_until, tables, chunk_size):
+    """Stream learner data into gzip NDJSON files in DIRECTORY (run again to resume)."""
+    filters = {'users': users, 'active_since': active_since and active_since.date().isoformat(),
+               'active_until': active_until and active_until.date().isoformat()}
+    tables = [name for name in TABLES if not tables or name in tables]
+    check_unsharded(tables, bool(active_since or active_until))
+
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        manifest = read_manifest(directory)
+        if manifest['finished_at']:
+            raise click.BadParameter(f'{directory} already holds a finished export', param_hint='DIRECTORY')
+        if manifest['filters'] != filters or list(manifest['tables']) != tables:
+            raise click.BadParameter(f'{directory} holds an unfinished export with other filters or tables',
+                                     param_hint='DIRECTORY')
+        resumed = {name: state['last_id'] for name, state in manifest['tables'].items() if state['rows']}
+        if resumed:
+            click.echo('Resuming after ' + ', '.join(f'{name} id {last_id}' for name, last_id in resumed.items()))
+    else:
+        if os.path.exists(directory) and os.listdir(directory):
+            raise click.BadParameter(f'{directory} is not empty', param_hint='DIRECTORY')
+        os.makedirs(directory, exist_ok=True)
+        manifest = new_manifest(tables, filters)
+        write_manifest(directory, manifest)
+
+    started = time.perf_counter()
+    total = 0
+    for _, rows in export(directory, manifest, chunk_size):
+        total += rows
+    elapsed = time.perf_counter() - started
+    for name in tables:
+        state = manifest['tables'][name]
+        click.echo(f"{name:<9} {state['rows']:>12,} rows  {state['size'] / 1e6:>9.1f} MB")
+    click.echo(f'{total:,} rows exported in {elapsed:.1f}s ({_rate(total, elapsed)})'
+               + (' by this run' if total != sum(state['rows'] for state in manifest['tables'].values()) else ''))
+
+
+@data_cli.command('import')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--table', 'tables', multiple=True, type=click.Choice(list(TABLES)),
+              help='Import only this table (repeatable; default: all in the export).')
+@click.option('--batch-size', default=BACKUP_CONFIG['batch_size'], show_default=True,
+              help='Rows per upsert batch and transaction.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoints of an interrupted import of this export.')
+def import_command(directory, tables, batch_size, restart):
+    """Upsert the rows of an export in DIRECTORY (run again to resume)."""
+    try:
+        manifest = read_manifest(directory)
+    except FileNotFoundError:
+        raise click.BadParameter(f'{directory} holds no export', param_hint='DIRECTORY') from None
+    if manifest.get('format') != FORMAT:
+        raise click.ClickException(f"Unsupported export format {manifest.get('format')!r}")
+    if not manifest['finished_at']:
+        raise click.ClickException(f'The export in {directory} is unfinished: run `flask data export` again on it')
+
+    names = [name for name in manifest['tables'] if not tables or name in tables]
+    check_unsharded(names)
+    started = time.perf_counter()
+    total = 0
+    try:
+        for name in names:
+            after_id = 0 if restart else load_checkpoint(import_job(name), manifest['export_id'])
+            if after_id:
+                click.echo(f'{name}: resuming after id {after_id}')
+            table_started, imported = time.perf_counter(), 0
+            for rows in import_table(directory, manifest, name, batch_size, after_id):
+                imported += rows
+            elapsed = time.perf_counter() - table_started
+            total += imported
+            click.echo(f'{name:<9} {imported:>12,} rows in {elapsed:>7.1f}s ({_rate(imported, elapsed)})')
+    except BackupError as error:
+        db.session.rollback()
+        raise click.ClickException(str(error))
+    if {'lesson', 'exercise'} & set(names):
+        bump_content_version()  # Tell every worker's lesson catalog to reload
+        db.session.commit()
+    elapsed = time.perf_counter() - started
+    click.echo(f'{total:,} rows imported in {elapsed:.1f}s ({_rate(total, elapsed)})')
+    if 'progress' in names:
+        click.echo('Run `flask stats rebuild` to recompute the per-user stats from the restored progress')
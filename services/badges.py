@@ -0,0 +1,158 @@
+"""
+Badge awards
+Rules are declared in config.BADGE_RULES. Each event (a submission with a correct
+answer, a login) carries the current values of the metrics it can have moved, and
+only the rules watching that event and one of those metrics are checked, so
+awarding never rescans a user's history. Awards are stored in the
+user_badge table; its unique key keeps them idempotent.
+
+`flask badges backfill` evaluates every rule for existing users in chunks (on a
+sharded database, against the shard holding each chunk's rows).
+"""
+
+import json
+import time
+from collections import defaultdict
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select
+
+from config import BADGE_RULES
+from models import Progress, User, UserBadge, UserStats, db
+from services.database import user_shards, using_shard
+from services.dbutil import insert_ignore
+
+badges_cli = AppGroup('badges', help='Maintain badge awards.')
+
+# event -> metric -> [(threshold, name)], built once from the config
+RULES_BY_EVENT = defaultdict(lambda: defaultdict(list))
+for _rule in BADGE_RULES:
+    for _event in _rule['events']:
+        RULES_BY_EVENT[_event][_rule['metric']].append((_rule['threshold'], _rule['name']))
+
+
+def rules_met(facts, rules):
+    """Names of the rules in `rules` (metric -> [(threshold, name)]) satisfied by `facts`"""
+    return [name
+            for metric, value in facts.items() if value is not None
+            for threshold, name in rules.get(metric, ()) if value >= threshold]
+
+
+def award(session, user_id, names):
+    """Insert the badges the user does not have yet; returns the newly awarded names"""
+    if not names:
+        return []
+    owned = set(session.execute(select(UserBadge.badge).where(
+        UserBadge.user_id == user_id, UserBadge.badge.in_(names))).scalars())
+    new = [name for name in dict.fromkeys(names) if name not in owned]
+    insert_ignore(session, UserBadge, [{'user_id': user_id, 'badge': name} for name in new],
+                  ['user_id', 'badge'])
+    return new
+
+
+def award_badges(event, user_id, facts, session=None):
+    """
+    Check the rules triggered by `event` against `facts` (metric -> current value)
+    Returns the names of badges awarded by this call. Does not commit.
+    """
+    session = session or db.session
+    return award(session, user_id, rules_met(facts, RULES_BY_EVENT.get(event, {})))
+
+
+def on_completion(user_id, result, session=None):
+    """
+    Badges earned by a SubmissionResult from services.submissions
+    Every correct answer re-checks the xp and correct_attempts rules (a user's XP
+    can also come from an import, and a rule added later may already be met);
+    first completions and first-try answers add the lesson counters. The current
+    values are read with two primary-key lookups.
+    """
+    if not (result.correct_answers or result.first_completion or result.first_try):
+        return []
+    session = session or db.session
+    facts = {'xp': session.execute(select(User.xp).where(User.id == user_id)).scalar()}
+    stats = session.get(UserStats, user_id, populate_existing=True)
+    if stats is not None:
+        facts['correct_attempts'] = stats.correct_attempts
+        if result.first_completion:
+            facts['completed_lessons'] = stats.completed_lessons
+        if result.first_try:
+            facts['perfect_lessons'] = stats.perfect_lessons
+    return award_badges('completion', user_id, facts, session)
+
+
+def on_login(user, session=None):
+    """Badges earned by logging in (streak rules)"""
+    return award_badges('login', user.id, {'streak': user.streak}, session)
+
+
+def all_rules():
+    """Every rule regardless of event, as metric -> [(threshold, name)]"""
+    rules = defaultdict(list)
+    for rule in BADGE_RULES:
+        rules[rule['metric']].append((rule['threshold'], rule['name']))
+    return rules
+
+
+def backfill_users(rows, rules):
+    """Award the badges met by (id, xp, streak, badges) user rows sorted by id; returns how many were new"""
+    first_id, last_id = rows[0][0], rows[-1][0]
+    stats = {row.user_id: row for row in UserStats.query.filter(UserStats.user_id.between(first_id, last_id))}
+    # Lessons completed per user, for users whose summary row predates user_stats
+    completed = dict(db.session.query(Progress.user_id, db.func.count(Progress.id))
+                     .filter(Progress.user_id.between(first_id, last_id), Progress.completed.is_(True))
+                     .group_by(Progress.user_id))
+    owned = defaultdict(set)
+    for user_id, name in db.session.query(UserBadge.user_id, UserBadge.badge) \
+            .filter(UserBadge.user_id.between(first_id, last_id)):
+        owned[user_id].add(name)
+
+    new_rows = []
+    for user_id, xp, streak, legacy in rows:
+        summary = stats.get(user_id)
+        facts = {
+            'xp': xp,
+            'streak': streak,
+            'completed_lessons': max(completed.get(user_id, 0), summary.completed_lessons if summary else 0),
+            'correct_attempts': summary.correct_attempts if summary else None,
+            'perfect_lessons': summary.perfect_lessons if summary else None,
+        }
+        try:
+            names = json.loads(legacy) if legacy else []
+        except ValueError:
+            names = []
+        names = list(dict.fromkeys([*names, *rules_met(facts, rules)]))
+        new_rows.extend({'user_id': user_id, 'badge': name} for name in names if name not in owned[user_id])
+
+    insert_ignore(db.session, UserBadge, new_rows, ['user_id', 'badge'])
+    return len(new_rows)
+
+
+@badges_cli.command('backfill')
+@click.option('--chunk-size', default=1000, show_default=True, help='Users processed per transaction.')
+def backfill_command(chunk_size):
+    """Evaluate all badge rules for existing users and migrate legacy JSON badges."""
+    rules = all_rules()
+    started = time.perf_counter()
+    last_id = 0
+    users = awarded = 0
+
+    while True:
+        rows = db.session.query(User.id, User.xp, User.streak, User.badges).filter(User.id > last_id) \
+            .order_by(User.id).limit(chunk_size).all()
+        if not rows:
+            break
+        first_id, last_id = rows[0][0], rows[-1][0]
+
+        for shard, low, high in user_shards(first_id, last_id):
+            piece = [row for row in rows if low <= row[0] <= high]
+            if piece:
+                with using_shard(shard):
+                    awarded += backfill_users(piece, rules)
+        db.session.commit()
+        users += len(rows)
+
+    elapsed = time.perf_counter() - started
+    click.echo(f'{users} users scanned, {awarded} badges awarded in {elapsed:.1f}s '
+               f'({users / elapsed if elapsed else 0:,.0f} users/s)')
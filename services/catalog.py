@@ -0,0 +1,221 @@
+"""
+In-process lesson catalog
+Lessons and exercises are loaded once per worker into an immutable snapshot.
+The snapshot is swapped for a fresh one when ContentVersion changes in the DB.
+"""
+
+import json
+import threading
+import time
+from config import CATALOG_CONFIG
+from models import ContentVersion, Exercise, ExerciseVariant, Lesson, db, utcnow
+from services.prerequisites import PrerequisiteGraph
+
+
+def _parse_json_list(value):
+    """Parse a JSON list column into a tuple (empty tuple if missing or invalid)"""
+    try:
+        return tuple(json.loads(value)) if value else ()
+    except (TypeError, ValueError):
+        return ()
+
+
+class _Frozen:
+    """Base for snapshot entries: attributes are set once in __init__ and never change"""
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is read-only')
+
+    def _set(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+
+class ExerciseEntry(_Frozen):
+    """Read-only copy of an Exercise row with its options already parsed"""
+    __slots__ = ('id', 'lesson_id', 'type', 'question', 'answer', 'options', 'hint', 'order', 'generator', 'seed')
+
+    def __init__(self, exercise):
+        self._set(
+            id=exercise.id,
+            lesson_id=exercise.lesson_id,
+            type=exercise.type,
+            question=exercise.question,
+            answer=exercise.answer,
+            options=_parse_json_list(exercise.options),
+            hint=exercise.hint,
+            order=exercise.order or 0,
+            generator=exercise.generator,
+            seed=None  # Set on copies showing a pregenerated variant
+        )
+
+    def with_variant(self, variant):
+        """Copy of this exercise showing one variant of its generator"""
+        entry = object.__new__(ExerciseEntry)
+        entry._set(**{name: getattr(self, name) for name in self.__slots__})
+        entry._set(question=variant.question, answer=variant.answer, options=variant.options,
+                   hint=variant.hint or self.hint, seed=variant.seed)
+        return entry
+
+    def __repr__(self):
+        return f'<ExerciseEntry {self.id}>'
+
+
+class VariantEntry(_Frozen):
+    """Read-only copy of an ExerciseVariant row"""
+    __slots__ = ('generator', 'seed', 'question', 'answer', 'options', 'hint')
+
+    def __init__(self, variant):
+        self._set(
+            generator=variant.generator,
+            seed=variant.seed,
+            question=variant.question,
+            answer=variant.answer,
+            options=_parse_json_list(variant.options),
+            hint=variant.hint
+        )
+
+    def __repr__(self):
+        return f'<VariantEntry {self.generator}:{self.seed}>'
+
+
+class LessonEntry(_Frozen):
+    """Read-only copy of a Lesson row with its prerequisites and exercises attached"""
+    __slots__ = ('id', 'title', 'description', 'order', 'xp_reward', 'prerequisites', 'exercises')
+
+    def __init__(self, lesson, exercises):
+        self._set(
+            id=lesson.id,
+            title=lesson.title,
+            description=lesson.description,
+            order=lesson.order,
+            xp_reward=lesson.xp_reward or 0,
+            prerequisites=_parse_json_list(lesson.prerequisites),
+            exercises=tuple(exercises)
+        )
+
+    def __repr__(self):
+        return f'<LessonEntry {self.title}>'
+
+
+class Catalog(_Frozen):
+    """Snapshot of all course content at one content version"""
+    __slots__ = ('version', 'updated_at', 'lessons', 'lessons_by_id', 'exercises_by_id', 'graph',
+                 'variant_pools', 'variants_by_key')
+
+    def __init__(self, version, lessons, updated_at=None, variants=()):
+        pools = {}
+        for variant in variants:
+            pools.setdefault(variant.generator, []).append(variant)
+        self._set(
+            version=version,
+            updated_at=updated_at,  # When content last changed (None if never versioned)
+            lessons=tuple(lessons),  # Ordered by Lesson.order
+            lessons_by_id={lesson.id: lesson for lesson in lessons},
+            exercises_by_id={exercise.id: exercise for lesson in lessons for exercise in lesson.exercises},
+            graph=PrerequisiteGraph(lessons),  # Raises PrerequisiteCycleError on bad content
+            variant_pools={generator: tuple(pool) for generator, pool in pools.items()},  # Ordered by seed
+            variants_by_key={(variant.generator, variant.seed): variant for variant in variants}
+        )
+
+    def get_lesson(self, lesson_id):
+        return self.lessons_by_id.get(lesson_id)
+
+    def get_exercise(self, exercise_id):
+        return self.exercises_by_id.get(exercise_id)
+
+    def variant_pool(self, generator):
+        """Pregenerated variants of a generator, empty if it has none (or generator is None)"""
+        return self.variant_pools.get(generator, ())
+
+    def get_variant(self, generator, seed):
+        return self.variants_by_key.get((generator, seed))
+
+
+def current_version():
+    """Content version stored in the DB (0 when content was never versioned)"""
+    return db.session.query(ContentVersion.version).filter_by(id=1).scalar() or 0
+
+
+def load_catalog():
+    """Build a new snapshot from the DB"""
+    # Read the version first: if content changes while loading, the next check reloads again
+    version, updated_at = db.session.query(ContentVersion.version, ContentVersion.updated_at).filter_by(
+        id=1).first() or (0, None)
+
+    exercises_by_lesson = {}
+    for exercise in Exercise.query.order_by(Exercise.lesson_id, Exercise.order, Exercise.id):
+        exercises_by_lesson.setdefault(exercise.lesson_id, []).append(ExerciseEntry(exercise))
+
+    lessons = [
+        LessonEntry(lesson, exercises_by_lesson.get(lesson.id, ()))
+        for lesson in Lesson.query.order_by(Lesson.order, Lesson.id)
+    ]
+
+    # Only the pools of generators that some exercise uses
+    generators = {exercise.generator for lesson in lessons for exercise in lesson.exercises if exercise.generator}
+    variants = [
+        VariantEntry(variant) for variant in ExerciseVariant.query.filter(
+            ExerciseVariant.generator.in_(generators)).order_by(ExerciseVariant.generator, ExerciseVariant.seed)
+    ] if generators else []
+    return Catalog(version, lessons, updated_at, variants)
+
+
+_catalog = None
+_checked_at = 0.0
+_reload_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    Return the current snapshot, reloading it if the content version changed
+    The DB version is checked at most once per CATALOG_CONFIG['version_check_interval']
+    """
+    global _catalog, _checked_at
+
+    catalog = _catalog
+    if catalog is not None and time.monotonic() - _checked_at < CATALOG_CONFIG['version_check_interval']:
+        return catalog
+
+    # Only one thread reloads; the others keep serving the old snapshot meanwhile
+    if not _reload_lock.acquire(blocking=catalog is None):
+        return catalog
+    try:
+        if _catalog is not None and time.monotonic() - _checked_at < CATALOG_CONFIG['version_check_interval']:
+            return _catalog
+        if _catalog is None or current_version() != _catalog.version:
+            _catalog = load_catalog()  # Atomic swap: readers see either the old or the new snapshot
+        _checked_at = time.monotonic()
+        return _catalog
+    finally:
+        _reload_lock.release()
+
+
+def fresh_catalog():
+    """The current snapshot if it was checked recently, else None (never touches the DB)"""
+    catalog = _catalog
+    if catalog is not None and time.monotonic() - _checked_at < CATALOG_CONFIG['version_check_interval']:
+        return catalog
+    return None
+
+
+def invalidate_catalog():
+    """Force the next get_catalog() call in this worker to re-check the content version"""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def bump_content_version():
+    """
+    Mark course content as changed so every worker reloads its snapshot
+    Call this in the same transaction that edits lessons or exercises
+    """
+    now = utcnow()
+    updated = ContentVersion.query.filter_by(id=1).update(
+        {ContentVersion.version: ContentVersion.version + 1, ContentVersion.updated_at: now},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.add(ContentVersion(id=1, version=1, updated_at=now))
+    invalidate_catalog()
@@ -0,0 +1,251 @@
+"""
+Bulk content import
+Lessons and exercises are streamed from JSONL or CSV files, validated row by
+row and written with batched executemany upserts keyed on Lesson.slug and
+Exercise.key, so re-running an import updates rows instead of duplicating them.
+Only one batch of exercises is held in memory at a time.
+
+File columns (JSONL objects use the same names):
+    lessons:   slug, title, description, order, xp_reward, prerequisites
+    exercises: key, lesson, type, question, answer, options, hint, order, generator
+`prerequisites` lists lesson slugs and `lesson` is a lesson slug. In CSV files
+list values are either a JSON array or separated by "|". `generator` (optional) names
+a parametric generator in services/variants.py.
+"""
+
+import csv
+import json
+import re
+import time
+from collections import namedtuple
+from itertools import islice
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, update
+
+from config import APP_CONFIG
+from models import Exercise, Lesson, db
+from services.catalog import bump_content_version
+from services.dbutil import upsert_rows
+from services.prerequisites import PrerequisiteCycleError, PrerequisiteGraph
+from services.variants import GENERATORS
+
+content_cli = AppGroup('content', help='Import lessons and exercises.')
+
+EXERCISE_TYPES = ('multiple_choice', 'fill_blank', 'drag_drop', 'graph')
+
+# Minimal lesson shape accepted by PrerequisiteGraph
+_Node = namedtuple('_Node', 'id prerequisites')
+
+
+class ContentError(ValueError):
+    """Raised for an invalid content record; the whole import is rolled back"""
+
+
+def slugify(text):
+    """'Product & Chain Rule' -> 'product-chain-rule'"""
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')
+
+
+def exercise_key(lesson_slug, position):
+    """Default key of the n-th exercise (1-based) of a lesson"""
+    return f'{lesson_slug}-{position}'
+
+
+def read_records(path):
+    """Yield one dict per JSONL line or CSV row, without loading the file"""
+    with open(path, newline='', encoding='utf-8') as handle:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(handle)
+        elif path.endswith(('.jsonl', '.ndjson')):
+            for number, line in enumerate(handle, 1):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as error:
+                        raise ContentError(f'{path} line {number}: {error}') from None
+        else:
+            raise ContentError(f'{path}: expected a .jsonl or .csv file')
+
+
+def _text(record, field, required=True):
+    value = record.get(field)
+    value = value.strip() if isinstance(value, str) else value
+    if required and value in (None, ''):
+        raise ContentError(f'missing {field!r}')
+    return value if value != '' else None
+
+
+def _int(record, field, default=None):
+    value = record.get(field)
+    if value in (None, ''):
+        if default is None:
+            raise ContentError(f'missing {field!r}')
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ContentError(f'{field!r} must be an integer, got {value!r}') from None
+
+
+def _list(record, field):
+    value = record.get(field)
+    if value in (None, ''):
+        return []
+    if isinstance(value, str):
+        value = value.strip()
+        value = json.loads(value) if value.startswith('[') else value.split('|')
+    if not isinstance(value, list):
+        raise ContentError(f'{field!r} must be a list')
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def validate_lesson(record):
+    """Lesson row (prerequisites still as slugs) from a raw record"""
+    return {
+        'slug': _text(record, 'slug'),
+        'title': _text(record, 'title'),
+        'description': _text(record, 'description', required=False),
+        'order': _int(record, 'order'),
+        'xp_reward': _int(record, 'xp_reward', APP_CONFIG['default_xp_per_lesson']),
+        'prerequisites': _list(record, 'prerequisites'),
+    }
+
+
+def validate_exercise(record, lesson_ids):
+    """Exercise row from a raw record; lesson_ids maps lesson slugs to IDs"""
+    lesson_slug = _text(record, 'lesson')
+    if lesson_slug not in lesson_ids:
+        raise ContentError(f'unknown lesson {lesson_slug!r}')
+    exercise_type = _text(record, 'type')
+    if exercise_type not in EXERCISE_TYPES:
+        raise ContentError(f'unknown exercise type {exercise_type!r}')
+    answer = _text(record, 'answer')
+    options = _list(record, 'options')
+    if exercise_type == 'multiple_choice' and answer not in options:
+        raise ContentError('multiple_choice answer must be one of the options')
+    generator = _text(record, 'generator', required=False)
+    if generator is not None and generator not in GENERATORS:
+        raise ContentError(f'unknown generator {generator!r}')
+    return {
+        'key': _text(record, 'key'),
+        'lesson_id': lesson_ids[lesson_slug],
+        'type': exercise_type,
+        'question': _text(record, 'question'),
+        'answer': answer,
+        'options': json.dumps(options) if options else None,
+        'hint': _text(record, 'hint', required=False),
+        'order': _int(record, 'order', 0),
+        'generator': generator,
+    }
+
+
+def _batches(records, size):
+    records = iter(records)
+    while batch := list(islice(records, size)):
+        yield batch
+
+
+def _validated(records, validate, label, *args):
+    """Validate records lazily, tagging errors with the record number"""
+    for number, record in enumerate(records, 1):
+        try:
+            yield validate(record, *args)
+        except (ContentError, ValueError) as error:
+            raise ContentError(f'{label} record {number}: {error}') from None
+
+
+def import_lessons(records, batch_size=1000, session=None):
+    """Upsert lessons, then resolve prerequisite slugs to IDs; returns the row count"""
+    session = session or db.session
+    count = 0
+    prerequisite_slugs = {}
+    for batch in _batches(_validated(records, validate_lesson, 'lesson'), batch_size):
+        for row in batch:
+            prerequisite_slugs[row['slug']] = row['prerequisites']
+            row['prerequisites'] = '[]'
+        upsert_rows(session, Lesson, batch, ['slug'])
+        count += len(batch)
+
+    lesson_ids = dict(session.query(Lesson.slug, Lesson.id))
+    updates = []
+    for slug, prerequisites in prerequisite_slugs.items():
+        unknown = [prerequisite for prerequisite in prerequisites if prerequisite not in lesson_ids]
+        if unknown:
+            raise ContentError(f'lesson {slug!r}: unknown prerequisites {unknown}')
+        updates.append({'lesson_slug': slug,
+                        'ids': json.dumps([lesson_ids[prerequisite] for prerequisite in prerequisites])})
+    if updates:
+        session.execute(
+            update(Lesson.__table__).where(Lesson.__table__.c.slug == bindparam('lesson_slug'))
+            .values(prerequisites=bindparam('ids')),
+            updates
+        )
+    return count
+
+
+def import_exercises(records, batch_size=1000, session=None):
+    """Upsert exercises in batches; returns the row count"""
+    session = session or db.session
+    lesson_ids = dict(session.query(Lesson.slug, Lesson.id))
+    count = 0
+    for batch in _batches(_validated(records, validate_exercise, 'exercise', lesson_ids), batch_size):
+        upsert_rows(session, Exercise, batch, ['key'])
+        count += len(batch)
+    return count
+
+
+def check_prerequisites(session=None):
+    """Raise ContentError if the stored prerequisites form a cycle"""
+    session = session or db.session
+    lessons = [
+        _Node(lesson_id, json.loads(prerequisites or '[]'))
+        for lesson_id, prerequisites in session.query(Lesson.id, Lesson.prerequisites).order_by(Lesson.order)
+    ]
+    try:
+        PrerequisiteGraph(lessons)
+    except PrerequisiteCycleError as error:
+        raise ContentError(str(error)) from None
+
+
+def import_content(lessons=(), exercises=(), batch_size=1000, session=None):
+    """
+    Import lesson and exercise records (iterables of dicts) in one transaction
+    Returns (lessons, exercises) row counts. Does not commit.
+    """
+    session = session or db.session
+    lesson_count = import_lessons(lessons, batch_size, session)
+    exercise_count = import_exercises(exercises, batch_size, session)
+    check_prerequisites(session)
+    bump_content_version()  # Tell every worker's lesson catalog to reload
+    return lesson_count, exercise_count
+
+
+@content_cli.command('import')
+@click.option('--lessons', 'lessons_path', type=click.Path(exists=True, dir_okay=False),
+              help='Lessons file (.jsonl or .csv).')
+@click.option('--exercises', 'exercises_path', type=click.Path(exists=True, dir_okay=False),
+              help='Exercises file (.jsonl or .csv).')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per executemany batch.')
+def import_command(lessons_path, exercises_path, batch_size):
+    """Upsert lessons and exercises from JSONL/CSV files."""
+    if not lessons_path and not exercises_path:
+        raise click.UsageError('Pass --lessons and/or --exercises')
+
+    started = time.perf_counter()
+    try:
+        counts = import_content(
+            read_records(lessons_path) if lessons_path else (),
+            read_records(exercises_path) if exercises_path else (),
+            batch_size
+        )
+    except ContentError as error:
+        db.session.rollback()
+        raise click.ClickException(str(error))
+    db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    rows = sum(counts)
+    click.echo(f'{counts[0]} lessons, {counts[1]} exercises imported in {elapsed:.1f}s '
+               f'({rows / elapsed if elapsed else 0:,.0f} rows/s)')
@@ -0,0 +1,293 @@
+"""
+Database engine configuration, read-replica and user-shard routing
+engine_options() turns config.DATABASE_CONFIG into Flask-SQLAlchemy engine options.
+SQLite connections get WAL mode, a busy timeout and the other pragmas on connect,
+so concurrent writers wait for the lock instead of failing with "database is locked".
+
+When DATABASE_REPLICA_URL is set, views decorated with @read_only send their
+SELECTs to the replica bind. Writes always go to the primary, and a user who wrote
+within DATABASE_CONFIG['read_your_writes_seconds'] keeps reading from the primary,
+so they never see a replica that has not caught up with their own changes.
+
+When DATABASE_SHARD_URLS is set, the per-user tables (SHARDED_TABLES) are split
+by user id over the primary (shard 0) and those databases. Statements on them go
+to the shard of the logged-in user, or to the shard selected with using_shard()
+outside requests; everything else (users, the lesson catalog, the XP ledger)
+stays on the primary. See services/shards.py for moving users between shards.
+
+This module must not import models: models.db is built with RoutingSession.
+"""
+
+import bisect
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import column, event, false, inspect, not_, or_, select, table
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+
+from config import DATABASE_CONFIG, SHARD_CONFIG
+
+REPLICA = 'replica'  # Bind key of the read replica in SQLALCHEMY_BINDS
+SHARD_PREFIX = 'shard'  # Bind keys shard1..shardN of the extra shards; shard 0 is the primary
+SHARD_MAP = 'shard_map'  # app.extensions key of the app's ShardMap
+
+# Flask session key holding the time of the user's last write
+LAST_WRITE_KEY = 'db_last_write'
+
+# Tables holding one user's learning state: each user's rows live on exactly one shard
+SHARDED_TABLES = frozenset({'progress', 'attempt', 'user_stats', 'user_badge', 'review_item', 'daily_activity'})
+# Every shard also keeps its own maintenance checkpoints, next to the rows the jobs
+# process; they are only routed to a shard inside using_shard()
+SHARD_LOCAL_TABLES = SHARDED_TABLES | {'maintenance_checkpoint'}
+
+# models.ShardRange, as a lightweight table (read before models is imported)
+SHARD_RANGES = table('shard_range', column('first_user_id'), column('last_user_id'), column('shard'),
+                     column('moving_to'), column('moved_from'))
+
+_shard_override = ContextVar('shard_override', default=None)
+
+
+class ShardMoving(Exception):
+    """A write for a user whose rows are being copied to another shard; retry shortly"""
+
+
+def engine_options(url):
+    """SQLALCHEMY_ENGINE_OPTIONS for a database URL"""
+    options = {'pool_pre_ping': DATABASE_CONFIG['pool_pre_ping']}
+    if url.startswith('sqlite'):
+        if ':memory:' in url or url.rstrip('/') == 'sqlite:':
+            return options  # In-memory databases use a single shared connection
+    else:
+        options['pool_recycle'] = DATABASE_CONFIG['pool_recycle']
+    options['pool_size'] = DATABASE_CONFIG['pool_size']
+    options['max_overflow'] = DATABASE_CONFIG['max_overflow']
+    return options
+
+
+def shard_key(number):
+    """Bind key of a shard (None, the default bind, for shard 0)"""
+    return f'{SHARD_PREFIX}{number}' if number else None
+
+
+def binds(replica_url, shard_urls=()):
+    """SQLALCHEMY_BINDS with the replica and the extra shards, if configured"""
+    result = {}
+    if replica_url:
+        result[REPLICA] = {'url': replica_url, **engine_options(replica_url)}
+    for number, url in enumerate(shard_urls, 1):
+        result[shard_key(number)] = {'url': url, **engine_options(url)}
+    return result
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """Apply DATABASE_CONFIG['sqlite_pragmas'] to a new SQLite DBAPI connection"""
+    cursor = dbapi_connection.cursor()
+    for name, value in DATABASE_CONFIG['sqlite_pragmas'].items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # The async engine (services/asyncdb.py) registers apply_sqlite_pragmas itself
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        apply_sqlite_pragmas(dbapi_connection)
+
+
+def recently_wrote():
+    """True if the current user wrote within the read-your-writes window"""
+    last_write = session.get(LAST_WRITE_KEY)
+    return last_write is not None and time.time() - last_write < DATABASE_CONFIG['read_your_writes_seconds']
+
+
+def read_only(view):
+    """Serve this view's SELECTs from the replica (when configured and safe for this user)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not recently_wrote():
+            g.db_route = REPLICA
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def remember_write(response):
+    """after_request hook: start the read-your-writes window after a request that wrote"""
+    if g.get('db_wrote'):
+        session[LAST_WRITE_KEY] = time.time()
+    return response
+
+
+MappedRange = namedtuple('MappedRange', 'first_user_id last_user_id shard moving_to moved_from')
+
+
+class ShardMap:
+    """
+    user id -> shard, from the shard_range table on the primary
+    Users outside every range are on shard 0. A range with moving_to set is being
+    copied to that shard: its users read from `shard` but cannot write. Each worker
+    re-reads the (small) table at most every SHARD_CONFIG['map_refresh_seconds'].
+    """
+
+    def __init__(self, count):
+        self.count = count  # Number of shards, the primary included
+        self.ranges = []
+        self.starts = []
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def load(self, engine):
+        with engine.connect() as connection:
+            ranges = [MappedRange(*row) for row in connection.execute(
+                select(*SHARD_RANGES.c).order_by(SHARD_RANGES.c.first_user_id))]
+        self.ranges, self.starts = ranges, [entry.first_user_id for entry in ranges]
+        self.loaded_at = time.monotonic()
+
+    def refresh(self, engine):
+        """Re-read the map if this copy is older than map_refresh_seconds"""
+        if self.loaded_at is None or time.monotonic() - self.loaded_at >= SHARD_CONFIG['map_refresh_seconds']:
+            with self.lock:
+                if self.loaded_at is None or time.monotonic() - self.loaded_at >= SHARD_CONFIG['map_refresh_seconds']:
+                    self.load(engine)
+        return self
+
+    def find(self, user_id):
+        """The MappedRange holding user_id, or None for the default (shard 0)"""
+        position = bisect.bisect_right(self.starts, user_id) - 1
+        if position >= 0 and self.ranges[position].last_user_id >= user_id:
+            return self.ranges[position]
+        return None
+
+    def shard_for(self, user_id):
+        entry = self.find(user_id)
+        return entry.shard if entry else 0
+
+    def pieces(self, first_user_id, last_user_id):
+        """[first_user_id, last_user_id] cut into MappedRanges, the default ones included"""
+        result = []
+        position = first_user_id
+        for entry in self.ranges:
+            if entry.last_user_id < position:
+                continue
+            if entry.first_user_id > last_user_id:
+                break
+            if entry.first_user_id > position:
+                result.append(MappedRange(position, entry.first_user_id - 1, 0, None, None))
+            result.append(entry._replace(first_user_id=max(entry.first_user_id, position),
+                                         last_user_id=min(entry.last_user_id, last_user_id)))
+            position = entry.last_user_id + 1
+        if position <= last_user_id:
+            result.append(MappedRange(position, last_user_id, 0, None, None))
+        return result
+
+    def owned(self, user_id_column, number):
+        """
+        SQL condition: the user's rows are on shard `number`, or are being copied there
+        (used to pick a shard's share of the XP ledger for its daily rollup)
+        """
+        def within(entries):
+            return or_(false(), *(user_id_column.between(entry.first_user_id, entry.last_user_id)
+                                  for entry in entries))
+        mine = within(entry for entry in self.ranges if number in (entry.shard, entry.moving_to))
+        if number:
+            return mine
+        return or_(not_(within(self.ranges)), mine)
+
+
+def shard_map():
+    """The current app's ShardMap, or None when it is not sharded"""
+    return current_app.extensions.get(SHARD_MAP) if has_app_context() else None
+
+
+def init_shards(app):
+    """Route the per-user tables over the primary and the shard binds in SQLALCHEMY_BINDS"""
+    count = 1 + sum(1 for key in app.config.get('SQLALCHEMY_BINDS', {}) if key.startswith(SHARD_PREFIX))
+    if count > 1:
+        app.extensions[SHARD_MAP] = ShardMap(count)
+
+
+def shard_count():
+    """Number of shards, the primary included (1 when the app is not sharded)"""
+    shards = shard_map()
+    return shards.count if shards else 1
+
+
+def user_shards(first_user_id, last_user_id):
+    """
+    (shard, first, last) pieces of a user id range, for jobs that work through users
+    in chunks: run each piece inside using_shard(shard)
+    """
+    shards = shard_map()
+    if shards is None:
+        return [(0, first_user_id, last_user_id)]
+    shards.refresh(current_app.extensions['sqlalchemy'].engine)
+    return [(entry.shard, entry.first_user_id, entry.last_user_id)
+            for entry in shards.pieces(first_user_id, last_user_id)]
+
+
+@contextmanager
+def using_shard(number):
+    """Send statements on the per-user tables (and maintenance checkpoints) to shard `number`"""
+    token = _shard_override.set(number)
+    try:
+        yield
+    finally:
+        _shard_override.reset(token)
+
+
+def _table_name(mapper, clause):
+    if mapper is not None:
+        return inspect(mapper).local_table.name  # callers may pass the model class instead of its mapper
+    if isinstance(clause, UpdateBase):
+        return clause.table.name
+    if isinstance(clause, Select):
+        froms = clause.get_final_froms()
+        return getattr(froms[0], 'name', None) if froms else None
+    return None
+
+
+def _shard_number(db, mapper, clause, writing):
+    """Shard a statement goes to (None: not a per-user table, or sharding is off)"""
+    shards = shard_map()
+    if shards is None:
+        return None
+    name = _table_name(mapper, clause)
+    number = _shard_override.get()
+    if number is not None:
+        return number if name in SHARD_LOCAL_TABLES else None
+    if name not in SHARDED_TABLES:
+        return None
+    user_id = session.get('user_id') if has_request_context() else None
+    if user_id is None:
+        raise RuntimeError(f'{name} is sharded by user: query it for the logged-in user or inside using_shard()')
+    entry = shards.refresh(db.engine).find(user_id)
+    if entry is None:
+        return 0
+    if writing and entry.moving_to is not None:
+        raise ShardMoving(user_id)
+    return entry.shard
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends per-user tables to their shard and can send reads to the replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            writing = self._flushing or (clause is not None and not isinstance(clause, Select))
+            if writing and has_request_context():
+                g.db_wrote = True
+            number = _shard_number(self._db, mapper, clause, writing)
+            if number:
+                return self._db.engines[shard_key(number)]
+            if not writing and has_request_context() and g.get('db_route') == REPLICA \
+                    and REPLICA in self._db.engines:
+                return self._db.engines[REPLICA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
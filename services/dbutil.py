@@ -0,0 +1,97 @@
+"""
+Database helpers shared by the write paths
+Wraps the dialect-specific INSERT ... ON CONFLICT constructs with a portable fallback.
+"""
+
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+# Dialects with a native INSERT ... ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert,
+}
+
+
+def dialect_insert(session, model):
+    """Dialect-specific insert() supporting on_conflict_* for the model's database, or None"""
+    dialect = session.get_bind(mapper=model).dialect.name
+    insert_func = UPSERT_INSERTS.get(dialect)
+    # On the table, not the mapped class: executemany batches skip the ORM's per-row bulk-insert bookkeeping
+    return insert_func(model.__table__) if insert_func else None
+
+
+def upsert_counters(session, model, keys, increments, assign=None):
+    """
+    Insert a row or add `increments` to its counter columns, in one statement
+    keys: values of the unique key columns, e.g. {'user_id': 1, 'lesson_id': 2}
+    assign: columns overwritten on every write (e.g. timestamps)
+    """
+    assign = assign or {}
+    columns = model.__table__.c
+    stmt = dialect_insert(session, model)
+    if stmt is not None:
+        stmt = stmt.values(**keys, **increments, **assign).on_conflict_do_update(
+            index_elements=[columns[name] for name in keys],
+            set_={**{name: columns[name] + amount for name, amount in increments.items()}, **assign}
+        )
+        session.execute(stmt)
+        return
+
+    # Generic fallback: update first, insert if missing, retry the update if another
+    # transaction inserted the row in between
+    bump = update(model).where(*[columns[name] == value for name, value in keys.items()]).values(
+        **{name: columns[name] + amount for name, amount in increments.items()}, **assign
+    )
+    if session.execute(bump).rowcount:
+        return
+    try:
+        with session.begin_nested():
+            session.execute(insert(model).values(**keys, **increments, **assign))
+    except IntegrityError:
+        session.execute(bump)
+
+
+def insert_ignore(session, model, rows, index_elements):
+    """
+    Insert rows, skipping any that collide with the unique key `index_elements`
+    Uses one executemany statement on SQLite/PostgreSQL.
+    """
+    if not rows:
+        return
+    stmt = dialect_insert(session, model)
+    if stmt is not None:
+        session.execute(stmt.on_conflict_do_nothing(index_elements=index_elements), rows)
+        return
+
+    for row in rows:
+        try:
+            with session.begin_nested():
+                session.execute(insert(model).values(**row))
+        except IntegrityError:
+            pass
+
+
+def upsert_rows(session, model, rows, index_elements):
+    """
+    Insert rows or overwrite the existing rows with the same unique key `index_elements`
+    Uses one executemany statement on SQLite/PostgreSQL; all rows must have the same keys.
+    """
+    if not rows:
+        return
+    columns = model.__table__.c
+    stmt = dialect_insert(session, model)
+    if stmt is not None:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={name: stmt.excluded[name] for name in rows[0] if name not in index_elements}
+        )
+        session.execute(stmt, rows)
+        return
+
+    for row in rows:
+        keys = [columns[name] == row[name] for name in index_elements]
+        if not session.execute(update(model).where(*keys).values(**row)).rowcount:
+            session.execute(insert(model).values(**row))
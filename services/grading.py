@@ -0,0 +1,232 @@
+"""
+Answer grading engine
+Checks submitted answers against Exercise.answer using math-aware equivalence,
+so '10x', '10*x' and 'x*10' are all accepted for the same exercise
+"""
+
+import ast
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from config import GRADING_CONFIG
+
+# Characters students type (or copy from the question) mapped to plain ASCII math
+SYMBOL_REPLACEMENTS = {
+    '−': '-', '–': '-', '·': '*', '⋅': '*', '×': '*', '÷': '/',
+    '√': 'sqrt', 'π': 'pi', '**': '^'
+}
+SUPERSCRIPTS = {
+    '⁰': '0', '¹': '1', '²': '2', '³': '3', '⁴': '4', '⁵': '5',
+    '⁶': '6', '⁷': '7', '⁸': '8', '⁹': '9', '⁻': '-', 'ⁿ': 'n'
+}
+
+# Names allowed inside an expression answer
+FUNCTIONS = {
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+    'sec': lambda v: 1 / np.cos(v), 'csc': lambda v: 1 / np.sin(v), 'cot': lambda v: 1 / np.tan(v),
+    'arcsin': np.arcsin, 'arccos': np.arccos, 'arctan': np.arctan,
+    'sqrt': np.sqrt, 'exp': np.exp, 'ln': np.log, 'log': np.log, 'abs': np.abs
+}
+CONSTANTS = {'pi': np.pi, 'e': np.e}
+VARIABLES = ('x', 'y', 'z', 't', 'n', 'u', 'k', 'c')  # 'c' covers the constant of integration
+
+# Longest names first so 'sqrt' is not read as 's' 'q' 'r' 't'
+_NAMES = sorted(list(FUNCTIONS) + list(CONSTANTS), key=len, reverse=True)
+_TOKEN_RE = re.compile(r'\s*(?:(\d+\.\d*|\.\d+|\d+)|([a-z]+)|(\S))')
+_SUPERSCRIPT_RE = re.compile('[' + ''.join(SUPERSCRIPTS) + ']+')
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Constant, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.UAdd, ast.USub
+)
+
+
+class CanonicalAnswer:
+    """
+    Parsed form of an answer string
+    kind is 'expression' when the answer could be compiled as math, otherwise 'text'
+    """
+    __slots__ = ('kind', 'text', 'code', 'variables', '_values')
+
+    def __init__(self, kind, text, code=None, variables=()):
+        self.kind = kind
+        self.text = text  # Whitespace-free, lowercased form used for text comparison
+        self.code = code  # Compiled expression, evaluated over numpy arrays
+        self.variables = variables
+        self._values = {}  # Sample-point evaluations keyed by variable tuple
+
+    def values(self, variables):
+        """Evaluate the expression at the shared sample points for the given variables"""
+        cached = self._values.get(variables)
+        if cached is None:
+            namespace = dict(FUNCTIONS)
+            namespace.update(CONSTANTS)
+            namespace.update(zip(variables, sample_points(variables)))
+            with np.errstate(all='ignore'):
+                try:
+                    result = eval(self.code, {'__builtins__': {}}, namespace)
+                    cached = np.broadcast_to(np.asarray(result, dtype=float), (_sample_count(),))
+                except (ArithmeticError, ValueError, TypeError):
+                    cached = np.full(_sample_count(), np.nan)
+            self._values[variables] = cached
+        return cached
+
+
+def normalize_text(value):
+    """Lowercase and drop all whitespace so spacing and case never matter"""
+    return ''.join(str(value).split()).lower()
+
+
+def _to_expression(text):
+    """
+    Translate a student-style math string ('3x² + 2x', '√(x-2)') into Python syntax
+    Returns None when the string is not recognizable math
+    """
+    for symbol, replacement in SYMBOL_REPLACEMENTS.items():
+        text = text.replace(symbol, replacement)
+    text = _SUPERSCRIPT_RE.sub(lambda m: '^(' + ''.join(SUPERSCRIPTS[c] for c in m.group()) + ')', text)
+
+    tokens = []
+    for number, word, symbol in _TOKEN_RE.findall(text.lower()):
+        if number:
+            tokens.append(('num', repr(float(number))))
+        elif word:
+            # Split runs of letters into known names and single-letter variables
+            while word:
+                name = next((n for n in _NAMES if word.startswith(n)), None)
+                if name:
+                    tokens.append(('func' if name in FUNCTIONS else 'name', name))
+                    word = word[len(name):]
+                elif word[0] in VARIABLES:
+                    tokens.append(('name', word[0]))
+                    word = word[1:]
+                else:
+                    return None
+        elif symbol in '+-*/^()':
+            tokens.append((symbol, symbol))
+        else:
+            return None
+
+    # Insert the multiplication signs students leave out: 10x, 2(x+1), x sin(x), (x+1)(x-1)
+    parts = []
+    previous = None
+    for kind, value in tokens:
+        if previous in ('num', 'name', ')') and kind in ('num', 'name', 'func', '('):
+            parts.append('*')
+        parts.append('**' if kind == '^' else value)
+        previous = kind
+    return ' '.join(parts)
+
+
+def parse_answer(text):
+    """Build the canonical form of an answer string"""
+    text = str(text).strip()
+    canonical_text = normalize_text(text)
+    if not text or len(text) > GRADING_CONFIG['max_answer_length']:
+        return CanonicalAnswer('text', canonical_text)
+
+    expression = _to_expression(text)
+    if not expression:
+        return CanonicalAnswer('text', canonical_text)
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError:
+        return CanonicalAnswer('text', canonical_text)
+
+    variables = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            return CanonicalAnswer('text', canonical_text)
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS \
+                    or len(node.args) != 1 or node.keywords:
+                return CanonicalAnswer('text', canonical_text)
+        elif isinstance(node, ast.Name) and node.id in VARIABLES:
+            variables.add(node.id)
+
+    code = compile(tree, '<answer>', 'eval')
+    return CanonicalAnswer('expression', canonical_text, code, tuple(sorted(variables)))
+
+
+# Exercise answers are parsed once and kept for the life of the worker.
+# Keying on the answer text means edited content is re-parsed automatically.
+canonical_answer = lru_cache(maxsize=None)(parse_answer)
+
+# Submissions are far more varied, so only the most recent ones are kept
+canonical_submission = lru_cache(maxsize=GRADING_CONFIG['submission_cache_size'])(parse_answer)
+
+
+def _sample_count():
+    return GRADING_CONFIG['sample_points']
+
+
+@lru_cache(maxsize=64)
+def sample_points(variables):
+    """Deterministic random sample points, one row per variable"""
+    rng = np.random.default_rng(GRADING_CONFIG['sample_seed'])
+    # A second, positive interval keeps answers like sqrt(x - 2) or ln(x) defined at enough points
+    ranges = np.array(GRADING_CONFIG['sample_ranges'], dtype=float)
+    which = np.arange(_sample_count()) % len(ranges)
+    low, high = ranges[which, 0], ranges[which, 1]
+    points = low + (high - low) * rng.random((len(variables), _sample_count()))
+    points.setflags(write=False)
+    return tuple(points)
+
+
+def equivalent(expected, submitted):
+    """
+    Compare two canonical answers
+    Expressions are evaluated at the same batch of random points in one vectorized pass
+    """
+    if expected.text == submitted.text:
+        return True
+    if expected.kind != 'expression' or submitted.kind != 'expression':
+        return False
+
+    variables = tuple(sorted(set(expected.variables) | set(submitted.variables)))
+    a = expected.values(variables)
+    b = submitted.values(variables)
+
+    a_defined = np.isfinite(a)
+    b_defined = np.isfinite(b)
+    # Both sides must be defined (or undefined) at exactly the same points
+    if not np.array_equal(a_defined, b_defined):
+        return False
+    if a_defined.sum() < GRADING_CONFIG['min_valid_points']:
+        return False
+    return bool(np.allclose(a[a_defined], b[b_defined],
+                            rtol=GRADING_CONFIG['rel_tolerance'],
+                            atol=GRADING_CONFIG['abs_tolerance']))
+
+
+# Grader registry keyed by Exercise.type
+GRADERS = {}
+
+
+def grader(*exercise_types):
+    """Register a grading function for one or more exercise types"""
+    def register(func):
+        for exercise_type in exercise_types:
+            GRADERS[exercise_type] = func
+        return func
+    return register
+
+
+@grader('multiple_choice')
+def grade_choice(expected_answer, submitted_answer):
+    """Choices are picked from a fixed list, so only the text has to match"""
+    return canonical_answer(expected_answer).text == normalize_text(submitted_answer)
+
+
+@grader('fill_blank')
+def grade_math(expected_answer, submitted_answer):
+    """Free-form answers are compared by mathematical equivalence"""
+    return equivalent(canonical_answer(expected_answer), canonical_submission(str(submitted_answer).strip()))
+
+
+def grade(exercise, submitted_answer):
+    """Grade a submission for an exercise, using the grader registered for its type"""
+    grade_func = GRADERS.get(exercise.type, grade_math)
+    return grade_func(exercise.answer, submitted_answer)
@@ -0,0 +1,128 @@
+"""
+Current-user loading
+current_user() resolves the logged-in user at most once per request and keeps the
+result in flask.g, so a view and the helpers it calls share one lookup. Lookups
+go through a per-worker LRU of small, immutable user snapshots, so most requests
+do not query the user table at all.
+
+Snapshots expire after IDENTITY_CONFIG['user_cache_ttl'] seconds. Writes that
+change a user (XP awards, logins) drop the user's snapshot when their transaction
+commits, and a snapshot loaded before the user's own last write (the
+read-your-writes timestamp in their session) is never served, so users always see
+their own XP and streak up to date, whichever worker answers.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import g, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import IDENTITY_CONFIG
+from models import User, db
+from services.database import LAST_WRITE_KEY
+
+UserSnapshot = namedtuple('UserSnapshot', 'id username xp streak last_login')
+
+# Session.info key: ids of users changed in the current transaction
+CHANGED_USERS_KEY = 'changed_user_ids'
+
+
+class UserCache:
+    """Thread-safe LRU of UserSnapshots with a time-to-live"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (snapshot, loaded_at), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id, not_before=None):
+        """The cached snapshot, or None if missing, expired or loaded before `not_before` (a time.time())"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or now - entry[1] > self.ttl or (not_before and entry[1] < not_before):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, snapshot, loaded_at):
+        """Cache a snapshot read from the database at `loaded_at` (taken before the read)"""
+        with self._lock:
+            self._entries[snapshot.id] = (snapshot, loaded_at)
+            self._entries.move_to_end(snapshot.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+users = UserCache(IDENTITY_CONFIG['user_cache_size'], IDENTITY_CONFIG['user_cache_ttl'])
+
+
+def snapshot_query(user_id):
+    return db.select(*(getattr(User, field) for field in UserSnapshot._fields)).where(User.id == user_id)
+
+
+def load_user(user_id, not_before=None):
+    """Snapshot of a user from the cache or, on a miss, the database (None if there is no such user)"""
+    snapshot = users.get(user_id, not_before)
+    if snapshot is None:
+        loaded_at = time.time()
+        row = db.session.execute(snapshot_query(user_id)).first()
+        if row is None:
+            return None
+        snapshot = UserSnapshot(*row)
+        users.put(snapshot, loaded_at)
+    return snapshot
+
+
+def current_user():
+    """Snapshot of the logged-in user, loaded once per request (None for visitors and deleted accounts)"""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = load_user(user_id, session.get(LAST_WRITE_KEY)) if user_id else None
+    return g.current_user
+
+
+def user_changed(session, user_id):
+    """Drop the user's cached snapshot once the caller's transaction commits"""
+    session.info.setdefault(CHANGED_USERS_KEY, set()).add(user_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_user_updates(session, flush_context):
+    # ORM changes to users (streak updates on login); Core updates call user_changed() themselves
+    for instance in session.dirty:
+        if isinstance(instance, User):
+            user_changed(session, instance.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_changed_users(session):
+    changed = session.info.pop(CHANGED_USERS_KEY, None)
+    if changed:
+        users.discard(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_cached_users(session):
+    # Nothing was written: the cached snapshots are still current
+    session.info.pop(CHANGED_USERS_KEY, None)
@@ -0,0 +1,348 @@
+"""
+XP leaderboards
+Each worker keeps an in-memory rank index per board (all-time and this week).
+Indexes are built from the DB once, then kept current by tailing the xp_event
+ledger written by services.submissions.award_xp.
+
+Ranks use competition ranking: users with the same XP share a rank, and are
+listed in the order they reached that XP.
+"""
+
+import threading
+import time
+from datetime import timedelta
+
+from config import LEADERBOARD_CONFIG
+from models import User, XpEvent, db, utcnow
+
+SYNC_BATCH_SIZE = 5000
+
+
+class TieBucket:
+    """
+    Users sharing one score, in the order they reached it
+    Members only ever join at the end, so each gets the next slot; a Fenwick tree
+    over the slots counts the members still present, which makes joining,
+    leaving, "how many are ahead of slot i" and "which slot is k-th" O(log n)
+    even for the 0 XP bucket that holds most users. Slots left empty are
+    compacted away once they outnumber the members.
+    """
+
+    __slots__ = ('members', 'live', '_tree')
+
+    def __init__(self, user_ids=()):
+        self.members = list(user_ids)  # Slot -> user id, None once the user left
+        self.live = len(self.members)
+        self._build()
+
+    def _build(self):
+        members = self.members
+        size = len(members)
+        tree = [0] * (size + 1)
+        for i in range(1, size + 1):
+            if members[i - 1] is not None:
+                tree[i] += 1
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _count_before(self, i):
+        """Members in slots 0..i-1"""
+        tree = self._tree
+        total = 0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def append(self, user_id):
+        """Add a user after everyone already here; returns their slot"""
+        self.members.append(user_id)
+        i = len(self.members)
+        # Node i covers slots i - lowbit(i) .. i - 1: the newcomer plus the members already in that range
+        self._tree.append(1 + self._count_before(i - 1) - self._count_before(i - (i & -i)))
+        self.live += 1
+        return i - 1
+
+    def remove(self, slot):
+        """Take the user in `slot` out; returns True if the slots were compacted (renumbered)"""
+        self.members[slot] = None
+        self.live -= 1
+        tree, size = self._tree, len(self.members)
+        i = slot + 1
+        while i <= size:
+            tree[i] -= 1
+            i += i & -i
+        if self.live and size > 2 * self.live:
+            self.members = [user_id for user_id in self.members if user_id is not None]
+            self._build()  # O(size), after more than size / 2 removals: amortized O(1)
+            return True
+        return False
+
+    def ahead_of(self, slot):
+        """Members that reached the score before the one in `slot`"""
+        return self._count_before(slot)
+
+    def user_at(self, k):
+        """The k-th (0-based) member still here"""
+        tree, size = self._tree, len(self.members)
+        position, step = 0, 1 << size.bit_length()
+        k += 1
+        while step:
+            following = position + step
+            if following <= size and tree[following] < k:
+                position = following
+                k -= tree[following]
+            step >>= 1
+        return self.members[position]
+
+
+class RankIndex:
+    """
+    Order-statistics index over integer scores
+    A Fenwick tree counts users per score, so "how many users are above X" and
+    "which score holds position k" cost O(log S), where S is the highest score.
+    Users sharing a score are kept in a TieBucket, ordered by who reached the
+    score first (by user id for the users loaded when the index is built).
+    """
+
+    def __init__(self, pairs=()):
+        """pairs: iterable of (user_id, score)"""
+        self._scores = {}
+        grouped = {}
+        for user_id, score in pairs:
+            score = max(int(score or 0), 0)
+            self._scores[user_id] = score
+            grouped.setdefault(score, []).append(user_id)
+        self._buckets = {}
+        self._slots = {}  # user id -> slot in the bucket of their score
+        for score, user_ids in grouped.items():
+            user_ids.sort()
+            self._buckets[score] = TieBucket(user_ids)
+            self._slots.update(zip(user_ids, range(len(user_ids))))
+        self._build_tree(max(self._buckets, default=0))
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    def _build_tree(self, highest):
+        """(Re)build the Fenwick tree in O(S) with room for scores up to `highest`"""
+        capacity = 1024
+        while capacity <= highest:
+            capacity *= 2
+        tree = [0] * (capacity + 1)
+        for score, bucket in self._buckets.items():
+            tree[score + 1] = bucket.live
+        for i in range(1, capacity + 1):
+            parent = i + (i & -i)
+            if parent <= capacity:
+                tree[parent] += tree[i]
+        self._capacity = capacity
+        self._tree = tree
+
+    def _tree_add(self, score, delta):
+        i = score + 1
+        tree, capacity = self._tree, self._capacity
+        while i <= capacity:
+            tree[i] += delta
+            i += i & -i
+
+    def _count_at_or_below(self, score):
+        i = min(score + 1, self._capacity)
+        tree = self._tree
+        total = 0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def _score_at(self, m):
+        """Smallest score s with count_at_or_below(s) >= m (m is 1-based from the bottom)"""
+        tree, position, step = self._tree, 0, self._capacity
+        while step:
+            following = position + step
+            if following <= self._capacity and tree[following] < m:
+                position = following
+                m -= tree[following]
+            step >>= 1
+        return position
+
+    def score(self, user_id):
+        return self._scores.get(user_id)
+
+    def set(self, user_id, score):
+        """Insert a user or move them to a new score (behind the users already there)"""
+        score = max(int(score or 0), 0)
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            bucket = self._buckets[old]
+            if bucket.remove(self._slots[user_id]):
+                self._slots.update((member, slot) for slot, member in enumerate(bucket.members))
+            if not bucket.live:
+                del self._buckets[old]
+            self._tree_add(old, -1)
+        self._scores[user_id] = score
+        bucket = self._buckets.get(score)
+        if bucket is None:
+            bucket = self._buckets[score] = TieBucket()
+        self._slots[user_id] = bucket.append(user_id)
+        if score >= self._capacity:
+            self._build_tree(score)  # Doubles capacity; amortized O(1) per update
+        else:
+            self._tree_add(score, 1)
+
+    def add(self, user_id, delta):
+        self.set(user_id, self._scores.get(user_id, 0) + delta)
+
+    def count_above(self, score):
+        """Number of users with a strictly higher score"""
+        return len(self._scores) - self._count_at_or_below(score)
+
+    def rank(self, user_id):
+        """Competition rank (1 = best) or None if the user is not indexed"""
+        score = self._scores.get(user_id)
+        return None if score is None else self.count_above(score) + 1
+
+    def position(self, user_id):
+        """0-based position in leaderboard order (score desc, then who reached the score first)"""
+        score = self._scores[user_id]
+        return self.count_above(score) + self._buckets[score].ahead_of(self._slots[user_id])
+
+    def entries(self, start, count):
+        """Leaderboard slice as (rank, user_id, score) tuples, starting at a 0-based position"""
+        result = []
+        total = len(self._scores)
+        position = max(start, 0)
+        while len(result) < count and position < total:
+            score = self._score_at(total - position)
+            bucket = self._buckets[score]
+            above = self.count_above(score)
+            offset = position - above
+            for k in range(offset, min(bucket.live, offset + count - len(result))):
+                result.append((above + 1, bucket.user_at(k), score))
+            position = above + bucket.live
+        return result
+
+    def top(self, count):
+        return self.entries(0, count)
+
+    def around(self, user_id, radius):
+        """The user plus up to `radius` neighbours on each side"""
+        position = self.position(user_id)
+        start = max(position - radius, 0)
+        return self.entries(start, position - start + radius + 1)
+
+
+def current_week_start(now=None):
+    """Monday 00:00 UTC of the current week (naive UTC, like the stored timestamps)"""
+    now = now or utcnow()
+    monday = now - timedelta(days=now.weekday())
+    return monday.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class Leaderboard:
+    """All-time and weekly boards for one worker"""
+
+    def __init__(self):
+        self.overall = RankIndex()
+        self.weekly = RankIndex()
+        self.week_start = None
+        self.watermark = 0  # Highest xp_event id already applied
+        self.synced_at = 0.0
+        self.recent_ids = set()  # Applied event ids inside the lookback window
+        self.lock = threading.Lock()
+
+    def rebuild(self):
+        """Build both boards from the User table and this week's XP events"""
+        # Take the watermark first: events after it are applied by sync(). All-time
+        # scores are absolute User.xp values, so re-applying them is harmless.
+        watermark = db.session.query(db.func.max(XpEvent.id)).scalar() or 0
+        week_start = current_week_start()
+
+        overall = RankIndex(db.session.query(User.id, User.xp).yield_per(10000))
+        weekly = RankIndex(
+            db.session.query(XpEvent.user_id, db.func.sum(XpEvent.amount))
+            .filter(XpEvent.created_at >= week_start, XpEvent.id <= watermark)
+            .group_by(XpEvent.user_id)
+        )
+
+        self.overall, self.weekly = overall, weekly
+        self.week_start, self.watermark = week_start, watermark
+        self.recent_ids = {row[0] for row in db.session.query(XpEvent.id).filter(
+            XpEvent.id > watermark - LEADERBOARD_CONFIG['sync_lookback'], XpEvent.id <= watermark)}
+        self.synced_at = time.monotonic()
+
+    def sync(self):
+        """Apply XP events written (by any worker) since the last sync"""
+        if self.week_start != current_week_start():
+            self.rebuild()  # New week: the weekly board starts over
+            return
+
+        # Re-read a few ids below the watermark: on PostgreSQL ids can commit out of
+        # order, and a plain "id > watermark" tail would skip the late ones
+        lookback = LEADERBOARD_CONFIG['sync_lookback']
+        while True:
+            events = db.session.query(XpEvent.id, XpEvent.user_id, XpEvent.amount, XpEvent.created_at) \
+                .filter(XpEvent.id > self.watermark - lookback).order_by(XpEvent.id) \
+                .limit(SYNC_BATCH_SIZE + lookback).all()
+            fresh = [event for event in events if event[0] not in self.recent_ids]
+            if not fresh:
+                break
+            touched = set()
+            for event_id, user_id, amount, created_at in fresh:
+                touched.add(user_id)
+                self.recent_ids.add(event_id)
+                if created_at >= self.week_start:
+                    self.weekly.add(user_id, amount)
+            # All-time scores are read back as absolute values so they cannot drift
+            for user_id, xp in db.session.query(User.id, User.xp).filter(User.id.in_(touched)):
+                self.overall.set(user_id, xp)
+            self.watermark = max(self.watermark, events[-1][0])
+            self.recent_ids = {event_id for event_id in self.recent_ids if event_id > self.watermark - lookback}
+            if len(events) < SYNC_BATCH_SIZE + lookback:
+                break
+        self.synced_at = time.monotonic()
+
+    def refresh(self):
+        """Build on first use, then sync at most once per LEADERBOARD_CONFIG['sync_interval']"""
+        with self.lock:
+            if self.week_start is None:
+                self.rebuild()
+            elif time.monotonic() - self.synced_at >= LEADERBOARD_CONFIG['sync_interval']:
+                self.sync()
+
+    def _index(self, board):
+        return self.weekly if board == 'weekly' else self.overall
+
+    def top(self, board, limit):
+        """Top entries of a board as (rank, user_id, xp) tuples"""
+        with self.lock:
+            return self._index(board).top(limit)
+
+    def standing(self, board, user_id, xp, radius):
+        """
+        A user's rank and neighbours; returns (rank, entries)
+        Users missing from the all-time board (no XP yet) are added with their current XP.
+        """
+        with self.lock:
+            index = self._index(board)
+            if user_id not in index:
+                if board == 'weekly':
+                    return None, []
+                index.set(user_id, xp)
+            return index.rank(user_id), index.around(user_id, radius)
+
+
+_leaderboard = Leaderboard()
+
+
+def get_leaderboard():
+    """Worker-wide leaderboard, kept in sync with the xp_event ledger"""
+    _leaderboard.refresh()
+    return _leaderboard
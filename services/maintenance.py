@@ -0,0 +1,201 @@
+"""
+Scheduled maintenance jobs
+`flask maintenance run` (from cron or a systemd timer, e.g. nightly) runs each job
+as a sequence of set-based statements over id ranges: no ORM objects are loaded
+and every chunk is its own short transaction. A job saves its position in
+maintenance_checkpoint in the same transaction as the chunk it finished, so a
+run that is interrupted resumes where it stopped and never applies a chunk twice.
+
+Jobs:
+    streak-decay     reset the streak of users whose last login is before yesterday (UTC)
+    activity-rollup  add new attempts and XP events to the per-user daily_activity rollup
+
+On a sharded database the rollup runs once per shard, with its checkpoints kept
+on that shard (next to the rows it counts), over the shard's share of the XP ledger.
+"""
+
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Date, Integer, cast, func, select, type_coerce, update
+
+from config import MAINTENANCE_CONFIG
+from models import Attempt, DailyActivity, MaintenanceCheckpoint, User, XpEvent, db, utcnow
+from services.database import shard_count, shard_map, using_shard
+from services.dbutil import dialect_insert, upsert_counters, upsert_rows
+
+maintenance_cli = AppGroup('maintenance', help='Run scheduled maintenance jobs.')
+
+# Registry of job name -> function(chunk_size, today) yielding (rows scanned, rows written) per chunk
+JOBS = {}
+
+JobResult = namedtuple('JobResult', 'scanned changed seconds')
+
+# Checkpoints of the activity rollup (per shard); services/shards.py reads them when moving users
+ATTEMPT_ROLLUP = 'activity-rollup:attempt'
+XP_ROLLUP = 'activity-rollup:xp_event'
+
+
+def job(name):
+    """Register a maintenance job"""
+    def register(func):
+        JOBS[name] = func
+        return func
+    return register
+
+
+def load_checkpoint(name, run_key):
+    """Last id `name` processed for run_key (0 if it has not run for it yet)"""
+    row = db.session.query(MaintenanceCheckpoint.run_key, MaintenanceCheckpoint.position).filter_by(job=name).first()
+    return row.position if row is not None and row.run_key == run_key else 0
+
+
+def save_checkpoint(name, run_key, position):
+    """Record progress; call in the transaction that did the work"""
+    upsert_rows(db.session, MaintenanceCheckpoint, [
+        {'job': name, 'run_key': run_key, 'position': position, 'updated_at': utcnow()}
+    ], ['job'])
+
+
+@job('streak-decay')
+def decay_streaks(chunk_size, today):
+    """One UPDATE per range of user ids; users who logged in yesterday or today keep their streak"""
+    run_key = today.isoformat()
+    cutoff = datetime.combine(today - timedelta(days=1), datetime.min.time())  # Yesterday 00:00 UTC
+    start = load_checkpoint('streak-decay', run_key)
+    last_id = db.session.query(func.max(User.id)).scalar() or 0
+
+    while start < last_id:
+        end = min(start + chunk_size, last_id)
+        changed = db.session.execute(
+            update(User).where(User.id > start, User.id <= end, User.streak > 0, User.last_login < cutoff)
+            .values(streak=0).execution_options(synchronize_session=False)
+        ).rowcount
+        save_checkpoint('streak-decay', run_key, end)
+        db.session.commit()
+        yield end - start, changed
+        start = end
+
+
+def settled_id(model, created_at):
+    """
+    Highest id whose row is older than MAINTENANCE_CONFIG['settle_seconds']
+    Newer ids may still have lower-numbered rows in uncommitted transactions (PostgreSQL
+    hands out ids before commit), so the rollup stops short of them.
+    """
+    cutoff = utcnow() - timedelta(seconds=MAINTENANCE_CONFIG['settle_seconds'])
+    # Walks the primary key backwards from the newest row; stops at the first settled one
+    return db.session.query(model.id).filter(created_at < cutoff).order_by(model.id.desc()).limit(1).scalar() or 0
+
+
+def daily(column):
+    """UTC day of a timestamp, as the rollup groups it (read back as a date on every dialect)"""
+    return type_coerce(func.date(column), Date)
+
+
+def add_to_rollup(aggregate, columns, local=True):
+    """
+    daily_activity += the (day, user_id, *columns) rows of `aggregate`, in one INSERT ... SELECT
+    local=False: `aggregate` reads another database (the XP ledger, for a shard other
+    than the primary), so its rows are fetched and written with one executemany instead.
+    Returns the number of rollup rows written.
+    """
+    stmt = dialect_insert(db.session, DailyActivity)
+    if stmt is None:
+        rows = db.session.execute(aggregate).all()
+        for day, user_id, *values in rows:
+            upsert_counters(db.session, DailyActivity, {'day': day, 'user_id': user_id}, dict(zip(columns, values)))
+        return len(rows)
+    table = DailyActivity.__table__.c
+    if not local:
+        rows = [dict(zip(['day', 'user_id', *columns], row)) for row in db.session.execute(aggregate)]
+        if rows:
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['day', 'user_id'],
+                set_={name: table[name] + stmt.excluded[name] for name in columns}
+            ), rows)
+        return len(rows)
+    stmt = stmt.from_select(['day', 'user_id', *columns], aggregate)
+    return db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['day', 'user_id'],
+        set_={name: table[name] + stmt.excluded[name] for name in columns}
+    )).rowcount
+
+
+def rollup_log(name, model, aggregate, columns, chunk_size, local=True):
+    """Fold the log table `model` into daily_activity in id ranges; aggregate(start, end) builds the SELECT"""
+    start = load_checkpoint(name, 'log')
+    last_id = settled_id(model, model.created_at)
+    while start < last_id:
+        end = min(start + chunk_size, last_id)
+        written = add_to_rollup(aggregate(start, end), columns, local)
+        save_checkpoint(name, 'log', end)
+        db.session.commit()
+        yield end - start, written
+        start = end
+
+
+@job('activity-rollup')
+def rollup_activity(chunk_size, today):
+    """Attempts and XP events not rolled up yet, grouped by UTC day and user"""
+    def attempts(start, end):
+        day = daily(Attempt.created_at)
+        return select(day, Attempt.user_id, func.count(), func.sum(cast(Attempt.correct, Integer))).where(
+            Attempt.id > start, Attempt.id <= end).group_by(day, Attempt.user_id)
+
+    def xp(shard):
+        def aggregate(start, end):
+            day = daily(XpEvent.created_at)
+            query = select(day, XpEvent.user_id, func.sum(XpEvent.amount)).where(
+                XpEvent.id > start, XpEvent.id <= end).group_by(day, XpEvent.user_id)
+            shards = shard_map()
+            if shards is None:
+                return query
+            # The ledger is on the primary; each shard takes the events of its own users
+            return query.where(shards.refresh(db.engine).owned(XpEvent.user_id, shard))
+        return aggregate
+
+    for shard in range(shard_count()):
+        with using_shard(shard):
+            yield from rollup_log(ATTEMPT_ROLLUP, Attempt, attempts, ['attempts', 'correct_attempts'], chunk_size)
+            yield from rollup_log(XP_ROLLUP, XpEvent, xp(shard), ['xp_earned'], chunk_size, local=shard == 0)
+
+
+def run_job(name, chunk_size, today=None):
+    """Run one job to completion (or resume it); returns a JobResult"""
+    started = time.perf_counter()
+    scanned = changed = 0
+    for chunk_scanned, chunk_changed in JOBS[name](chunk_size, today or utcnow().date()):
+        scanned += chunk_scanned
+        changed += chunk_changed
+    return JobResult(scanned, changed, time.perf_counter() - started)
+
+
+@maintenance_cli.command('run')
+@click.argument('jobs', nargs=-1, type=click.Choice(sorted(JOBS)))
+@click.option('--chunk-size', default=MAINTENANCE_CONFIG['chunk_size'], show_default=True,
+              help='Ids covered by each statement and transaction.')
+@click.option('--today', type=click.DateTime(['%Y-%m-%d']), help='Run as of this UTC day (default: today).')
+def run_command(jobs, chunk_size, today):
+    """Run maintenance jobs (default: all), resuming from their checkpoints."""
+    for name in jobs or sorted(JOBS):
+        result = run_job(name, chunk_size, today and today.date())
+        rate = result.scanned / result.seconds if result.seconds else 0
+        click.echo(f'{name:<16} {result.scanned:>12,} rows scanned, {result.changed:>10,} changed '
+                   f'in {result.seconds:.2f}s ({rate:,.0f} rows/s)')
+
+
+@maintenance_cli.command('status')
+def status_command():
+    """Show each job's last checkpoint."""
+    count = shard_count()
+    for shard in range(count):
+        with using_shard(shard):
+            for name, run_key, position, updated_at in db.session.query(
+                    MaintenanceCheckpoint.job, MaintenanceCheckpoint.run_key, MaintenanceCheckpoint.position,
+                    MaintenanceCheckpoint.updated_at).order_by(MaintenanceCheckpoint.job):
+                label = f'{name}@{shard}' if count > 1 else name
+                click.echo(f'{label:<26} {run_key:<12} id {position:>12,}  at {updated_at:%Y-%m-%d %H:%M:%S} UTC')
@@ -0,0 +1,289 @@
+"""
+Request and SQL instrumentation
+SQLAlchemy cursor events count and time every statement issued while a request
+is being handled; Flask request hooks (registered in app.py) fold the per-request
+totals into per-endpoint histograms when the request ends. render() returns them
+in the Prometheus text format for /metrics. Requests served by the async
+endpoints in asgi.py are tracked the same way through track_request().
+
+Memory and overhead are bounded: labels are endpoint names (a fixed set), the
+histograms have fixed buckets, only METRICS_CONFIG['slow_statements'] statement
+shapes are kept, and the time spent in these hooks is itself exported as
+calcuingo_metrics_overhead_seconds_total. Metrics are per worker process.
+
+The output names tables, columns and slow statements, so /metrics only answers
+scrapes allowed by scrape_allowed(): a bearer token when METRICS_TOKEN is set,
+otherwise direct requests from the host itself.
+"""
+
+import hmac
+import ipaddress
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import METRICS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+UNMATCHED = '<unmatched>'  # Requests that matched no route (404s)
+
+# Metrics of an async request (asgi.py); Flask requests keep theirs on flask.g
+_task_metrics = ContextVar('request_metrics', default=None)
+
+_IN_LIST = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|%s)\s*,)+\s*(?:\?|%\(\w+\)s|%s)\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)  # Statement strings repeat (SQLAlchemy caches compiled SQL)
+def statement_shape(statement):
+    """Statement text with expanded IN lists collapsed, so N+1 variants compare equal"""
+    shape = _IN_LIST.sub('(?...)', _SPACES.sub(' ', statement).strip())
+    return shape[:METRICS_CONFIG['max_statement_length']]
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip((*self.bounds, '+Inf'), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class EndpointStats:
+    """Aggregates for one endpoint"""
+    __slots__ = ('latency', 'queries', 'sql_seconds', 'statuses', 'n_plus_one')
+
+    def __init__(self):
+        self.latency = Histogram(METRICS_CONFIG['latency_buckets'])
+        self.queries = Histogram(METRICS_CONFIG['query_count_buckets'])
+        self.sql_seconds = 0.0
+        self.statuses = Counter()
+        self.n_plus_one = 0
+
+
+class RequestMetrics:
+    """State of the request being handled, stored on flask.g"""
+    __slots__ = ('started', 'queries', 'sql_seconds', 'shapes', 'statement_started', 'status', 'overhead')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.shapes = Counter()
+        self.statement_started = None
+        self.status = None
+        self.overhead = 0.0
+
+
+class Registry:
+    """Process-wide aggregates; one lock acquisition per finished request"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.slow = {}  # statement shape -> slowest duration seen, at most `slow_statements` entries
+        self.slow_floor = 0.0  # Statements faster than this cannot enter a full `slow`
+        self.overhead_seconds = 0.0
+
+    def record(self, endpoint, metrics, elapsed):
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.latency.observe(elapsed)
+            stats.queries.observe(metrics.queries)
+            stats.sql_seconds += metrics.sql_seconds
+            stats.statuses[metrics.status or 500] += 1
+            if metrics.shapes and max(metrics.shapes.values()) > METRICS_CONFIG['n_plus_one_threshold']:
+                stats.n_plus_one += 1
+            self.overhead_seconds += metrics.overhead
+
+    def record_statement(self, shape, seconds):
+        """Keep the slowest distinct statement shapes"""
+        if seconds <= self.slow_floor:
+            return
+        with self.lock:
+            slow = self.slow
+            if seconds > slow.get(shape, 0.0):
+                slow[shape] = seconds
+                if len(slow) > METRICS_CONFIG['slow_statements']:
+                    del slow[min(slow, key=slow.get)]
+                if len(slow) >= METRICS_CONFIG['slow_statements']:
+                    self.slow_floor = min(slow.values())
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+            self.slow.clear()
+            self.slow_floor = 0.0
+            self.overhead_seconds = 0.0
+
+
+registry = Registry()
+
+
+def _current():
+    """Metrics of the request being handled, or None outside a request"""
+    if not has_request_context():
+        return _task_metrics.get()
+    return g.get('request_metrics')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current()
+    if metrics is not None:
+        metrics.statement_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current()
+    if metrics is None or metrics.statement_started is None:
+        return
+    now = time.perf_counter()
+    elapsed = now - metrics.statement_started
+    metrics.statement_started = None
+    shape = statement_shape(statement)
+    metrics.queries += 1
+    metrics.sql_seconds += elapsed
+    metrics.shapes[shape] += 1
+    registry.record_statement(shape, elapsed)
+    metrics.overhead += time.perf_counter() - now
+
+
+def start_request():
+    """before_request hook"""
+    if METRICS_CONFIG['enabled']:
+        g.request_metrics = RequestMetrics()
+
+
+def finish_response(response):
+    """after_request hook; remembers the status code"""
+    metrics = g.get('request_metrics')
+    if metrics is not None:
+        metrics.status = response.status_code
+    return response
+
+
+def finish_request(error=None):
+    """teardown_request hook (runs even if the view raised)"""
+    metrics = g.pop('request_metrics', None)
+    if metrics is None:
+        return
+    now = time.perf_counter()
+    endpoint = request.endpoint or UNMATCHED
+    repeated = [(shape, count) for shape, count in metrics.shapes.items()
+                if count > METRICS_CONFIG['n_plus_one_threshold']]
+    for shape, count in repeated:
+        logger.warning('Possible N+1 in %s: statement ran %d times: %s', endpoint, count, shape)
+    metrics.overhead += time.perf_counter() - now
+    registry.record(endpoint, metrics, now - metrics.started)
+
+
+@contextmanager
+def track_request(endpoint):
+    """
+    Collect metrics for a request handled outside Flask (the async endpoints)
+    Yields the RequestMetrics, or None when metrics are disabled; set .status on it.
+    """
+    if not METRICS_CONFIG['enabled']:
+        yield None
+        return
+    metrics = RequestMetrics()
+    token = _task_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _task_metrics.reset(token)
+        registry.record(endpoint, metrics, time.perf_counter() - metrics.started)
+
+
+def scrape_allowed(remote_addr, forwarded_for, authorization, token):
+    """
+    Whether a /metrics request may read the metrics
+    With a token, only `Authorization: Bearer <token>` is accepted. Without one,
+    only loopback peers are, and not when a proxy relayed the request for a client.
+    """
+    if token:
+        return hmac.compare_digest((authorization or '').encode(), f'Bearer {token}'.encode())
+    if forwarded_for or not remote_addr:
+        return False
+    try:
+        return ipaddress.ip_address(remote_addr).is_loopback
+    except ValueError:
+        return False
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    with registry.lock:
+        endpoints = sorted(registry.endpoints.items())
+
+        lines += ['# HELP calcuingo_request_duration_seconds Request latency by endpoint.',
+                  '# TYPE calcuingo_request_duration_seconds histogram']
+        for endpoint, stats in endpoints:
+            lines += stats.latency.lines('calcuingo_request_duration_seconds', f'endpoint="{_escape(endpoint)}"')
+
+        lines += ['# HELP calcuingo_request_queries SQL statements issued per request.',
+                  '# TYPE calcuingo_request_queries histogram']
+        for endpoint, stats in endpoints:
+            lines += stats.queries.lines('calcuingo_request_queries', f'endpoint="{_escape(endpoint)}"')
+
+        lines += ['# HELP calcuingo_request_sql_seconds_total Time spent in SQL by endpoint.',
+                  '# TYPE calcuingo_request_sql_seconds_total counter']
+        lines += [f'calcuingo_request_sql_seconds_total{{endpoint="{_escape(endpoint)}"}} {stats.sql_seconds:.6f}'
+                  for endpoint, stats in endpoints]
+
+        lines += ['# HELP calcuingo_requests_total Finished requests by endpoint and status.',
+                  '# TYPE calcuingo_requests_total counter']
+        lines += [f'calcuingo_requests_total{{endpoint="{_escape(endpoint)}",status="{status}"}} {count}'
+                  for endpoint, stats in endpoints for status, count in sorted(stats.statuses.items())]
+
+        lines += ['# HELP calcuingo_n_plus_one_total Requests that repeated one statement shape '
+                  'more than the N+1 threshold.',
+                  '# TYPE calcuingo_n_plus_one_total counter']
+        lines += [f'calcuingo_n_plus_one_total{{endpoint="{_escape(endpoint)}"}} {stats.n_plus_one}'
+                  for endpoint, stats in endpoints]
+
+        lines += ['# HELP calcuingo_slow_statement_seconds Slowest distinct statements seen by this worker.',
+                  '# TYPE calcuingo_slow_statement_seconds gauge']
+        lines += [f'calcuingo_slow_statement_seconds{{statement="{_escape(shape)}"}} {seconds:.6f}'
+                  for shape, seconds in sorted(registry.slow.items(), key=lambda item: -item[1])]
+
+        lines += ['# HELP calcuingo_metrics_overhead_seconds_total Time spent recording these metrics.',
+                  '# TYPE calcuingo_metrics_overhead_seconds_total counter',
+                  f'calcuingo_metrics_overhead_seconds_total {registry.overhead_seconds:.6f}']
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,153 @@
+"""
+Conditional GET and rendered-fragment caching for the server-rendered pages
+Lesson pages and the learning path get a strong ETag and a Last-Modified date
+derived from the content version, the templates and asset build, and the user's
+progress rows. A request whose validators still match is answered with 304 before
+anything is rendered.
+
+The parts of a page that only depend on content (a lesson's exercise list, a
+learning path card in a given state) are rendered once per content version and
+kept in a per-worker LRU bounded by PAGE_CACHE_CONFIG['fragment_cache_bytes'].
+"""
+
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import timezone
+
+from flask import current_app, make_response, render_template, request, session
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+
+from config import PAGE_CACHE_CONFIG
+from services.assets import get_manifest
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered HTML, bounded by the memory its strings use"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (html, size), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, html):
+        size = sys.getsizeof(html)
+        if size > self.max_bytes:
+            return  # Would evict everything else
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (html, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+fragments = FragmentCache(PAGE_CACHE_CONFIG['fragment_cache_bytes'])
+
+
+def render_fragment(template_name, key, **context):
+    """
+    Render a partial template, or reuse the HTML rendered for the same key
+    key must identify everything the partial depends on, including the content version
+    """
+    key = (template_name, *key)
+    html = fragments.get(key)
+    if html is None:
+        html = render_template(template_name, **context)
+        fragments.put(key, html)
+    return Markup(html)
+
+
+_templates_digest = None
+
+
+def templates_digest():
+    """Hash of the template sources, so a deploy that changes markup changes every ETag"""
+    global _templates_digest
+    if _templates_digest is None:
+        digest = hashlib.blake2b(digest_size=6)
+        root = os.path.join(current_app.root_path, current_app.template_folder)
+        for directory, subdirectories, files in sorted(os.walk(root)):
+            subdirectories.sort()
+            for name in sorted(files):
+                with open(os.path.join(directory, name), 'rb') as template:
+                    digest.update(name.encode())
+                    digest.update(template.read())
+        _templates_digest = digest.hexdigest()
+    return _templates_digest
+
+
+def _as_utc(moment):
+    # Timestamps are stored as UTC; SQLite hands them back without a timezone
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def page_validators(catalog, page, progress_rows=()):
+    """
+    (etag, last_modified) for a page built from `catalog` and the user's `progress_rows`
+    Returns None when the page must not be validated: it carries flash messages
+    that are only shown once.
+    """
+    if '_flashes' in session:
+        return None
+
+    digest = hashlib.blake2b(digest_size=8)
+    assets = sorted(get_manifest().items())  # A new asset build changes the links in every page
+    digest.update(f"{templates_digest()}|{assets}|{page}|{session.get('user_id', 0)}".encode())
+    last_modified = catalog.updated_at and _as_utc(catalog.updated_at)
+    for row in sorted(progress_rows, key=lambda row: row.lesson_id):
+        digest.update(f'|{row.lesson_id}:{row.completed}:{row.score}:{row.attempts}:{row.last_attempt}'.encode())
+        if row.last_attempt:
+            last_modified = max(filter(None, (last_modified, _as_utc(row.last_attempt))))
+
+    return f'v{catalog.version}-{digest.hexdigest()}', last_modified
+
+
+def conditional_page(validators, render):
+    """
+    Answer 304 if the client's copy is still current, else call render() for the page
+    Pages depend on the session cookie, so caches must revalidate them every time.
+    """
+    if validators is None:
+        response = make_response(render())
+        response.headers['Cache-Control'] = 'private, no-store'
+        return response
+
+    etag, last_modified = validators
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
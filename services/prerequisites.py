@@ -0,0 +1,85 @@
+"""
+Prerequisite graph for the learning path
+Built once per catalog load from Lesson.prerequisites and topologically sorted,
+so unlock states for a user are computed in a single linear pass.
+"""
+
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Node states shown on the learning path
+LOCKED = 'locked'
+AVAILABLE = 'available'
+COMPLETED = 'completed'
+
+
+class PrerequisiteCycleError(ValueError):
+    """Raised when lesson prerequisites form a cycle, which would lock those lessons forever"""
+
+
+class PrerequisiteGraph:
+    """DAG of lesson IDs, edges point from a prerequisite to the lessons it unlocks"""
+    __slots__ = ('order', 'prerequisites')
+
+    def __init__(self, lessons):
+        """
+        lessons: iterable of objects with .id and .prerequisites (sequence of lesson IDs),
+        in display order; that order breaks ties in the topological sort
+        """
+        lessons = list(lessons)
+        known = {lesson.id for lesson in lessons}
+
+        prerequisites = {}
+        for lesson in lessons:
+            required = []
+            for prerequisite_id in lesson.prerequisites:
+                if prerequisite_id in known:
+                    required.append(prerequisite_id)
+                else:
+                    logger.warning('Lesson %s lists unknown prerequisite %r, ignoring it', lesson.id, prerequisite_id)
+            prerequisites[lesson.id] = tuple(dict.fromkeys(required))  # Drop duplicates, keep order
+
+        self.prerequisites = prerequisites
+        self.order = self._topological_order(lessons, prerequisites)
+
+    @staticmethod
+    def _topological_order(lessons, prerequisites):
+        """Kahn's algorithm, O(V + E); raises PrerequisiteCycleError if a cycle exists"""
+        unlocks = {lesson.id: [] for lesson in lessons}
+        remaining = {}
+        for lesson_id, required in prerequisites.items():
+            remaining[lesson_id] = len(required)
+            for prerequisite_id in required:
+                unlocks[prerequisite_id].append(lesson_id)
+
+        ready = deque(lesson.id for lesson in lessons if remaining[lesson.id] == 0)
+        order = []
+        while ready:
+            lesson_id = ready.popleft()
+            order.append(lesson_id)
+            for next_id in unlocks[lesson_id]:
+                remaining[next_id] -= 1
+                if remaining[next_id] == 0:
+                    ready.append(next_id)
+
+        if len(order) != len(prerequisites):
+            stuck = sorted(lesson_id for lesson_id, count in remaining.items() if count > 0)
+            raise PrerequisiteCycleError(f'Lesson prerequisites contain a cycle involving lessons {stuck}')
+        return tuple(order)
+
+    def node_states(self, completed_ids):
+        """
+        Map every lesson ID to locked/available/completed for a user
+        A lesson is available once all of its prerequisites are completed
+        """
+        states = {}
+        for lesson_id in self.order:
+            if lesson_id in completed_ids:
+                states[lesson_id] = COMPLETED
+            elif all(prerequisite_id in completed_ids for prerequisite_id in self.prerequisites[lesson_id]):
+                states[lesson_id] = AVAILABLE
+            else:
+                states[lesson_id] = LOCKED
+        return states
@@ -0,0 +1,240 @@
+"""
+Rate limiting and write admission control
+Every answer submission is a write transaction, and on SQLite a write locks out all
+other writers, so one client submitting in a loop slows everyone down. Non-GET
+requests to the endpoints in RATE_LIMIT_CONFIG['limits'] are checked before the
+view runs:
+
+- Token buckets per user and per client IP: a bucket allows a burst of `burst`
+  requests and refills at a steady rate. A request that finds its bucket empty gets
+  a 429 with Retry-After (the seconds until the next token).
+- At most `max_concurrent_writes` of these requests run at once. A request that
+  gets no write slot within `write_wait_seconds` gets a 429 at once, instead of
+  queueing on the database lock until the worker times out.
+
+With the default memory backend the buckets and slots are per worker process.
+RATE_LIMIT_BACKEND=sqlite keeps them in a SQLite file in the instance folder, shared
+by the workers of a host: a check is one UPSERT on that local file, never a round
+trip to the application database.
+"""
+
+import math
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request, session
+
+from config import RATE_LIMIT_CONFIG
+from services.database import apply_sqlite_pragmas
+
+# app.extensions key of the app's bucket store
+RATE_LIMITS = 'rate_limits'
+
+SAFE_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+class RateLimited(Exception):
+    """The request is over a limit; the client should retry after `retry_after` seconds"""
+
+    def __init__(self, seconds):
+        super().__init__(f'rate limited, retry after {seconds:.1f}s')
+        self.retry_after = max(1, math.ceil(seconds))  # Whole seconds, rounded up, for the header
+
+
+class MemoryRateLimits:
+    """Buckets and write slots of this worker process"""
+
+    def __init__(self, max_buckets, max_concurrent_writes):
+        self.max_buckets = max_buckets
+        self.max_concurrent_writes = max_concurrent_writes
+        self.after_fork()
+
+    def after_fork(self):
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at), least recently used first
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_concurrent_writes) if self.max_concurrent_writes else None
+
+    def take(self, key, burst, per_second, now):
+        """Take a token from bucket `key`; returns 0 if there was one, else the seconds until there is"""
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + max(now - updated_at, 0) * per_second)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / per_second
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)  # Forgetting a bucket refills it: only idle ones go
+        return wait
+
+    def give_back(self, key, burst):
+        """Return a token taken from bucket `key` by a request that was refused after all"""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated_at = self._buckets[key]
+                self._buckets[key] = (min(burst, tokens + 1), updated_at)
+
+    def acquire_slot(self, timeout):
+        """A write slot to hand back with release_slot(), or None if none freed up within `timeout` seconds"""
+        if self._slots is None:
+            return True
+        return True if self._slots.acquire(timeout=timeout) else None
+
+    def release_slot(self, slot):
+        if self._slots is not None:
+            self._slots.release()
+
+
+class SqliteRateLimits:
+    """Buckets and write slots in a local SQLite file shared by the workers; one connection per thread"""
+
+    # Takes a token if the refilled bucket has one; returns a row only then
+    TAKE = ('INSERT INTO bucket (key, tokens, updated_at) VALUES (:key, :burst - 1, :now) '
+            'ON CONFLICT (key) DO UPDATE SET '
+            'tokens = min(:burst, tokens + max(:now - updated_at, 0) * :rate) - 1, updated_at = :now '
+            'WHERE min(:burst, tokens + max(:now - updated_at, 0) * :rate) >= 1 RETURNING tokens')
+    # Takes a slot if fewer than :limit unexpired ones are held (one statement, so atomic)
+    ACQUIRE = ('INSERT INTO write_slot (id, expires_at) SELECT :id, :expires_at '
+               'WHERE (SELECT count(*) FROM write_slot WHERE expires_at > :now) < :limit')
+
+    def __init__(self, path, max_concurrent_writes):
+        self.path = path
+        self.max_concurrent_writes = max_concurrent_writes
+        self._local = threading.local()
+        self._pruned_at = 0.0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, isolation_level=None)  # Autocommit: one statement each
+            apply_sqlite_pragmas(connection)
+            connection.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+                               'updated_at REAL NOT NULL) WITHOUT ROWID')
+            connection.execute('CREATE TABLE IF NOT EXISTS write_slot (id TEXT PRIMARY KEY, '
+                               'expires_at REAL NOT NULL) WITHOUT ROWID')
+            self._local.connection = connection
+        return connection
+
+    def after_fork(self):
+        # A forked worker inherits the parent's thread-local connection; it must open its own
+        self._local = threading.local()
+
+    def take(self, key, burst, per_second, now):
+        connection = self._connection()
+        if now - self._pruned_at > RATE_LIMIT_CONFIG['prune_interval_seconds']:
+            self._pruned_at = now
+            self.prune(now)
+        params = {'key': key, 'burst': burst, 'rate': per_second, 'now': now}
+        if connection.execute(self.TAKE, params).fetchone() is not None:
+            return 0.0
+        row = connection.execute('SELECT min(:burst, tokens + max(:now - updated_at, 0) * :rate) FROM bucket '
+                                 'WHERE key = :key', params).fetchone()
+        return max((1 - row[0]) / per_second, 0.0) if row else 0.0
+
+    def give_back(self, key, burst):
+        self._connection().execute('UPDATE bucket SET tokens = min(:burst, tokens + 1) WHERE key = :key',
+                                   {'key': key, 'burst': burst})
+
+    def acquire_slot(self, timeout):
+        if not self.max_concurrent_writes:
+            return True
+        slot = secrets.token_hex(8)
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.time()
+            acquired = self._connection().execute(self.ACQUIRE, {
+                'id': slot, 'expires_at': now + RATE_LIMIT_CONFIG['slot_lease_seconds'], 'now': now,
+                'limit': self.max_concurrent_writes
+            }).rowcount
+            if acquired:
+                return slot
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.01)  # The slots are held by other workers: poll until one is given back
+
+    def release_slot(self, slot):
+        if slot is not True:
+            self._connection().execute('DELETE FROM write_slot WHERE id = ?', (slot,))
+
+    def prune(self, now):
+        """Delete buckets idle long enough to be full again, and expired slots"""
+        refill = max((burst / per_second for limits in RATE_LIMIT_CONFIG['limits'].values()
+                      for burst, per_second in limits.values()), default=0)
+        connection = self._connection()
+        connection.execute('DELETE FROM bucket WHERE updated_at < ?', (now - refill,))
+        connection.execute('DELETE FROM write_slot WHERE expires_at <= ?', (now,))
+
+
+def rate_limit_store(app, backend):
+    """Bucket store for RATE_LIMIT_BACKEND: memory (the default), sqlite, or off (None: nothing is limited)"""
+    max_concurrent_writes = RATE_LIMIT_CONFIG['max_concurrent_writes']
+    if backend == 'off':
+        return None
+    if not backend or backend == 'memory':
+        return MemoryRateLimits(RATE_LIMIT_CONFIG['max_buckets'], max_concurrent_writes)
+    if backend == 'sqlite':
+        return SqliteRateLimits(os.path.join(app.instance_path, RATE_LIMIT_CONFIG['sqlite_file']),
+                                max_concurrent_writes)
+    raise ValueError(f'Unknown RATE_LIMIT_BACKEND {backend!r}: use memory, sqlite or off')
+
+
+def client_ip(remote_addr, forwarded_for):
+    """The client's address: the peer, or the X-Forwarded-For entry added by the outermost trusted proxy"""
+    proxies = RATE_LIMIT_CONFIG['trusted_proxies']
+    if not proxies or not forwarded_for:
+        return remote_addr
+    route = [address.strip() for address in forwarded_for.split(',')]
+    return route[max(len(route) - proxies, 0)]
+
+
+def admit_request(store, endpoint, limits, user_id, ip):
+    """
+    Take a token from the user's and the IP's bucket for `endpoint`, then a write slot
+    Returns the slot (give it back with store.release_slot()); raises RateLimited.
+    A request refused by either bucket costs no token from the other.
+    """
+    now = time.time()
+    user_key = f'{endpoint}:user:{user_id}' if user_id is not None and 'user' in limits else None
+    if user_key is not None:
+        wait = store.take(user_key, *limits['user'], now)
+        if wait:
+            raise RateLimited(wait)
+    if 'ip' in limits:
+        wait = store.take(f'{endpoint}:ip:{ip}', *limits['ip'], now)
+        if wait:
+            if user_key is not None:
+                store.give_back(user_key, limits['user'][0])
+            raise RateLimited(wait)
+    slot = store.acquire_slot(RATE_LIMIT_CONFIG['write_wait_seconds'])
+    if slot is None:
+        raise RateLimited(RATE_LIMIT_CONFIG['busy_retry_after_seconds'])
+    return slot
+
+
+def endpoint_limits(method, endpoint):
+    """The limits of a request, or None if it is not limited"""
+    if not RATE_LIMIT_CONFIG['enabled'] or method in SAFE_METHODS:
+        return None
+    return RATE_LIMIT_CONFIG['limits'].get(endpoint)
+
+
+def admit():
+    """before_request hook: raises RateLimited, or holds a write slot until the request ends"""
+    store = current_app.extensions[RATE_LIMITS]
+    limits = endpoint_limits(request.method, request.endpoint)
+    if store is None or limits is None:
+        return
+    ip = client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+    g.write_slot = admit_request(store, request.endpoint, limits, session.get('user_id'), ip)
+
+
+def release(error=None):
+    """teardown_request hook (runs even if the view raised)"""
+    slot = g.pop('write_slot', None)
+    if slot is not None:
+        current_app.extensions[RATE_LIMITS].release_slot(slot)
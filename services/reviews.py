@@ -0,0 +1,166 @@
+"""
+Spaced-repetition review scheduling (SM-2)
+Each graded answer moves its exercise's review_item for the user: a correct answer
+pushes the next review further out (1 day, 6 days, then interval x ease), a wrong
+one brings it back to tomorrow and lowers the ease. Correct answers given before
+an item is due leave its schedule alone, so re-answering a lesson in one sitting
+cannot inflate the intervals.
+
+The (user_id, next_due) index answers "the next K items due for this user" with a
+range scan. `flask reviews rebuild` replays the attempt log to recompute every
+schedule, in chunks of users (each on the shard holding their rows), and deletes
+the items of exercises that no longer exist.
+"""
+
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, delete, select
+
+from config import REVIEW_CONFIG
+from models import Attempt, Exercise, ReviewItem, User, db, utcnow
+from services.database import user_shards, using_shard
+from services.dbutil import upsert_rows
+
+reviews_cli = AppGroup('reviews', help='Maintain spaced-repetition schedules.')
+
+ReviewState = namedtuple('ReviewState', 'ease interval_days repetitions lapses last_reviewed_at next_due')
+
+# Columns of review_item besides the (user_id, exercise_id) key
+STATE_FIELDS = ReviewState._fields
+
+
+def new_state(now):
+    return ReviewState(REVIEW_CONFIG['initial_ease'], 0, 0, 0, now, now)
+
+
+def answer_quality(correct, latency_ms):
+    """SM-2 quality grade (0-5) of an answer"""
+    if not correct:
+        return 2
+    if latency_ms is None:
+        return 4
+    if latency_ms <= REVIEW_CONFIG['fast_answer_ms']:
+        return 5
+    return 3 if latency_ms > REVIEW_CONFIG['slow_answer_ms'] else 4
+
+
+def next_state(state, correct, latency_ms, now):
+    """The SM-2 schedule after one answer given at `now` (naive UTC, see models.utcnow)"""
+    if correct and now < state.next_due:
+        return state._replace(last_reviewed_at=now)  # Reviewed early: nothing new was learned
+
+    quality = answer_quality(correct, latency_ms)
+    ease = max(REVIEW_CONFIG['min_ease'], state.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if quality < 3:
+        repetitions, interval, lapses = 0, 1, state.lapses + 1
+    else:
+        repetitions, lapses = state.repetitions + 1, state.lapses
+        first, second = REVIEW_CONFIG['first_intervals']
+        if repetitions == 1:
+            interval = first
+        elif repetitions == 2:
+            interval = second
+        else:
+            interval = round(state.interval_days * ease)
+        interval = min(interval, REVIEW_CONFIG['max_interval_days'])
+    return ReviewState(ease, interval, repetitions, lapses, now, now + timedelta(days=interval))
+
+
+def schedule_reviews(session, user_id, answers, now):
+    """
+    Reschedule the exercises answered in one submission, in the caller's transaction
+    answers: sequence of (exercise_id, correct, latency_ms), in the order they were given
+    One SELECT of the current schedules and one upsert, whatever the batch size.
+    """
+    exercise_ids = {exercise_id for exercise_id, _, _ in answers}
+    states = {
+        row.exercise_id: ReviewState(*(getattr(row, field) for field in STATE_FIELDS))
+        for row in session.execute(select(ReviewItem).where(
+            ReviewItem.user_id == user_id, ReviewItem.exercise_id.in_(exercise_ids))).scalars()
+    }
+    for exercise_id, correct, latency_ms in answers:
+        state = states.get(exercise_id) or new_state(now)
+        states[exercise_id] = next_state(state, correct, latency_ms, now)
+
+    upsert_rows(session, ReviewItem, [
+        {'user_id': user_id, 'exercise_id': exercise_id, **states[exercise_id]._asdict()}
+        for exercise_id in sorted(exercise_ids)  # Stable order: concurrent batches lock rows alike
+    ], ['user_id', 'exercise_id'])
+
+
+def due_reviews(user_id, limit, now=None, session=None):
+    """The user's `limit` most overdue review items (range scan on ix_review_item_due)"""
+    session = session or db.session
+    now = now or utcnow()
+    return session.execute(
+        select(ReviewItem).where(ReviewItem.user_id == user_id, ReviewItem.next_due <= now)
+        .order_by(ReviewItem.next_due).limit(limit)
+    ).scalars().all()
+
+
+def replay_attempts(first_user_id, last_user_id, exercise_ids):
+    """Recompute the schedules of a range of users from the attempt log, for the exercises in `exercise_ids`"""
+    states = {}
+    attempts = db.session.query(
+        Attempt.user_id, Attempt.exercise_id, Attempt.correct, Attempt.latency_ms, Attempt.created_at
+    ).filter(Attempt.user_id.between(first_user_id, last_user_id)).order_by(Attempt.user_id, Attempt.id)
+    for user_id, exercise_id, correct, latency_ms, created_at in attempts.yield_per(5000):
+        if exercise_id not in exercise_ids:
+            continue  # The exercise was removed: it is not reviewed any more
+        key = (user_id, exercise_id)
+        states[key] = next_state(states.get(key) or new_state(created_at), correct, latency_ms, created_at)
+    return states
+
+
+def delete_orphaned_items(first_user_id, last_user_id, exercise_ids):
+    """
+    Delete a range of users' review items whose exercise is not in `exercise_ids`; returns how many
+    Items the replay merely did not produce are kept: one may belong to an answer
+    committed while this chunk was being replayed.
+    """
+    orphaned = [{'orphan_user_id': user_id, 'orphan_exercise_id': exercise_id}
+                for user_id, exercise_id in db.session.query(ReviewItem.user_id, ReviewItem.exercise_id)
+                .filter(ReviewItem.user_id.between(first_user_id, last_user_id))
+                if exercise_id not in exercise_ids]
+    if orphaned:
+        table = ReviewItem.__table__
+        db.session.execute(delete(table).where(table.c.user_id == bindparam('orphan_user_id'),
+                                               table.c.exercise_id == bindparam('orphan_exercise_id')), orphaned)
+    return len(orphaned)
+
+
+@reviews_cli.command('rebuild')
+@click.option('--chunk-size', default=1000, show_default=True, help='Users processed per transaction.')
+def rebuild_command(chunk_size):
+    """Recompute review schedules from the attempt log, in chunks of users; drops items of removed exercises."""
+    started = time.perf_counter()
+    exercise_ids = {exercise_id for (exercise_id,) in db.session.query(Exercise.id)}
+    last_id = 0
+    users = items = deleted = 0
+
+    while True:
+        user_ids = [row[0] for row in db.session.query(User.id).filter(User.id > last_id)
+                    .order_by(User.id).limit(chunk_size)]
+        if not user_ids:
+            break
+        first_id, last_id = user_ids[0], user_ids[-1]
+
+        for shard, low, high in user_shards(first_id, last_id):
+            with using_shard(shard):
+                states = replay_attempts(low, high, exercise_ids)
+                deleted += delete_orphaned_items(low, high, exercise_ids)
+                upsert_rows(db.session, ReviewItem, [
+                    {'user_id': user_id, 'exercise_id': exercise_id, **state._asdict()}
+                    for (user_id, exercise_id), state in states.items()
+                ], ['user_id', 'exercise_id'])
+            items += len(states)
+        db.session.commit()
+        users += len(user_ids)
+
+    elapsed = time.perf_counter() - started
+    click.echo(f'{users} users, {items} review items rebuilt in {elapsed:.1f}s '
+               f'({items / elapsed if elapsed else 0:,.0f} items/s); {deleted} of removed exercises deleted')
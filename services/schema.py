@@ -0,0 +1,279 @@
+"""
+Versioned schema migrations
+db.create_all() only creates missing tables, so changes to existing tables are
+made by the numbered migrations below. Applied versions are recorded in the
+schema_migration table and `flask db upgrade` (or `flask db setup`, which also
+adds the starter lessons to an empty database) runs the pending ones in order.
+Starting the app never touches the schema.
+
+Every migration checks the live schema before changing it, so it is also safe
+on databases where create_all() already built the latest tables. On PostgreSQL
+indexes are built with CREATE INDEX CONCURRENTLY, so writes are not blocked.
+
+Migrations run on the primary. The extra user shards (DATABASE_SHARD_URLS) get
+their per-user tables created at the current models by the same commands, so a
+future migration that changes one of those tables must also run on each shard.
+"""
+
+import time
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, delete, inspect, text, update
+
+from models import (DailyActivity, Exercise, ExerciseVariant, Lesson, MaintenanceCheckpoint, Progress, ReviewItem,
+                    SchemaMigration, ShardRange, db)
+from services.content import exercise_key, slugify
+from services.shards import create_shard_tables
+
+db_cli = AppGroup('db', help='Set up the database and manage schema migrations.')
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def _quote(name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+
+def has_column(table, column):
+    return column in {col['name'] for col in inspect(db.engine).get_columns(table)}
+
+
+def has_index(table, name):
+    return any(index['name'] == name for index in inspect(db.engine).get_indexes(table))
+
+
+def add_column(table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN unless the column exists; returns True if added"""
+    if has_column(table, column):
+        return False
+    db.session.execute(text(f'ALTER TABLE {_quote(table)} ADD COLUMN {_quote(column)} {ddl}'))
+    db.session.commit()
+    return True
+
+
+def create_index(name, table, columns, unique=False):
+    """
+    Create an index unless it exists; returns True if it was built
+    On PostgreSQL the build runs CONCURRENTLY (outside a transaction), and an
+    invalid index left behind by an interrupted concurrent build is rebuilt.
+    """
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    column_list = ', '.join(_quote(column) for column in columns)
+    db.session.commit()  # Data fixes made before the index must be visible to it
+
+    if _dialect() != 'postgresql':
+        if has_index(table, name):
+            return False
+        db.session.execute(text(f'CREATE {kind} {_quote(name)} ON {_quote(table)} ({column_list})'))
+        db.session.commit()
+        return True
+
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        valid = connection.execute(text(
+            'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name'
+        ), {'name': name}).scalar()
+        if valid:
+            return False
+        if valid is not None:
+            connection.execute(text(f'DROP INDEX CONCURRENTLY {_quote(name)}'))
+        connection.execute(text(f'CREATE {kind} CONCURRENTLY {_quote(name)} ON {_quote(table)} ({column_list})'))
+    return True
+
+
+def _merge_duplicate_progress():
+    """Collapse duplicate (user_id, lesson_id) progress rows into the oldest one"""
+    duplicates = db.session.query(Progress.user_id, Progress.lesson_id).group_by(
+        Progress.user_id, Progress.lesson_id
+    ).having(db.func.count(Progress.id) > 1).all()
+
+    progress = Progress.__table__
+    for user_id, lesson_id in duplicates:
+        rows = db.session.query(
+            Progress.id, Progress.completed, Progress.score, Progress.attempts, Progress.last_attempt
+        ).filter_by(user_id=user_id, lesson_id=lesson_id).order_by(Progress.id).all()
+        keeper, extras = rows[0], rows[1:]
+        db.session.execute(update(progress).where(progress.c.id == keeper.id).values(
+            completed=any(row.completed for row in rows),
+            score=max(row.score or 0.0 for row in rows),
+            attempts=sum(row.attempts or 0 for row in rows),
+            last_attempt=max(row.last_attempt for row in rows if row.last_attempt),
+        ))
+        db.session.execute(delete(progress).where(progress.c.id.in_([row.id for row in extras])))
+    return len(duplicates)
+
+
+def _assign_content_keys():
+    """
+    Give legacy lessons and exercises the slugs/keys a content import would use
+    Only the columns this migration knows about are read and written, so it does
+    not depend on columns that later migrations add to the models.
+    """
+    lessons = db.session.query(Lesson.id, Lesson.title, Lesson.order, Lesson.slug).order_by(
+        Lesson.order, Lesson.id).all()
+    taken = {slug for _, _, _, slug in lessons if slug is not None}
+    slugs = {lesson_id: slug for lesson_id, _, _, slug in lessons if slug is not None}
+    new_slugs = []
+    for lesson_id, title, _, slug in lessons:
+        if slug is not None:
+            continue
+        slug = slugify(title)
+        if slug in taken:
+            slug = f'{slug}-{lesson_id}'
+        slugs[lesson_id] = slug
+        taken.add(slug)
+        new_slugs.append({'row_id': lesson_id, 'new_slug': slug})
+
+    position = {}
+    new_keys = []
+    exercises = db.session.query(Exercise.id, Exercise.lesson_id, Exercise.order, Exercise.key).order_by(
+        Exercise.lesson_id, Exercise.order, Exercise.id)
+    for exercise_id, lesson_id, _, key in exercises:
+        position[lesson_id] = position.get(lesson_id, 0) + 1
+        if key is None:
+            new_keys.append({'row_id': exercise_id,
+                             'new_key': exercise_key(slugs.get(lesson_id, f'lesson-{lesson_id}'), position[lesson_id])})
+
+    lesson, exercise = Lesson.__table__, Exercise.__table__
+    if new_slugs:
+        db.session.execute(update(lesson).where(lesson.c.id == bindparam('row_id'))
+                           .values(slug=bindparam('new_slug')), new_slugs)
+    if new_keys:
+        db.session.execute(update(exercise).where(exercise.c.id == bindparam('row_id'))
+                           .values(key=bindparam('new_key')), new_keys)
+
+
+def migrate_progress_unique():
+    """Unique (user_id, lesson_id) on progress; duplicates left by the old read-then-insert code are merged"""
+    if has_index('progress', 'uq_progress_user_lesson'):
+        return
+    merged = _merge_duplicate_progress()
+    create_index('uq_progress_user_lesson', 'progress', ('user_id', 'lesson_id'), unique=True)
+    if merged:
+        click.echo(f'Merged {merged} duplicate progress records')
+
+
+def migrate_content_keys():
+    """lesson.slug / exercise.key content keys used by `flask content import`"""
+    add_column('lesson', 'slug', 'VARCHAR(120)')
+    add_column('exercise', 'key', 'VARCHAR(120)')
+    _assign_content_keys()
+    create_index('uq_lesson_slug', 'lesson', ('slug',), unique=True)
+    create_index('uq_exercise_key', 'exercise', ('key',), unique=True)
+
+
+def migrate_perfect_lessons():
+    """user_stats.perfect_lessons counter (run `flask stats rebuild` afterwards to fill it)"""
+    if add_column('user_stats', 'perfect_lessons', 'INTEGER NOT NULL DEFAULT 0'):
+        click.echo('Added user_stats.perfect_lessons; run `flask stats rebuild` to backfill it')
+
+
+def migrate_hot_query_indexes():
+    """Indexes for per-lesson progress lookups and ordered exercise loads"""
+    create_index('ix_progress_lesson_id', 'progress', ('lesson_id',))
+    create_index('ix_exercise_lesson_order', 'exercise', ('lesson_id', 'order'))
+
+
+def migrate_review_items():
+    """Add the review_item spaced-repetition table and its due-queue index"""
+    if not inspect(db.engine).has_table('review_item'):
+        ReviewItem.__table__.create(db.engine)
+        click.echo('Added review_item; run `flask reviews rebuild` to schedule past attempts')
+    create_index('ix_review_item_due', 'review_item', ('user_id', 'next_due'))
+
+
+def migrate_exercise_variants():
+    """exercise.generator and the exercise_variant pool table for parametric exercises"""
+    add_column('exercise', 'generator', 'VARCHAR(80)')
+    if not inspect(db.engine).has_table('exercise_variant'):
+        ExerciseVariant.__table__.create(db.engine)
+
+
+def migrate_maintenance_tables():
+    """daily_activity rollup and maintenance_checkpoint tables for `flask maintenance run`"""
+    for model in (DailyActivity, MaintenanceCheckpoint):
+        model.__table__.create(db.engine, checkfirst=True)
+
+
+def migrate_shard_ranges():
+    """shard_range map of user id ranges to shards, for `flask shards move`"""
+    ShardRange.__table__.create(db.engine, checkfirst=True)
+
+
+# (version, migration); never renumber or edit an applied migration, append a new one
+MIGRATIONS = [
+    (1, migrate_progress_unique),
+    (2, migrate_content_keys),
+    (3, migrate_perfect_lessons),
+    (4, migrate_hot_query_indexes),
+    (5, migrate_review_items),
+    (6, migrate_exercise_variants),
+    (7, migrate_maintenance_tables),
+    (8, migrate_shard_ranges),
+]
+
+
+def _describe(migration):
+    return migration.__doc__.splitlines()[0].strip()
+
+
+def applied_versions():
+    return {version for (version,) in db.session.query(SchemaMigration.version)}
+
+
+def upgrade(target=None, echo=lambda message: None):
+    """Apply pending migrations up to `target` (default: all); returns the versions applied"""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    done = applied_versions()
+    applied = []
+    for version, migration in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        started = time.perf_counter()
+        migration()
+        db.session.add(SchemaMigration(version=version, name=_describe(migration)))
+        db.session.commit()
+        applied.append(version)
+        echo(f'{version:>4}  {_describe(migration)} ({time.perf_counter() - started:.2f}s)')
+    return applied
+
+
+def ensure_schema():
+    """Apply pending migrations; call after db.create_all()"""
+    return upgrade()
+
+
+@db_cli.command('upgrade')
+@click.option('--target', type=int, help='Stop after this version.')
+def upgrade_command(target):
+    """Create missing tables and apply pending migrations."""
+    db.create_all()
+    applied = upgrade(target, echo=click.echo)
+    click.echo(f'{len(applied)} migration(s) applied' if applied else 'Schema is up to date')
+    if create_shard_tables():
+        click.echo('Per-user tables checked on every shard')
+
+
+@db_cli.command('setup')
+def setup_command():
+    """Create missing tables, apply pending migrations and add the starter lessons if there are none."""
+    db.create_all()
+    applied = upgrade(echo=click.echo)
+    click.echo(f'{len(applied)} migration(s) applied' if applied else 'Schema is up to date')
+    if create_shard_tables():
+        click.echo('Per-user tables checked on every shard')
+    if db.session.query(Lesson.id).first() is None:
+        from dummy_data import create_dummy_data
+        create_dummy_data()
+        click.echo(f'{db.session.query(Lesson).count()} starter lesson(s) added')
+
+
+@db_cli.command('status')
+def status_command():
+    """List migrations and whether they have been applied."""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    done = applied_versions()
+    for version, migration in MIGRATIONS:
+        click.echo(f"{version:>4}  {'applied' if version in done else 'pending':<8} {_describe(migration)}")
@@ -0,0 +1,238 @@
+"""
+Server-side sessions (optional)
+By default the whole Flask session travels in its signed cookie, which cannot be
+taken back before it expires. With SESSION_BACKEND=sqlite the cookie only carries
+a signed random id; the data lives in a local SQLite file shared by the workers on
+the host, and `flask sessions revoke USERNAME` ends all of a user's sessions at
+once. Reading a session is a primary-key lookup in that local file, never a round
+trip to the application database. SESSION_BACKEND=memory keeps sessions in the
+worker process, for single-process development servers.
+
+The session id is replaced whenever the logged-in user changes (login, logout), so
+an id handed out before login is never a valid id afterwards.
+"""
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, SessionInterface
+from flask.sessions import session_json_serializer
+from itsdangerous import BadSignature, Signer
+
+from config import SESSION_CONFIG
+from models import User, db
+from services.database import apply_sqlite_pragmas
+
+sessions_cli = AppGroup('sessions', help='Manage server-side sessions.')
+
+
+class ServerSession(SecureCookieSession):
+    """Session data kept in a SessionStore under `sid`"""
+
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.owner = self.get('user_id')  # Logged-in user when loaded; if it changes, so does the sid
+        self.accessed = False
+
+
+class SqliteSessionStore:
+    """Sessions in a local SQLite file; one connection per thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, isolation_level=None)  # Autocommit: one statement each
+            apply_sqlite_pragmas(connection)
+            connection.execute('CREATE TABLE IF NOT EXISTS session (id TEXT PRIMARY KEY, user_id INTEGER, '
+                               'data TEXT NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_session_user_id ON session (user_id)')
+            self._local.connection = connection
+        return connection
+
+    def after_fork(self):
+        # A forked worker inherits the parent's thread-local connection; it must open its own
+        self._local = threading.local()
+
+    def load(self, sid, now):
+        row = self._connection().execute(
+            'SELECT data FROM session WHERE id = ? AND expires_at > ?', (sid, now)).fetchone()
+        return row[0] if row else None
+
+    def save(self, sid, user_id, data, expires_at):
+        self._connection().execute(
+            'INSERT INTO session (id, user_id, data, expires_at) VALUES (?, ?, ?, ?) ON CONFLICT (id) DO UPDATE '
+            'SET user_id = excluded.user_id, data = excluded.data, expires_at = excluded.expires_at',
+            (sid, user_id, data, expires_at))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM session WHERE id = ?', (sid,))
+
+    def revoke_user(self, user_id):
+        """End every session of a user; returns how many there were"""
+        return self._connection().execute('DELETE FROM session WHERE user_id = ?', (user_id,)).rowcount
+
+    def prune(self, now):
+        """Delete expired sessions; returns how many"""
+        return self._connection().execute('DELETE FROM session WHERE expires_at <= ?', (now,)).rowcount
+
+
+class MemorySessionStore:
+    """Sessions in this process only (single-process development servers)"""
+
+    def __init__(self):
+        self._sessions = {}  # sid -> (user_id, data, expires_at)
+        self._lock = threading.Lock()
+
+    def load(self, sid, now):
+        entry = self._sessions.get(sid)
+        return entry[1] if entry and entry[2] > now else None
+
+    def save(self, sid, user_id, data, expires_at):
+        with self._lock:
+            self._sessions[sid] = (user_id, data, expires_at)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            revoked = [sid for sid, entry in self._sessions.items() if entry[0] == user_id]
+            for sid in revoked:
+                del self._sessions[sid]
+        return len(revoked)
+
+    def prune(self, now):
+        with self._lock:
+            expired = [sid for sid, entry in self._sessions.items() if entry[2] <= now]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface keeping the data in `store` and a signed session id in the cookie"""
+    salt = 'calcuingo-session-id'
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def load(self, app, cookie_value):
+        """The session a cookie value refers to (a new, empty one if it is missing, forged, expired or revoked)"""
+        if cookie_value:
+            try:
+                sid = self._signer(app).unsign(cookie_value).decode()
+            except BadSignature:
+                return ServerSession()
+            data = self.store.load(sid, time.time())
+            if data is not None:
+                return ServerSession(session_json_serializer.loads(data), sid)
+        return ServerSession()
+
+    def store_session(self, app, session):
+        """Save a session's data; returns the signed id to put in its cookie"""
+        if session.sid is None or session.get('user_id') != session.owner:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            session.sid, session.owner = secrets.token_urlsafe(32), session.get('user_id')
+        expires_at = time.time() + app.permanent_session_lifetime.total_seconds()
+        self.store.save(session.sid, session.get('user_id'), session_json_serializer.dumps(dict(session)), expires_at)
+        return self._signer(app).sign(session.sid).decode()
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None  # Flask falls back to a NullSession, as with cookie sessions
+        return self.load(app, request.cookies.get(self.get_cookie_name(app)))
+
+    def save_session(self, app, session, response):
+        name, domain, path = self.get_cookie_name(app), self.get_cookie_domain(app), self.get_cookie_path(app)
+        secure, httponly = self.get_cookie_secure(app), self.get_cookie_httponly(app)
+        samesite = self.get_cookie_samesite(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified:
+                if session.sid is not None:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+        response.set_cookie(name, self.store_session(app, session), expires=self.get_expiration_time(app, session),
+                            httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite)
+        response.vary.add('Cookie')
+
+
+def session_interface(app, backend):
+    """Session interface for SESSION_BACKEND: cookie (the default), sqlite or memory"""
+    if not backend or backend == 'cookie':
+        return SecureCookieSessionInterface()
+    if backend == 'sqlite':
+        return ServerSessionInterface(SqliteSessionStore(os.path.join(app.instance_path, SESSION_CONFIG['sqlite_file'])))
+    if backend == 'memory':
+        return ServerSessionInterface(MemorySessionStore())
+    raise ValueError(f'Unknown SESSION_BACKEND {backend!r}: use cookie, sqlite or memory')
+
+
+def load_cookie_session(app, cookie_value):
+    """Session for a cookie value, outside Flask's request handling (asgi.py); {} if there is none"""
+    interface = app.session_interface
+    if isinstance(interface, ServerSessionInterface):
+        return interface.load(app, cookie_value)
+    if not cookie_value:
+        return {}
+    try:
+        return interface.get_signing_serializer(app).loads(
+            cookie_value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+def session_cookie_value(app, session):
+    """Cookie value carrying `session` (for server-side sessions, after saving it)"""
+    interface = app.session_interface
+    if isinstance(interface, ServerSessionInterface):
+        return interface.store_session(app, session)
+    return interface.get_signing_serializer(app).dumps(dict(session))
+
+
+def server_store():
+    store = getattr(current_app.session_interface, 'store', None)
+    if not isinstance(store, SqliteSessionStore):
+        raise click.ClickException('Sessions are not stored server-side: set SESSION_BACKEND=sqlite')
+    return store
+
+
+@sessions_cli.command('revoke')
+@click.argument('username')
+def revoke_command(username):
+    """End every session of USERNAME (they have to log in again)."""
+    user_id = db.session.query(User.id).filter_by(username=username).scalar()
+    if user_id is None:
+        raise click.BadParameter(f'no user named {username!r}', param_hint='USERNAME')
+    click.echo(f'{server_store().revoke_user(user_id)} session(s) of {username} revoked')
+
+
+@sessions_cli.command('prune')
+def prune_command():
+    """Delete expired sessions."""
+    click.echo(f'{server_store().prune(time.time())} expired session(s) deleted')
@@ -0,0 +1,290 @@
+"""
+User-id shards
+With DATABASE_SHARD_URLS set, each user's learning state (SHARDED_TABLES in
+services/database.py) lives on one shard: the primary (shard 0) or one of those
+databases, which can be SQLite files or PostgreSQL schemas. The shard_range table
+on the primary maps ranges of user ids to shards; users outside every range are
+on shard 0. Users, the lesson catalog and the XP ledger stay on the primary.
+
+`flask shards move FIRST LAST TARGET` moves a range of users while the app keeps
+serving, one chunk of users at a time:
+
+    1. freeze   the chunk is marked moving_to=TARGET; its users can still read,
+                but their writes get 503 with Retry-After
+    2. wait     SHARD_CONFIG['move_grace_seconds'], so every worker has seen the
+                freeze and writes already under way have committed
+    3. copy     the chunk's rows are copied in one transaction on the target
+                (replacing any partial copy), with new surrogate ids
+    4. flip     the chunk is mapped to TARGET; its users write again
+    5. purge    after another grace period (for workers still reading the old
+                map) the rows are deleted from the source
+
+Every step is recorded in shard_range, so an interrupted move is finished by
+running the same command again. Run one move at a time.
+
+daily_activity moves with the user. Because the copied attempts get new ids, and
+each shard's rollup checkpoint is its own, the copied rollup rows are adjusted
+so that the target's next `flask maintenance run activity-rollup` neither
+counts an attempt or XP event twice nor skips one.
+"""
+
+import time
+from collections import namedtuple
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Integer, cast, delete, func, insert, select, update
+
+from config import SHARD_CONFIG
+from models import (Attempt, DailyActivity, MaintenanceCheckpoint, Progress, ReviewItem, ShardRange, User,
+                    UserBadge, UserStats, XpEvent, db, utcnow)
+from services.database import SHARD_LOCAL_TABLES, MappedRange, shard_count, shard_key, shard_map
+from services.maintenance import ATTEMPT_ROLLUP, XP_ROLLUP, daily
+
+shards_cli = AppGroup('shards', help='Inspect the user-id shards and move users between them.')
+
+# Per-user tables in copy order, and whether their id is a surrogate key the target assigns anew
+MOVED_TABLES = [(UserStats, False), (Progress, True), (Attempt, True), (UserBadge, True), (ReviewItem, False)]
+
+# One chunk of a move: users first..last, rows copied, seconds their writes were paused
+MoveStep = namedtuple('MoveStep', 'first last rows paused')
+
+
+def engine(shard):
+    """Engine of a shard (the primary for shard 0)"""
+    return db.engines[shard_key(shard)] if shard else db.engine
+
+
+def create_shard_tables():
+    """Create the per-user tables missing on the extra shards; returns the number of shards checked"""
+    tables = [db.metadata.tables[name] for name in sorted(SHARD_LOCAL_TABLES)]
+    for shard in range(1, shard_count()):
+        db.metadata.create_all(engine(shard), tables=tables)
+    return shard_count() - 1
+
+
+def assign(ranges, first, last, shard, moving_to=None, moved_from=None):
+    """The map `ranges` (sorted, non-overlapping MappedRanges) with users first..last reassigned"""
+    result = [MappedRange(first, last, shard, moving_to, moved_from)]
+    for entry in ranges:
+        if entry.last_user_id < first or entry.first_user_id > last:
+            result.append(entry)
+            continue
+        if entry.first_user_id < first:
+            result.append(entry._replace(last_user_id=first - 1))
+        if entry.last_user_id > last:
+            result.append(entry._replace(first_user_id=last + 1))
+    merged = []
+    for entry in sorted(result):
+        if merged and merged[-1].last_user_id + 1 == entry.first_user_id and merged[-1][2:] == entry[2:]:
+            merged[-1] = merged[-1]._replace(last_user_id=entry.last_user_id)
+        else:
+            merged.append(entry)
+    return [entry for entry in merged if entry[2:] != (0, None, None)]  # Shard 0 is the default
+
+
+def update_map(changes):
+    """
+    Apply [(first, last, shard, moving_to, moved_from)] to shard_range and commit
+    Returns the new map, which this process uses from now on.
+    """
+    ranges = [MappedRange(*row) for row in db.session.query(
+        ShardRange.first_user_id, ShardRange.last_user_id, ShardRange.shard, ShardRange.moving_to,
+        ShardRange.moved_from).order_by(ShardRange.first_user_id)]
+    for change in changes:
+        ranges = assign(ranges, *change)
+    db.session.query(ShardRange).delete()
+    now = utcnow()
+    db.session.add_all([ShardRange(**entry._asdict(), updated_at=now) for entry in ranges])
+    db.session.commit()
+    shards = shard_map()
+    shards.load(db.engine)
+    return shards
+
+
+def checkpoint(connection, job, lock=False):
+    """Position of a rollup checkpoint on a shard's connection (0 if it never ran)"""
+    query = select(MaintenanceCheckpoint.position).where(
+        MaintenanceCheckpoint.job == job, MaintenanceCheckpoint.run_key == 'log')
+    return connection.execute(query.with_for_update() if lock else query).scalar() or 0
+
+
+def rolled_up_activity(source, first, last):
+    """
+    The chunk's daily_activity rows on the source, and the rollup checkpoints they reflect
+    Read again until no rollup chunk committed in between, so the two match.
+    """
+    while True:
+        marks = checkpoint(source, ATTEMPT_ROLLUP), checkpoint(source, XP_ROLLUP)
+        rows = source.execute(select(DailyActivity.__table__).where(
+            DailyActivity.user_id.between(first, last))).all()
+        if marks == (checkpoint(source, ATTEMPT_ROLLUP), checkpoint(source, XP_ROLLUP)):
+            return {(row.day, row.user_id): row._asdict() for row in rows}, marks
+
+
+def adjust(activity, rows, columns, sign):
+    """Add (sign=1) or remove (sign=-1) (day, user_id, *values) rows from the activity dict"""
+    for day, user_id, *values in rows:
+        row = activity.setdefault((day, user_id), {'day': day, 'user_id': user_id, 'attempts': 0,
+                                                   'correct_attempts': 0, 'xp_earned': 0})
+        for name, value in zip(columns, values):
+            row[name] += sign * (value or 0)
+
+
+def delete_users(connection, first, last):
+    """
+    Delete the rows of users first..last from a shard, in the caller's transaction
+    SQLite numbers a new row max(id) + 1, so once the newest attempts are deleted the
+    next ones would reuse ids at or below the rollup checkpoint, and the rollup would
+    skip them. The checkpoint is lowered to the newest remaining attempt instead: no
+    attempt is left between the two, so none is counted twice.
+    """
+    for model, _ in [*MOVED_TABLES, (DailyActivity, False)]:
+        connection.execute(delete(model.__table__).where(model.user_id.between(first, last)))
+    if checkpoint(connection, ATTEMPT_ROLLUP, lock=True):
+        newest = connection.execute(select(func.max(Attempt.id))).scalar() or 0
+        connection.execute(update(MaintenanceCheckpoint.__table__).where(
+            MaintenanceCheckpoint.job == ATTEMPT_ROLLUP, MaintenanceCheckpoint.run_key == 'log',
+            MaintenanceCheckpoint.position > newest
+        ).values(position=newest, updated_at=utcnow()))
+
+
+def copy_users(source_shard, target_shard, first, last):
+    """
+    Copy users first..last from one shard to another in a single target transaction
+    Rows the target already holds for them (from an interrupted copy) are replaced.
+    Returns the number of rows copied.
+    """
+    batch_size = SHARD_CONFIG['copy_batch_size']
+    copied = 0
+    with engine(target_shard).connect() as target, target.begin(), engine(source_shard).connect() as source:
+        # Deleting first also takes the target's write lock, so its rollup cannot move on meanwhile
+        delete_users(target, first, last)
+        target_xp = checkpoint(target, XP_ROLLUP, lock=True)
+        activity, (source_attempts, source_xp) = rolled_up_activity(source, first, last)
+
+        for model, surrogate in MOVED_TABLES:
+            table = model.__table__
+            columns = [column for column in table.c if not (surrogate and column.name == 'id')]
+            result = source.execution_options(yield_per=batch_size).execute(
+                select(*columns).where(model.user_id.between(first, last)).order_by(*table.primary_key))
+            for rows in result.partitions():
+                target.execute(insert(table), [row._asdict() for row in rows])
+                copied += len(rows)
+
+        # The target's rollup counts every copied attempt again (they all get ids past its
+        # checkpoint): take out the ones the source had counted
+        adjust(activity, source.execute(
+            select(daily(Attempt.created_at), Attempt.user_id, func.count(), func.sum(cast(Attempt.correct, Integer)))
+            .where(Attempt.user_id.between(first, last), Attempt.id <= source_attempts)
+            .group_by(daily(Attempt.created_at), Attempt.user_id)), ['attempts', 'correct_attempts'], -1)
+        # XP events are counted up to the target's ledger checkpoint from now on
+        if source_xp != target_xp:
+            with db.engine.connect() as primary:
+                adjust(activity, primary.execute(
+                    select(daily(XpEvent.created_at), XpEvent.user_id, func.sum(XpEvent.amount))
+                    .where(XpEvent.user_id.between(first, last), XpEvent.id > min(source_xp, target_xp),
+                           XpEvent.id <= max(source_xp, target_xp))
+                    .group_by(daily(XpEvent.created_at), XpEvent.user_id)),
+                    ['xp_earned'], 1 if target_xp > source_xp else -1)
+        rows = [row for row in activity.values() if row['attempts'] or row['correct_attempts'] or row['xp_earned']]
+        if rows:
+            target.execute(insert(DailyActivity.__table__), rows)
+        copied += len(rows)
+    return copied
+
+
+def purge_users(shard, first, last):
+    """Delete the stale copy of users first..last from a shard they were moved off"""
+    with engine(shard).begin() as connection:
+        delete_users(connection, first, last)
+
+
+def move_chunk(first, last, target):
+    """Move users first..last to `target` (finishing any interrupted step on the way); returns a MoveStep"""
+    grace = SHARD_CONFIG['move_grace_seconds']
+    rows = 0
+    paused = 0.0
+    while True:
+        pieces = shard_map().refresh(db.engine).pieces(first, last)
+        if all(piece.shard == target and piece.moving_to is None and piece.moved_from is None for piece in pieces):
+            return MoveStep(first, last, rows, paused)
+
+        stale = [piece for piece in pieces if piece.moved_from is not None]
+        for piece in stale:
+            purge_users(piece.moved_from, piece.first_user_id, piece.last_user_id)
+        if stale:
+            update_map([(piece.first_user_id, piece.last_user_id, piece.shard, piece.moving_to, None)
+                        for piece in stale])
+            continue
+
+        frozen_at = time.perf_counter()
+        to_freeze = [piece for piece in pieces if piece.moving_to is None and piece.shard != target]
+        if to_freeze:
+            update_map([(piece.first_user_id, piece.last_user_id, piece.shard, target, None) for piece in to_freeze])
+            time.sleep(grace)
+
+        moving = [piece for piece in shard_map().pieces(first, last) if piece.moving_to is not None]
+        for piece in moving:
+            rows += copy_users(piece.shard, piece.moving_to, piece.first_user_id, piece.last_user_id)
+        update_map([(piece.first_user_id, piece.last_user_id, piece.moving_to, None, piece.shard)
+                    for piece in moving])
+        paused += time.perf_counter() - frozen_at
+        time.sleep(grace)  # Workers with the old map may still read the source
+
+
+def move(first, last, target, chunk_size):
+    """Move users first..last to shard `target` a chunk at a time, yielding a MoveStep per chunk"""
+    start = first
+    while start <= last:
+        ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.id >= start, User.id <= last)
+               .order_by(User.id).limit(chunk_size)]
+        db.session.rollback()
+        end = ids[-1] if len(ids) == chunk_size else last
+        yield move_chunk(start, end, target)
+        start = end + 1
+
+
+@shards_cli.command('status')
+def status_command():
+    """List the shards and the user ranges assigned to them."""
+    count = shard_count()
+    for shard in range(count):
+        click.echo(f'shard {shard}  {engine(shard).url.render_as_string(hide_password=True)}')
+    if count == 1:
+        click.echo('Not sharded: set DATABASE_SHARD_URLS to add shards')
+        return
+    for entry in shard_map().refresh(db.engine).ranges:
+        state = ''
+        if entry.moving_to is not None:
+            state = f'  moving to shard {entry.moving_to}'
+        elif entry.moved_from is not None:
+            state = f'  stale copy on shard {entry.moved_from}'
+        click.echo(f'users {entry.first_user_id:>10}-{entry.last_user_id:<10} shard {entry.shard}{state}')
+    click.echo('Users outside these ranges are on shard 0')
+
+
+@shards_cli.command('move')
+@click.argument('first_user_id', type=int)
+@click.argument('last_user_id', type=int)
+@click.argument('target', type=int)
+@click.option('--chunk-size', default=SHARD_CONFIG['move_chunk_users'], show_default=True,
+              help='Users moved per step; only they are paused while their rows are copied.')
+def move_command(first_user_id, last_user_id, target, chunk_size):
+    """Move users FIRST_USER_ID..LAST_USER_ID to shard TARGET while the app keeps serving."""
+    count = shard_count()
+    if count == 1:
+        raise click.ClickException('Not sharded: set DATABASE_SHARD_URLS first')
+    if not 0 <= target < count:
+        raise click.ClickException(f'There is no shard {target} (shards 0-{count - 1})')
+    if first_user_id > last_user_id:
+        raise click.ClickException('FIRST_USER_ID is after LAST_USER_ID')
+
+    started = time.perf_counter()
+    rows = 0
+    for step in move(first_user_id, last_user_id, target, chunk_size):
+        rows += step.rows
+        click.echo(f'users {step.first:>10}-{step.last:<10} {step.rows:>10,} rows copied, '
+                   f'writes paused {step.paused:.1f}s')
+    elapsed = time.perf_counter() - started
+    click.echo(f'{rows:,} rows moved to shard {target} in {elapsed:.1f}s')
@@ -0,0 +1,122 @@
+"""
+Worker startup
+A new worker used to compile every Jinja template on its first requests and load
+the catalog on its first page view. The compiled templates are now kept in a
+bytecode cache in the instance folder (filled by `flask templates compile` or by
+the first worker that needs them), and warm_up() does the remaining work once, in
+the gunicorn master when it runs with --preload (see wsgi.py): the forked workers
+inherit the compiled templates and the catalog and answer their first request
+straight away.
+
+State that must not be shared by processes is reset in every forked child:
+database connections (the pools are replaced, without closing the parent's
+sockets), the thread-local connections of the SQLite session and rate limit
+stores, the per-worker rate limit buckets and write slots, and the per-worker
+request metrics.
+"""
+
+import gc
+import logging
+import os
+import time
+import weakref
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.exc import DBAPIError
+
+from config import STARTUP_CONFIG
+from models import db
+from services import metrics
+from services.ratelimit import RATE_LIMITS
+from services.sessions import SqliteSessionStore
+
+logger = logging.getLogger(__name__)
+
+templates_cli = AppGroup('templates', help='Precompile Jinja templates.')
+
+# Apps built in this process; their state is reset in forked children
+_apps = weakref.WeakSet()
+
+
+def bytecode_cache_dir(app):
+    return os.path.join(app.instance_path, STARTUP_CONFIG['bytecode_cache_dir'])
+
+
+def init_app(app):
+    """Give the app a persistent template bytecode cache and reset its per-process state after fork"""
+    directory = bytecode_cache_dir(app)
+    os.makedirs(directory, exist_ok=True)
+    # Must be set before app.jinja_env is first used, which creates the environment
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(directory)}
+    _apps.add(app)
+
+
+def precompile_templates(app):
+    """Compile every template into the environment's cache (and the bytecode cache); returns how many"""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def warm_up(app):
+    """
+    Do the work of a worker's first requests ahead of time
+    With gunicorn --preload this runs once in the master, before the workers are forked.
+    """
+    from services.assets import get_manifest
+    from services.catalog import get_catalog
+    from services.pagecache import templates_digest
+
+    with app.app_context():
+        if STARTUP_CONFIG['precompile_templates']:
+            precompile_templates(app)
+        templates_digest()
+        get_manifest()
+        if STARTUP_CONFIG['warm_catalog']:
+            try:
+                get_catalog()
+            except DBAPIError as error:
+                # Workers still start; their requests fail the same way until the database is set up
+                logger.warning('Catalog not loaded (%s); run `flask db setup`', error.orig)
+            finally:
+                db.session.remove()
+        # Connections must not be inherited by the workers: close them here, while nothing uses them
+        for engine in db.engines.values():
+            engine.dispose()
+    # Everything loaded so far lives as long as the process: keep the workers' garbage collector off
+    # those objects, so it does not write to (and copy) the memory pages they share with the master
+    gc.freeze()
+
+
+def _reset_after_fork():
+    for app in list(_apps):
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)  # The parent keeps using its sockets; the child opens its own
+        store = getattr(app.session_interface, 'store', None)
+        if isinstance(store, SqliteSessionStore):
+            store.after_fork()
+        limits = app.extensions[RATE_LIMITS]
+        if limits is not None:
+            limits.after_fork()
+    metrics.registry.reset()  # Each worker reports its own requests
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@templates_cli.command('compile')
+@click.option('--clear', is_flag=True, help='Delete the cached bytecode first.')
+def compile_command(clear):
+    """Compile every template into the bytecode cache (run after each deploy)."""
+    if clear:
+        current_app.jinja_env.bytecode_cache.clear()
+    started = time.perf_counter()
+    compiled = precompile_templates(current_app)
+    elapsed = time.perf_counter() - started
+    click.echo(f'{compiled} template(s) compiled into {bytecode_cache_dir(current_app)} in {elapsed:.2f}s')
@@ -0,0 +1,143 @@
+"""
+Per-user learning statistics
+Reads come from the UserStats summary row; `flask stats rebuild` recomputes the
+summaries from the attempt log for recovery or to check for drift. On a sharded
+database each chunk of users is rebuilt on the shard holding their rows.
+"""
+
+import time
+
+import click
+from flask.cli import AppGroup
+
+from models import Attempt, Exercise, Progress, User, UserStats, db
+from services.database import user_shards, using_shard
+
+stats_cli = AppGroup('stats', help='Maintain per-user statistics.')
+
+STAT_FIELDS = ('total_attempts', 'correct_attempts', 'completed_lessons', 'perfect_lessons')
+
+
+def get_user_stats(user_id):
+    """Summary row for a user (an empty one if they have not submitted anything yet)"""
+    return db.session.get(UserStats, user_id) or blank_user_stats(user_id)
+
+
+def blank_user_stats(user_id):
+    """Unsaved all-zero UserStats for a user without a summary row"""
+    return UserStats(user_id=user_id, total_attempts=0, correct_attempts=0,
+                     completed_lessons=0, perfect_lessons=0)
+
+
+def empty_stats():
+    return {**dict.fromkeys(STAT_FIELDS, 0), 'last_attempt_at': None}
+
+
+def compute_stats(first_user_id, last_user_id):
+    """
+    Recompute aggregates for a range of user IDs straight from the attempt log
+    Users whose history predates the log keep SUM(progress.attempts) as their total.
+    """
+    stats = {}
+
+    logged = db.session.query(
+        Attempt.user_id,
+        db.func.count(Attempt.id),
+        db.func.sum(db.case((Attempt.correct, 1), else_=0)),
+        db.func.max(Attempt.created_at)
+    ).filter(Attempt.user_id.between(first_user_id, last_user_id)).group_by(Attempt.user_id)
+    for user_id, total, correct, last_attempt_at in logged:
+        stats[user_id] = empty_stats()
+        stats[user_id].update(total_attempts=total, correct_attempts=correct or 0,
+                              last_attempt_at=last_attempt_at)
+
+    # A perfect lesson is one whose first logged attempt was correct (see record_submission).
+    # Exercises are mapped to lessons here, not joined: the log may be on a shard without the catalog.
+    lesson_of = dict(db.session.query(Exercise.id, Exercise.lesson_id))
+    first_attempts = db.session.query(db.func.min(Attempt.id).label('id')).filter(
+        Attempt.user_id.between(first_user_id, last_user_id)
+    ).group_by(Attempt.user_id, Attempt.exercise_id).subquery()
+    firsts = {}
+    for user_id, exercise_id, attempt_id, correct in db.session.query(
+            Attempt.user_id, Attempt.exercise_id, Attempt.id, Attempt.correct
+    ).join(first_attempts, first_attempts.c.id == Attempt.id):
+        key = (user_id, lesson_of.get(exercise_id))
+        if key[1] is not None and (key not in firsts or attempt_id < firsts[key][0]):
+            firsts[key] = (attempt_id, correct)
+    for (user_id, _), (_, correct) in firsts.items():
+        if correct:
+            stats[user_id]['perfect_lessons'] += 1
+
+    progress = db.session.query(
+        Progress.user_id,
+        db.func.sum(db.case((Progress.completed, 1), else_=0)),
+        db.func.sum(Progress.attempts)
+    ).filter(Progress.user_id.between(first_user_id, last_user_id)).group_by(Progress.user_id)
+    for user_id, completed, attempts in progress:
+        row = stats.setdefault(user_id, empty_stats())
+        row['completed_lessons'] = completed or 0
+        row['total_attempts'] = max(row['total_attempts'], attempts or 0)
+    return stats
+
+
+def rebuild_users(user_ids, check):
+    """Compare (and unless `check`, fix) the stored stats of sorted user ids; returns how many drifted"""
+    first_id, last_id = user_ids[0], user_ids[-1]
+    fresh = compute_stats(first_id, last_id)
+    stored = {row.user_id: row for row in UserStats.query.filter(UserStats.user_id.between(first_id, last_id))}
+    drifted = 0
+
+    for user_id in user_ids:
+        values = fresh.get(user_id)
+        row = stored.get(user_id)
+        if values is None and row is None:
+            continue
+        values = values or empty_stats()
+        if row is not None and all(getattr(row, field) == values[field] for field in STAT_FIELDS):
+            continue
+
+        drifted += 1
+        if check:
+            current = {field: getattr(row, field) for field in STAT_FIELDS} if row else None
+            click.echo(f'user {user_id}: stored={current} expected={ {f: values[f] for f in STAT_FIELDS} }')
+        elif row is None:
+            db.session.add(UserStats(user_id=user_id, **values))
+        else:
+            for field, value in values.items():
+                setattr(row, field, value)
+    db.session.flush()  # Inside the shard's using_shard()
+    return drifted
+
+
+@stats_cli.command('rebuild')
+@click.option('--chunk-size', default=1000, show_default=True, help='Users processed per transaction.')
+@click.option('--check', is_flag=True, help='Only report users whose stored stats drifted.')
+def rebuild_command(chunk_size, check):
+    """Recompute user_stats from the attempt log, in chunks of users."""
+    started = time.perf_counter()
+    last_id = 0
+    users = drifted = 0
+
+    while True:
+        user_ids = [row[0] for row in db.session.query(User.id).filter(User.id > last_id)
+                    .order_by(User.id).limit(chunk_size)]
+        if not user_ids:
+            break
+        first_id, last_id = user_ids[0], user_ids[-1]
+
+        for shard, low, high in user_shards(first_id, last_id):
+            piece = [user_id for user_id in user_ids if low <= user_id <= high]
+            if piece:
+                with using_shard(shard):
+                    drifted += rebuild_users(piece, check)
+
+        users += len(user_ids)
+        if check:
+            db.session.rollback()
+        else:
+            db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    action = 'drifted' if check else 'rebuilt'
+    click.echo(f'{users} users scanned, {drifted} {action} in {elapsed:.1f}s '
+               f'({users / elapsed if elapsed else 0:,.0f} users/s)')
@@ -0,0 +1,136 @@
+"""
+Write path for exercise submissions and lesson completion
+Progress is upserted on (user_id, lesson_id) and XP is incremented inside the
+database, so concurrent submits from several workers never lose updates and a
+lesson only ever awards its XP once. Every submission is also appended to the
+attempt log and folded into the user's UserStats row in the same transaction.
+A batch of answers for one lesson is written with the same few statements.
+
+None of these functions commit: the caller owns the transaction.
+"""
+
+from collections import namedtuple
+from sqlalchemy import insert, select, update
+
+from models import Attempt, Progress, User, UserStats, XpEvent, db, utcnow
+from services.dbutil import upsert_counters
+from services.identity import user_changed
+from services.reviews import schedule_reviews
+
+# Outcome of a write: xp_earned is 0 unless this write completed the lesson first.
+# first_try is True when this was the user's first logged attempt at the lesson and it was correct.
+# correct_answers counts the correct answers logged by this write.
+SubmissionResult = namedtuple('SubmissionResult', 'first_completion xp_earned first_try correct_answers')
+NOT_COMPLETED = SubmissionResult(False, 0, False, 0)
+
+
+def upsert_progress(session, user_id, lesson_id, attempts, now):
+    """
+    Create the (user_id, lesson_id) progress row or add `attempts` to it
+    Relies on the uq_progress_user_lesson unique constraint
+    """
+    upsert_counters(session, Progress, {'user_id': user_id, 'lesson_id': lesson_id},
+                    {'attempts': attempts}, {'last_attempt': now})
+
+
+def mark_completed(session, user_id, lesson_id):
+    """
+    Flip the progress row to completed
+    Returns True only for the transaction that completed it first: the WHERE clause
+    re-checks completed under the row lock, so concurrent submits cannot both win.
+    """
+    result = session.execute(
+        update(Progress)
+        .where(Progress.user_id == user_id, Progress.lesson_id == lesson_id, Progress.completed.is_(False))
+        .values(completed=True, score=1.0)
+    )
+    return result.rowcount == 1
+
+
+def award_xp(session, user_id, amount):
+    """
+    Add XP in the database (xp = xp + :amount) instead of read-modify-write in Python
+    The award is also written to the xp_event ledger that feeds the leaderboards
+    """
+    if amount:
+        session.execute(
+            update(User).where(User.id == user_id).values(xp=db.func.coalesce(User.xp, 0) + amount)
+        )
+        session.execute(insert(XpEvent).values(user_id=user_id, amount=amount))
+        user_changed(session, user_id)  # Workers drop their cached snapshot once this commits
+
+
+def is_first_attempt(session, user_id, lesson, logged=1):
+    """
+    True if the `logged` attempts just written are the user's only ones on this lesson
+    Runs after the progress upsert, so concurrent submits for the lesson are
+    serialized on the progress row and cannot both see themselves as first.
+    """
+    exercise_ids = [exercise.id for exercise in lesson.exercises]
+    found = session.execute(select(Attempt.id).where(
+        Attempt.user_id == user_id, Attempt.exercise_id.in_(exercise_ids)).limit(logged + 1)).all()
+    return len(found) == logged
+
+
+def record_submissions(user_id, lesson, answers, session=None):
+    """
+    Record a batch of graded answers for one lesson in the caller's transaction
+    answers: sequence of (exercise_id, correct, latency_ms), in the order they were given
+    The batch costs the same handful of statements as a single answer: one
+    executemany into the attempt log, one progress upsert, one review schedule
+    upsert, one stats upsert and, on the first completion, the XP award.
+    Locks taken, in this order: the user's progress row, the user row, then the
+    user's stats row. Other users and other lessons are never blocked (on
+    PostgreSQL; SQLite only has a database-wide write lock).
+
+    Returns a SubmissionResult.
+    """
+    session = session or db.session
+    now = utcnow()
+
+    session.execute(insert(Attempt), [
+        {'user_id': user_id, 'exercise_id': exercise_id, 'correct': bool(correct),
+         'latency_ms': latency_ms, 'created_at': now}
+        for exercise_id, correct, latency_ms in answers
+    ])
+    upsert_progress(session, user_id, lesson.id, len(answers), now)
+
+    correct_count = sum(1 for _, correct, _ in answers if correct)
+    first_completion = correct_count > 0 and mark_completed(session, user_id, lesson.id)
+    if first_completion:
+        award_xp(session, user_id, lesson.xp_reward)
+    first_try = bool(answers[0][1]) and is_first_attempt(session, user_id, lesson, len(answers))
+    schedule_reviews(session, user_id, answers, now)
+
+    upsert_counters(session, UserStats, {'user_id': user_id}, {
+        'total_attempts': len(answers),
+        'correct_attempts': correct_count,
+        'completed_lessons': int(first_completion),
+        'perfect_lessons': int(first_try)
+    }, {'last_attempt_at': now})
+
+    return SubmissionResult(first_completion, lesson.xp_reward if first_completion else 0, first_try, correct_count)
+
+
+def record_submission(user_id, lesson, exercise, correct, latency_ms=None, session=None):
+    """
+    Record one answer: append it to the attempt log, update progress and the
+    user's stats, and award the lesson's XP on the first completion
+
+    Returns a SubmissionResult.
+    """
+    return record_submissions(user_id, lesson, [(exercise.id, correct, latency_ms)], session)
+
+
+def complete_lesson(user_id, lesson, session=None):
+    """Mark a lesson completed without logging an attempt; returns a SubmissionResult"""
+    session = session or db.session
+    now = utcnow()
+
+    upsert_progress(session, user_id, lesson.id, 0, now)
+    if not mark_completed(session, user_id, lesson.id):
+        return NOT_COMPLETED
+
+    award_xp(session, user_id, lesson.xp_reward)
+    upsert_counters(session, UserStats, {'user_id': user_id}, {'completed_lessons': 1})
+    return SubmissionResult(True, lesson.xp_reward, False, 0)
@@ -0,0 +1,235 @@
+"""
+Parametric exercises
+An exercise with a `generator` is shown as one of its generator's pregenerated
+variants instead of its fixed question, so a memorized answer no longer passes.
+A generator samples coefficients from a seeded RNG and computes the answer, so
+(generator, seed) always yields the same variant.
+
+`flask variants generate` fills the exercise_variant pools in bulk with a process
+pool; workers load them into their catalog snapshot, so serving a variant is a
+lookup. The variant picked depends on the user, the exercise and an attempt
+counter, so it changes after every attempt but stays stable across reloads (and
+ETags) in between. The seeds of the last page served are kept in the signed
+session cookie and submissions are graded against those variants.
+"""
+
+import hashlib
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from functools import partial
+
+import click
+from flask.cli import AppGroup
+
+from config import VARIANT_CONFIG
+from models import ExerciseVariant, db
+from services.catalog import bump_content_version
+from services.dbutil import insert_ignore
+
+variants_cli = AppGroup('variants', help='Pregenerate parametric exercise variants.')
+
+# Session key: {str(exercise id): seed served}
+VARIANTS_KEY = 'variants'
+
+# Registry of generator name -> function(rng) returning (question, answer, options, hint)
+GENERATORS = {}
+
+_SUPERSCRIPTS = str.maketrans('0123456789-', '⁰¹²³⁴⁵⁶⁷⁸⁹⁻')
+
+
+def generator(name):
+    """Register a variant generator under the name exercises refer to"""
+    def register(func):
+        GENERATORS[name] = func
+        return func
+    return register
+
+
+def _monomial(coefficient, power):
+    """'3x²', 'x', '-x³', '7' ..."""
+    if power == 0:
+        return str(coefficient)
+    sign, magnitude = ('-' if coefficient < 0 else ''), abs(coefficient)
+    variable = 'x' if power == 1 else 'x' + str(power).translate(_SUPERSCRIPTS)
+    return f"{sign}{'' if magnitude == 1 else magnitude}{variable}"
+
+
+def _polynomial(*terms):
+    """'2x + 3' from (2, 1), (3, 0); zero terms are left out"""
+    text = ''
+    for coefficient, power in terms:
+        if coefficient == 0:
+            continue
+        term = _monomial(coefficient, power)
+        if not text:
+            text = term
+        else:
+            text += f' - {term[1:]}' if term.startswith('-') else f' + {term}'
+    return text or '0'
+
+
+def _shuffled(rng, options):
+    options = list(options)
+    rng.shuffle(options)
+    return options
+
+
+@generator('linear_value')
+def linear_value(rng):
+    a, b, x = rng.randint(2, 9), rng.choice([n for n in range(-9, 10) if n]), rng.randint(-5, 9)
+    return (f'If f(x) = {_polynomial((a, 1), (b, 0))}, then f({x}) = ___', str(a * x + b), None,
+            f'Substitute x = {x} into the function')
+
+
+@generator('sqrt_domain')
+def sqrt_domain(rng):
+    k = rng.choice([n for n in range(-9, 13) if n])
+    answer = f'[{k}, ∞)'
+    return (f'What is the domain of f(x) = √({_polynomial((1, 1), (-k, 0))})?', answer,
+            _shuffled(rng, [answer, f'(-∞, {k}]', '(-∞, ∞)', f'[{-k}, ∞)']), None)
+
+
+@generator('factor_limit')
+def factor_limit(rng):
+    a = rng.choice([n for n in range(-9, 13) if n])
+    answer = str(2 * a)
+    return (f'What is lim(x→{a}) (x² - {a * a})/({_polynomial((1, 1), (-a, 0))})?', answer,
+            _shuffled(rng, [answer, str(a), '0', 'undefined']), None)
+
+
+@generator('sine_limit')
+def sine_limit(rng):
+    k, m = rng.randint(1, 9), rng.randint(1, 9)
+    inner, denominator = _monomial(k, 1), _monomial(m, 1)
+    denominator = denominator if m == 1 else f'({denominator})'
+    return (f'lim(x→0) sin({inner})/{denominator} = ___', str(Fraction(k, m)), None,
+            f'Write it as {Fraction(k, m)}·sin({inner})/({inner}) and use lim(u→0) sin(u)/u = 1')
+
+
+@generator('power_rule_choice')
+def power_rule_choice(rng):
+    a, n = rng.randint(1, 9), rng.randint(3, 9)
+    answer = _monomial(a * n, n - 1)
+    return (f'What is the derivative of {_monomial(a, n)}?', answer,
+            _shuffled(rng, [answer, _monomial(a, n - 1), _monomial(a * n, n), _monomial(a, n)]), None)
+
+
+@generator('power_rule_value')
+def power_rule_value(rng):
+    a, n = rng.randint(2, 9), rng.randint(2, 5)
+    answer = _monomial(a * n, n - 1)
+    return (f"If f(x) = {_monomial(a, n)}, then f'(x) = ___", answer, None,
+            f'Apply the power rule: d/dx({_monomial(a, n)}) = {a}·{_monomial(n, n - 1)} = {answer}')
+
+
+@generator('linear_integral')
+def linear_integral(rng):
+    a, b = rng.randint(1, 5), rng.randint(1, 9)
+    answer = f'{_polynomial((a, 2), (b, 1))} + C'
+    return (f'What is ∫({_polynomial((2 * a, 1), (b, 0))})dx?', answer, _shuffled(rng, [
+        answer, f'{_polynomial((2 * a, 2), (b, 1))} + C', _polynomial((a, 2), (b, 1)), _polynomial((2 * a, 1), (b, 0))
+    ]), None)
+
+
+def generate(name, seed):
+    """exercise_variant row for (generator, seed); identical on every machine and run"""
+    question, answer, options, hint = GENERATORS[name](random.Random(f'{name}:{seed}'))
+    return {'generator': name, 'seed': seed, 'question': question, 'answer': answer,
+            'options': json.dumps(options) if options else None, 'hint': hint}
+
+
+def generate_seeds(name, seeds):
+    """Rows for a range of seeds (runs in a pool process)"""
+    return [generate(name, seed) for seed in seeds]
+
+
+def pick_variant(catalog, exercise, user_id, counter):
+    """The variant this user sees for `counter`, or None if the exercise has no pool"""
+    pool = catalog.variant_pool(exercise.generator)
+    if not pool:
+        return None
+    digest = hashlib.blake2b(f'{user_id}:{exercise.id}:{counter}'.encode(), digest_size=8).digest()
+    return pool[int.from_bytes(digest, 'big') % len(pool)]
+
+
+def serve_exercises(catalog, exercises, user_id, counter):
+    """
+    (exercises as shown, {str(exercise id): seed}) for a page
+    counter: how many times the user has attempted them (progress.attempts), so
+    every attempt brings new numbers
+    """
+    served, issued = [], {}
+    for exercise in exercises:
+        variant = pick_variant(catalog, exercise, user_id, counter)
+        if variant is None:
+            served.append(exercise)
+        else:
+            served.append(exercise.with_variant(variant))
+            issued[str(exercise.id)] = variant.seed
+    return served, issued
+
+
+def remember_served(issued):
+    """
+    Session value recording the seeds of the page (lesson or review batch) just served
+    It replaces the earlier seeds rather than adding to them, so the session stays
+    small however many lessons are opened; answers from a tab served before that
+    find no seed and are asked to load the lesson again.
+    """
+    return dict(issued)
+
+
+def answered_exercise(catalog, exercise, stored):
+    """
+    The exercise as it was served to this session, to grade an answer against
+    None if it is parametric and no (still existing) variant of it was served.
+    """
+    if not catalog.variant_pool(exercise.generator):
+        return exercise
+    seed = (stored or {}).get(str(exercise.id))
+    variant = catalog.get_variant(exercise.generator, seed)
+    return exercise.with_variant(variant) if variant is not None else None
+
+
+@variants_cli.command('generate')
+@click.option('--count', default=VARIANT_CONFIG['pool_size'], show_default=True,
+              help='Seeds generated per generator.')
+@click.option('--workers', type=int, default=VARIANT_CONFIG['workers'], help='Processes (default: one per CPU).')
+@click.option('--generator', 'names', multiple=True, help='Only this generator (repeatable).')
+@click.option('--replace', is_flag=True, help='Drop the existing pools first, e.g. after changing a generator.')
+def generate_command(count, workers, names, replace):
+    """Pregenerate variant pools in parallel and store them by (generator, seed)."""
+    unknown = set(names) - set(GENERATORS)
+    if unknown:
+        raise click.BadParameter(f"unknown generator(s): {', '.join(sorted(unknown))}", param_hint='--generator')
+    names = sorted(names or GENERATORS)
+    chunk_size = VARIANT_CONFIG['chunk_size']
+
+    started = time.perf_counter()
+    generated = stored = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for name in names:
+            if replace:
+                ExerciseVariant.query.filter_by(generator=name).delete(synchronize_session=False)
+            # Seeds that come out identical to an earlier one are skipped, so small
+            # parameter spaces do not fill the pool with repeats
+            seen = {question for (question,) in db.session.query(ExerciseVariant.question).filter_by(generator=name)}
+            chunks = [range(start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)]
+            for rows in pool.map(partial(generate_seeds, name), chunks):
+                generated += len(rows)
+                fresh = []
+                for row in rows:
+                    if row['question'] not in seen:
+                        seen.add(row['question'])
+                        fresh.append(row)
+                insert_ignore(db.session, ExerciseVariant, fresh, ['generator', 'seed'])
+                stored += len(fresh)
+
+    bump_content_version()  # Workers reload their catalog, pools included
+    db.session.commit()
+    elapsed = time.perf_counter() - started
+    click.echo(f'{len(names)} generators, {generated} variants generated, {stored} new stored in {elapsed:.1f}s '
+               f'({generated / elapsed if elapsed else 0:,.0f} variants/s)')
@@ -1,28 +1,18 @@
 #!/usr/bin/env python3
 """
 Calcuingo - Simple startup script
-This script properly initializes the database and starts the Flask app
+This script starts the Flask app; set up the database once before with
+`flask --app app db setup` (tables, migrations and starter lessons)
 """
 
-from app import app, db
-from models import Lesson
+from app import create_app
 
 def main():
-    """Initialize database and start the app"""
+    """Start the app"""
     print("Starting Calcuingo...")
     
-    with app.app_context():
-        # Create all database tables
-        db.create_all()
-        print("Database tables created")
-        
-        # Check if we need to create dummy data
-        if Lesson.query.count() == 0:
-            print("Creating dummy data...")
-            from dummy_data import create_dummy_data
-            create_dummy_data()
-        else:
-            print("Database already has data")
+    app = create_app()
+    print("First run? Create the database with: flask --app app db setup")
     
     print("\nStarting Flask server...")
     print("Open: http://localhost:5000")
@@ -34,4 +24,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
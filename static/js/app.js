@@ -0,0 +1,38 @@
+// Dark mode functionality
+document.addEventListener('DOMContentLoaded', function() {
+    const darkModeToggle = document.querySelector('.dark-mode-toggle');
+    const body = document.body;
+
+    // Check for saved dark mode preference or default to light mode
+    const currentTheme = localStorage.getItem('theme') || 'light';
+    if (currentTheme === 'dark') {
+        body.classList.add('dark-mode');
+        updateDarkModeIcon(true);
+    }
+
+    // Add click event listener to dark mode toggle
+    if (darkModeToggle) {
+        darkModeToggle.addEventListener('click', function(e) {
+            e.preventDefault();
+            toggleDarkMode();
+        });
+    }
+
+    function toggleDarkMode() {
+        body.classList.toggle('dark-mode');
+        const isDarkMode = body.classList.contains('dark-mode');
+        localStorage.setItem('theme', isDarkMode ? 'dark' : 'light');
+        updateDarkModeIcon(isDarkMode);
+    }
+
+    function updateDarkModeIcon(isDarkMode) {
+        const icon = darkModeToggle.querySelector('i');
+        if (isDarkMode) {
+            icon.className = 'fas fa-sun';
+            darkModeToggle.innerHTML = '<i class="fas fa-sun"></i> Light Mode';
+        } else {
+            icon.className = 'fas fa-moon';
+            darkModeToggle.innerHTML = '<i class="fas fa-moon"></i> Dark Mode';
+        }
+    }
+});
@@ -0,0 +1,150 @@
+"""
+Analytics export and report benchmark
+Adds a synthetic cohort to the database: a path of benchmark lessons, users who
+work through it with some dropping out at every lesson, their progress rows and
+an attempt log of N rows (50M by default). Then it runs `flask analytics export`
+and `flask analytics report` as child processes, prints the time, throughput and
+peak memory of each, and checks the report's totals against SQL counts.
+
+DATABASE_URL must point at a scratch database (the rows are added to it).
+
+Usage: DATABASE_URL=sqlite:////tmp/analytics.db python tools/bench_analytics.py [--attempts 50000000]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import func, insert
+
+BATCH_ROWS = 50_000
+USERS_PER_BATCH = 1000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(db, attempts, lessons, per_lesson, rng):
+    """Add the benchmark path and enough users to log `attempts` attempts; returns the lesson ids"""
+    from models import Attempt, Exercise, Lesson, Progress, User, utcnow
+
+    run_id = time.time_ns()
+    started = time.perf_counter()
+    path = []
+    for number in range(lessons):
+        lesson = Lesson(title=f'bench-analytics-{run_id}-{number}', order=20_000 + number, xp_reward=0,
+                        prerequisites='[]')
+        db.session.add(lesson)
+        db.session.flush()
+        exercises = [Exercise(lesson_id=lesson.id, type='fill_blank', question=f'bench {i}', answer=str(i),
+                              order=i) for i in range(per_lesson)]
+        db.session.add_all(exercises)
+        db.session.flush()
+        # Every exercise gets its own chance of being answered correctly
+        path.append((lesson.id, [(exercise.id, rng.uniform(0.3, 0.9)) for exercise in exercises]))
+    db.session.commit()
+
+    now = utcnow()
+    logged = users = 0
+    attempt_rows, progress_rows = [], []
+    while logged < attempts:
+        first_id = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+        db.session.connection().execute(insert(User.__table__), [
+            {'username': f'bench-analytics-{run_id}-{users + i}', 'password': '-', 'xp': 0, 'streak': 0}
+            for i in range(USERS_PER_BATCH)
+        ])
+        users += USERS_PER_BATCH
+        for user_id in range(first_id, first_id + USERS_PER_BATCH):
+            for lesson_id, exercises in path:
+                tries, correct = 0, False
+                while not correct and tries < 20:
+                    exercise_id, chance = rng.choice(exercises)
+                    correct = rng.random() < chance
+                    tries += 1
+                    attempt_rows.append({'user_id': user_id, 'exercise_id': exercise_id, 'correct': correct,
+                                         'latency_ms': rng.randrange(2000, 60000), 'created_at': now})
+                logged += tries
+                progress_rows.append({'user_id': user_id, 'lesson_id': lesson_id, 'completed': correct,
+                                      'score': float(correct), 'attempts': tries, 'last_attempt': now})
+                if not correct or rng.random() < 0.1:  # Gave up here, or stopped after finishing
+                    break
+        for table, rows in ((Attempt.__table__, attempt_rows), (Progress.__table__, progress_rows)):
+            for start in range(0, len(rows), BATCH_ROWS):
+                db.session.connection().execute(insert(table), rows[start:start + BATCH_ROWS])
+            rows.clear()
+        db.session.commit()
+    elapsed = time.perf_counter() - started
+    print(f'seeded {users:,} users, {logged:,} attempts in {elapsed:.1f}s')
+    return [lesson_id for lesson_id, _ in path]
+
+
+def run_flask(*args):
+    """Run a flask CLI command in a child process; returns (stdout, seconds, peak RSS in MB)"""
+    started = time.perf_counter()
+    child = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', *args], cwd=ROOT,
+                             stdout=subprocess.PIPE, text=True)
+    output = child.stdout.read()
+    _, status, usage = os.wait4(child.pid, 0)
+    elapsed = time.perf_counter() - started
+    if os.waitstatus_to_exitcode(status):
+        raise SystemExit(f"flask {' '.join(args)} failed")
+    return output, elapsed, usage.ru_maxrss / 1024  # ru_maxrss is in KB on Linux
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the analytics export and reports')
+    parser.add_argument('--attempts', type=int, default=50_000_000, help='Attempt rows to add')
+    parser.add_argument('--lessons', type=int, default=12)
+    parser.add_argument('--per-lesson', type=int, default=8, help='Exercises per lesson')
+    parser.add_argument('--keep', action='store_true', help='Keep the export directory')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        raise SystemExit('Set DATABASE_URL to a scratch database (users, progress and attempts are added to it)')
+
+    from app import app, db
+    from models import Attempt, Progress
+    from services.schema import ensure_schema
+
+    with app.app_context():
+        db.create_all()
+        ensure_schema()
+        lesson_ids = seed(db, args.attempts, args.lessons, args.per_lesson, random.Random(42))
+        attempts = db.session.query(func.count(Attempt.id)).scalar()
+        completed = dict(db.session.query(Progress.lesson_id, func.count()).filter(
+            Progress.lesson_id.in_(lesson_ids), Progress.completed.is_(True)).group_by(Progress.lesson_id).all())
+
+    directory = os.path.join(tempfile.mkdtemp(prefix='calclingo-analytics-'), 'export')
+    try:
+        output, elapsed, peak = run_flask('analytics', 'export', directory)
+        print(f'export       {attempts / elapsed:>12,.0f} attempts/s, {elapsed:.1f}s, peak RSS {peak:,.0f} MB')
+        print(f'             {output.strip()}')
+
+        output, elapsed, peak = run_flask('analytics', 'report', directory, '--json')
+        print(f'report       {attempts / elapsed:>12,.0f} attempts/s, {elapsed:.1f}s, peak RSS {peak:,.0f} MB')
+        report = json.loads(output)
+    finally:
+        if not args.keep:
+            shutil.rmtree(os.path.dirname(directory), ignore_errors=True)
+
+    funnel = {row['lesson_id']: row for row in report['funnel']}
+    for lesson_id in lesson_ids[:3] + lesson_ids[-1:]:
+        row = funnel[lesson_id]
+        print(f"  lesson {lesson_id:<6} started {row['started']:>9,}, completed {row['completed']:>9,}, "
+              f"drop-off {row['drop_off'] or 0:.1%}, median attempts {row['median_attempts_to_complete']}")
+    ok = report['attempts'] == attempts and all(
+        funnel[lesson_id]['completed'] == completed.get(lesson_id, 0) for lesson_id in lesson_ids)
+    print(f"check: attempts {report['attempts']:,}/{attempts:,}, lesson completions "
+          f"{'OK' if ok else 'MISMATCH'}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Classroom polling benchmark: sync workers vs the async serving mode
+Opens N keep-alive connections, one per simulated student, that each poll
+/progress/user-stats every --interval seconds, and reports the achieved request
+rate, latency percentiles, failed requests and the server's CPU time. Run it
+once per server to compare how many polling connections each sustains per core:
+
+    DATABASE_URL=sqlite:////tmp/poll.db python tools/bench_asgi.py --server gunicorn --workers 4
+    DATABASE_URL=sqlite:////tmp/poll.db python tools/bench_asgi.py --server uvicorn --workers 1
+
+gunicorn runs wsgi:app (--preload) with sync (threaded) workers; uvicorn runs asgi:application.
+Session cookies are signed with the app's SECRET_KEY, so the server must use the same one.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tools.loadtest import percentile, start_server
+
+PATH = '/progress/user-stats'
+
+
+def seed_users(count):
+    """Create the polling students; returns a signed session cookie for each"""
+    from sqlalchemy import insert
+
+    from app import app, db
+    from models import User
+    from services.schema import ensure_schema
+
+    run_id = time.time_ns()
+    with app.app_context():
+        db.create_all()
+        ensure_schema()
+        db.session.execute(insert(User), [
+            {'username': f'bench-poll-{run_id}-{i}', 'password': '-', 'xp': 0, 'streak': 0} for i in range(count)
+        ])
+        db.session.commit()
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(
+            User.username.like(f'bench-poll-{run_id}-%'))]
+        db.session.remove()
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    name = app.config['SESSION_COOKIE_NAME']
+    return [f"{name}={serializer.dumps({'user_id': user_id, '_permanent': True})}" for user_id in user_ids]
+
+
+async def read_response(reader):
+    """(status code, keep-alive) of one response; the body is read and discarded"""
+    status_line = (await reader.readline()).split()
+    status, keep_alive = int(status_line[1]), status_line[0] == b'HTTP/1.1'
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+        elif name.lower() == 'connection':
+            keep_alive = value.strip().lower() != 'close'
+    await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def student(host, port, cookie, interval, deadline, latencies, failures):
+    """One keep-alive connection polling PATH until the deadline"""
+    request = (f'GET {PATH} HTTP/1.1\r\nHost: {host}:{port}\r\nCookie: {cookie}\r\n\r\n').encode()
+    reader = writer = None
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await asyncio.wait_for(read_response(reader), timeout=30)
+            if not keep_alive:  # e.g. the werkzeug dev server answers with HTTP/1.0
+                writer.close()
+                reader = writer = None
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures.append(status)
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            failures.append(0)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+    if writer is not None:
+        writer.close()
+
+
+async def poll(base_url, cookies, interval, seconds):
+    host, port = base_url.rsplit('//', 1)[1].split(':')
+    latencies, failures = [], []
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*(student(host, int(port), cookie, interval, deadline, latencies, failures)
+                           for cookie in cookies))
+    return latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark many polling connections against one server')
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn', 'uvicorn'), default='uvicorn')
+    parser.add_argument('--workers', type=int, default=1, help='Server worker processes')
+    parser.add_argument('--connections', type=int, default=300, help='Simulated students, one connection each')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls per student')
+    parser.add_argument('--seconds', type=float, default=30.0)
+    parser.add_argument('--port', type=int, default=5056)
+    args = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        raise SystemExit('Set DATABASE_URL to the database to benchmark (polling users are added to it)')
+    cookies = seed_users(args.connections)
+
+    process, base_url = start_server(args.server, args.port, args.workers, database_url)
+    try:
+        started = time.perf_counter()
+        latencies, failures = asyncio.run(poll(base_url, cookies, args.interval, args.seconds))
+        elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+    # The server and its workers have been reaped, so their CPU time is in RUSAGE_CHILDREN
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_seconds = usage.ru_utime + usage.ru_stime
+
+    latencies.sort()
+    offered = args.connections / args.interval
+    print(f'{args.server} x{args.workers}: {args.connections} connections polling every {args.interval}s '
+          f'(offered {offered:,.0f} req/s)')
+    print(f'  achieved   {len(latencies) / elapsed:>9,.0f} req/s, {len(failures)} failed')
+    if latencies:
+        print(f'  latency    p50 {percentile(latencies, 0.5) * 1000:.1f} ms, '
+              f'p95 {percentile(latencies, 0.95) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms')
+    print(f'  server CPU {cpu_seconds:.1f}s ({len(latencies) / max(cpu_seconds, 1e-9):,.0f} requests per CPU-second, '
+          f'{args.connections / args.workers:,.0f} connections per worker)')
+
+
+if __name__ == '__main__':
+    main()
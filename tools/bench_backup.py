@@ -0,0 +1,168 @@
+"""
+Backup and restore benchmark
+Adds N users with progress on every starter lesson to the database, then runs
+`flask data export` and `flask data import` (into a second, empty database) as
+child processes. Each command is killed part-way through once and run again, so
+the resume path is exercised, and the time, rows/s and peak memory of every run
+are printed. Finally the restored tables are compared with the source.
+
+DATABASE_URL must point at a scratch SQLite database (the rows are added to it);
+the restore goes to a file next to it, named <name>-restore.db.
+
+Peak RSS includes the database pages SQLite memory-maps for reads (up to the
+mmap_size pragma in DATABASE_CONFIG, 256 MB by default), which are shared with the
+page cache; the rest stays at about one chunk whatever the table size.
+
+Usage: DATABASE_URL=sqlite:////tmp/backup.db python tools/bench_backup.py [--users 2000000]
+"""
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import create_engine, func, insert, select
+
+BATCH_ROWS = 50_000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(db, users):
+    """Add `users` users, each with a progress row on every lesson"""
+    from models import Lesson, Progress, User, utcnow
+
+    run_id = time.time_ns()
+    started = time.perf_counter()
+    lesson_ids = [lesson_id for lesson_id, in db.session.query(Lesson.id)]
+    now = utcnow()
+    for start in range(0, users, BATCH_ROWS // len(lesson_ids)):
+        count = min(BATCH_ROWS // len(lesson_ids), users - start)
+        first_id = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+        db.session.connection().execute(insert(User.__table__), [
+            {'username': f'bench-backup-{run_id}-{start + i}', 'password': '-', 'xp': (start + i) % 500,
+             'streak': i % 7, 'last_login': now, 'badges': '[]'} for i in range(count)
+        ])
+        db.session.connection().execute(insert(Progress.__table__), [
+            {'user_id': user_id, 'lesson_id': lesson_id, 'completed': (user_id + lesson_id) % 3 == 0,
+             'score': (user_id % 10) / 10, 'attempts': user_id % 5 + 1, 'last_attempt': now}
+            for user_id in range(first_id, first_id + count) for lesson_id in lesson_ids
+        ])
+        db.session.commit()
+    print(f'seeded {users:,} users, {users * len(lesson_ids):,} progress rows in {time.perf_counter() - started:.1f}s')
+
+
+def run_flask(database_url, *args, kill_after=None):
+    """
+    Run a flask CLI command in a child process, optionally killing it after `kill_after` seconds
+    Returns (stdout, seconds, peak RSS in MB, killed)
+    """
+    started = time.perf_counter()
+    child = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', *args], cwd=ROOT,
+                             env={**os.environ, 'DATABASE_URL': database_url}, stdout=subprocess.PIPE, text=True)
+    if kill_after is not None:
+        try:
+            child.wait(kill_after)
+        except subprocess.TimeoutExpired:
+            child.send_signal(signal.SIGKILL)
+    output = child.stdout.read()
+    _, status, usage = os.wait4(child.pid, 0)
+    elapsed = time.perf_counter() - started
+    killed = os.WIFSIGNALED(status)
+    if not killed and os.waitstatus_to_exitcode(status):
+        raise SystemExit(f"flask {' '.join(args)} failed")
+    return output, elapsed, usage.ru_maxrss / 1024, killed  # ru_maxrss is in KB on Linux
+
+
+def interrupted_run(label, database_url, args, kill_after, rows):
+    """Run a resumable command, kill it once after `kill_after` seconds, then finish it"""
+    _, elapsed, peak, killed = run_flask(database_url, *args, kill_after=kill_after)
+    if killed:
+        print(f'{label:<8} killed after {elapsed:.1f}s (peak RSS {peak:,.0f} MB), running it again')
+    resumed_output, resumed, peak_resumed, _ = run_flask(database_url, *args)
+    total = elapsed + resumed
+    print(f'{label:<8} {rows / total:>10,.0f} rows/s, {total:.1f}s in total, '
+          f'peak RSS {max(peak, peak_resumed):,.0f} MB')
+    print('         ' + resumed_output.strip().replace('\n', '\n         '))
+
+
+def table_summary(url):
+    """Per table: (rows, max id, a checksum of a few columns)"""
+    from models import Exercise, Lesson, Progress, User
+
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        summary = {
+            'lesson': connection.execute(select(func.count(), func.max(Lesson.id), func.sum(Lesson.order))).one(),
+            'exercise': connection.execute(select(func.count(), func.max(Exercise.id),
+                                                  func.sum(Exercise.lesson_id))).one(),
+            'user': connection.execute(select(func.count(), func.max(User.id), func.sum(User.xp))).one(),
+            'progress': connection.execute(select(func.count(), func.max(Progress.id),
+                                                  func.sum(Progress.attempts + Progress.score))).one(),
+        }
+    engine.dispose()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark flask data export / import with an interruption each')
+    parser.add_argument('--users', type=int, default=2_000_000, help='Users to add (with 6 progress rows each)')
+    parser.add_argument('--kill-after', type=float, default=5.0, help='Seconds before each command is interrupted')
+    parser.add_argument('--keep', action='store_true', help='Keep the export directory and the restored database')
+    args = parser.parse_args()
+
+    url = os.environ.get('DATABASE_URL', '')
+    if not url.startswith('sqlite:///'):
+        raise SystemExit('Set DATABASE_URL to a scratch SQLite database (users and progress are added to it)')
+    source_path = url[len('sqlite:///'):]
+    restore_path = os.path.splitext(source_path)[0] + '-restore.db'
+    restore_url = 'sqlite:///' + restore_path
+
+    from app import app, db
+    from services.schema import ensure_schema
+
+    with app.app_context():
+        db.create_all()
+        ensure_schema()
+        if not db.session.query(func.count()).select_from(db.metadata.tables['lesson']).scalar():
+            from dummy_data import create_dummy_data
+            create_dummy_data()
+        seed(db, args.users)
+    source = table_summary(url)
+    rows = sum(count for count, _, _ in source.values())
+
+    directory = os.path.join(tempfile.mkdtemp(prefix='calcuingo-backup-'), 'export')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(restore_path + suffix):
+            os.remove(restore_path + suffix)
+    try:
+        interrupted_run('export', url, ['data', 'export', directory], args.kill_after, rows)
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f'         {size / 1e6:,.1f} MB on disk')
+
+        run_flask(restore_url, 'db', 'upgrade')
+        interrupted_run('import', restore_url, ['data', 'import', directory], args.kill_after, rows)
+        restored = table_summary(restore_url)
+    finally:
+        if not args.keep:
+            shutil.rmtree(os.path.dirname(directory), ignore_errors=True)
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(restore_path + suffix):
+                    os.remove(restore_path + suffix)
+
+    ok = True
+    for name, (count, max_id, checksum) in source.items():
+        match = restored[name] == (count, max_id, checksum)
+        ok &= match
+        print(f"check {name:<9} {count:>12,} rows, max id {max_id}: {'OK' if match else f'MISMATCH {restored[name]}'}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
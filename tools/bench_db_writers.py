@@ -0,0 +1,94 @@
+"""
+Concurrent writer benchmark
+Many threads submit answers at once (each thread is its own logged-in user) and
+the run reports submissions per second and how many failed, e.g. with
+"database is locked". Run it once with the tuned engine settings and once with
+--baseline (SQLite defaults: rollback journal, 5 s busy timeout) to compare.
+
+Usage: DATABASE_URL=sqlite:////tmp/writers.db python tools/bench_db_writers.py [--threads 32] [--baseline]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from config import DATABASE_CONFIG, RATE_LIMIT_CONFIG
+
+PASSWORD = 'bench-password'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent submit_exercise writers')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--submissions', type=int, default=50, help='Submissions per thread')
+    parser.add_argument('--baseline', action='store_true', help='Disable the SQLite pragmas and pool settings')
+    args = parser.parse_args()
+    RATE_LIMIT_CONFIG['enabled'] = False  # Measures the database, not the admission limits
+
+    if args.baseline:
+        # Must happen before the app (and its engine options) are imported
+        DATABASE_CONFIG['sqlite_pragmas'] = {'journal_mode': 'DELETE'}
+        DATABASE_CONFIG['pool_size'], DATABASE_CONFIG['max_overflow'] = 5, 10
+
+    from werkzeug.security import generate_password_hash
+
+    from app import app, db
+    from models import Lesson, User
+    from services.catalog import get_catalog
+    from services.schema import ensure_schema
+
+    run_id = time.time_ns()
+    with app.app_context():
+        db.create_all()
+        ensure_schema()
+        if Lesson.query.count() == 0:
+            from dummy_data import create_dummy_data
+            create_dummy_data()
+        password = generate_password_hash(PASSWORD)
+        usernames = [f'bench-writer-{run_id}-{i}' for i in range(args.threads)]
+        db.session.add_all([User(username=name, password=password, xp=0, streak=0) for name in usernames])
+        db.session.commit()
+        exercises = [(lesson.id, exercise.id, exercise.answer)
+                     for lesson in get_catalog().lessons for exercise in lesson.exercises]
+
+    clients = []
+    for username in usernames:
+        client = app.test_client()
+        client.post('/auth/login', data={'username': username, 'password': PASSWORD})
+        clients.append(client)
+
+    failures = []
+    barrier = threading.Barrier(args.threads + 1)
+
+    def writer(client, seed):
+        rng = random.Random(seed)
+        barrier.wait()
+        for _ in range(args.submissions):
+            lesson_id, exercise_id, answer = rng.choice(exercises)
+            response = client.post(f'/lessons/{lesson_id}/submit',
+                                   data={'exercise_id': exercise_id, 'answer': answer if rng.random() < 0.5 else 'x'})
+            if response.status_code >= 400:
+                failures.append(response.status_code)
+
+    threads = [threading.Thread(target=writer, args=(client, i)) for i, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = args.threads * args.submissions
+    mode = 'baseline' if args.baseline else 'tuned'
+    print(f'{mode}: {total} submissions from {args.threads} threads in {elapsed:.2f}s '
+          f'({(total - len(failures)) / elapsed:,.0f} successful/s), {len(failures)} failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Grading throughput benchmark
+Reports how many submissions a single worker can grade per second for each answer type.
+
+Usage: python tools/bench_grading.py [--rounds N]
+"""
+import argparse
+import os
+import sys
+import time
+
+# Ensure project root is on sys.path so imports like `from services import grading` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from services import grading
+
+
+class BenchExercise:
+    """Stand-in for an Exercise row (only type and answer are read by the grader)"""
+    def __init__(self, type, answer):
+        self.type = type
+        self.answer = answer
+
+
+CASES = {
+    'multiple_choice': (BenchExercise('multiple_choice', '3x²'), ['3x²', 'x²', '3x', 'x³']),
+    'numeric': (BenchExercise('fill_blank', '13'), ['13', '13.0', '12', ' 13 ']),
+    'expression': (BenchExercise('fill_blank', 'x² + 3x + C'), ['x^2 + 3x + C', 'C + 3*x + x**2', 'x^2+3x', '2x + 3']),
+    'text': (BenchExercise('fill_blank', 'No'), ['No', 'no', 'yes', 'undefined']),
+}
+
+
+def run(exercise, submissions, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for submission in submissions:
+            grading.grade(exercise, submission)
+    elapsed = time.perf_counter() - start
+    return rounds * len(submissions) / elapsed
+
+
+def run_cold(rounds):
+    """Every submission is new, so each one is parsed and evaluated from scratch"""
+    exercise = BenchExercise('fill_blank', '5x⁴ - 3x² - 2')
+    submissions = [f'5x^4 - 3x^2 - {i}' for i in range(rounds)]
+    start = time.perf_counter()
+    for submission in submissions:
+        grading.grade(exercise, submission)
+    return len(submissions) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'answer type':<24}{'grades/sec per worker':>24}")
+    print('-' * 48)
+    for name, (exercise, submissions) in CASES.items():
+        print(f'{name:<24}{run(exercise, submissions, args.rounds // len(submissions)):>24,.0f}')
+    print(f"{'expression (uncached)':<24}{run_cold(args.rounds // 10):>24,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Leaderboard index benchmark
+Builds the in-memory rank index for N users (1M by default) and times the
+operations the leaderboard endpoints use. Most users share the lowest scores,
+so updates, ranks and neighbours are also timed for users of the largest
+score bucket (the one with the most tied users), where per-bucket costs show.
+
+Usage: python tools/bench_leaderboard.py [--users 1000000] [--idle-share 0.7]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+# Ensure project root is on sys.path so imports like `from services import leaderboard` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from services.leaderboard import RankIndex
+
+
+def timed(label, func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    per_op = (time.perf_counter() - start) / repeat
+    print(f'{label:<32}{per_op * 1e6:>12.1f} us/op')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the leaderboard rank index')
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=10_000)
+    parser.add_argument('--idle-share', type=float, default=0.7, help='Share of users who never earned XP')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    # Skewed like real XP: most users never earn any, then many near zero and a long tail of heavy learners
+    pairs = [(user_id, 0 if rng.random() < args.idle_share else int(rng.paretovariate(1.2) * 10) - 10)
+             for user_id in range(1, args.users + 1)]
+
+    start = time.perf_counter()
+    index = RankIndex(pairs)
+    print(f'build ({args.users:,} users){"":<8}{time.perf_counter() - start:>12.2f} s')
+
+    user_ids = [rng.randrange(1, args.users + 1) for _ in range(args.repeat)]
+    picks = iter(user_ids * 4)
+
+    timed('award xp (add)', lambda: index.add(next(picks), rng.choice((10, 15, 20, 25))), args.repeat)
+    timed('rank', lambda: index.rank(next(picks)), args.repeat)
+    timed('top 10', lambda: index.top(10), args.repeat)
+    timed('top 100', lambda: index.top(100), args.repeat // 10)
+    timed('around me (radius 3)', lambda: index.around(next(picks), 3), args.repeat)
+
+    # Users tied on the most common score: each one leaves the bucket, then joins it again
+    largest, size = Counter(score for _, score in pairs).most_common(1)[0]
+    tied = [user_id for user_id, score in pairs if score == largest]
+    movers = rng.sample(tied, min(args.repeat, len(tied)))
+    print(f'largest bucket: {size:,} users at score {largest}')
+    leaving, joining, around = iter(movers), iter(movers), iter(movers)
+    timed('leave largest bucket (set)', lambda: index.set(next(leaving), largest + 10), len(movers))
+    timed('join largest bucket (set)', lambda: index.set(next(joining), largest), len(movers))
+    timed('around me in largest bucket', lambda: index.around(next(around), 3), len(movers))
+
+
+if __name__ == '__main__':
+    main()
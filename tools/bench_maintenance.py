@@ -0,0 +1,114 @@
+"""
+Maintenance job benchmark
+Adds N users (1M by default) with random login dates and streaks, plus an attempt
+log and XP ledger spread over the last two weeks, then runs every maintenance job
+twice: the first run does the work, the second shows it is a no-op. Finishes with
+consistency checks against the source tables.
+
+DATABASE_URL must point at a scratch database (the rows are added to it).
+
+Usage: DATABASE_URL=sqlite:////tmp/maintenance.db python tools/bench_maintenance.py [--users 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import func, insert
+
+BATCH_ROWS = 50_000
+
+
+def insert_batches(db, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_ROWS:
+            db.session.connection().execute(insert(table), batch)
+            db.session.commit()
+            batch = []
+    if batch:
+        db.session.connection().execute(insert(table), batch)
+        db.session.commit()
+
+
+def seed(db, users, attempts, rng):
+    """Add the users, attempts and XP events; returns the new users' id range"""
+    from models import Attempt, User, XpEvent, utcnow
+
+    now = utcnow()
+    run_id = time.time_ns()
+    started = time.perf_counter()
+    first_id = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    insert_batches(db, User.__table__, (
+        {'username': f'bench-maint-{run_id}-{i}', 'password': '-', 'xp': 0, 'streak': rng.randrange(0, 30),
+         'last_login': now - timedelta(minutes=rng.randrange(0, 10 * 1440))}
+        for i in range(users)
+    ))
+    last_id = db.session.query(func.max(User.id)).scalar()
+
+    def moment():
+        return now - timedelta(minutes=rng.randrange(10, 14 * 1440))
+
+    insert_batches(db, Attempt.__table__, sorted((
+        {'user_id': rng.randint(first_id, last_id), 'exercise_id': 1, 'correct': rng.random() < 0.6,
+         'latency_ms': rng.randrange(1000, 60000), 'created_at': moment()}
+        for _ in range(attempts)
+    ), key=lambda row: row['created_at']))
+    insert_batches(db, XpEvent.__table__, sorted((
+        {'user_id': rng.randint(first_id, last_id), 'amount': rng.choice((10, 15, 20)), 'created_at': moment()}
+        for _ in range(attempts // 10)
+    ), key=lambda row: row['created_at']))
+    print(f'seeded {users:,} users, {attempts:,} attempts, {attempts // 10:,} XP events '
+          f'in {time.perf_counter() - started:.1f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the set-based maintenance jobs')
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--attempts', type=int, default=1_000_000)
+    parser.add_argument('--chunk-size', type=int, default=None, help='Default: MAINTENANCE_CONFIG')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        raise SystemExit('Set DATABASE_URL to a scratch database (users and log rows are added to it)')
+
+    from app import app, db
+    from config import MAINTENANCE_CONFIG
+    from models import Attempt, DailyActivity, User, XpEvent, utcnow
+    from services.maintenance import JOBS, run_job
+    from services.schema import ensure_schema
+
+    chunk_size = args.chunk_size or MAINTENANCE_CONFIG['chunk_size']
+    with app.app_context():
+        db.create_all()
+        ensure_schema()
+        seed(db, args.users, args.attempts, random.Random(42))
+
+        for label in ('first run', 'second run'):
+            print(label)
+            for name in sorted(JOBS):
+                result = run_job(name, chunk_size)
+                print(f'  {name:<16} {result.scanned:>12,} rows scanned, {result.changed:>10,} changed '
+                      f'in {result.seconds:.2f}s ({result.scanned / max(result.seconds, 1e-9):,.0f} rows/s)')
+
+        cutoff = datetime.combine(utcnow().date() - timedelta(days=1), datetime.min.time())
+        stale = db.session.query(func.count()).filter(User.streak > 0, User.last_login < cutoff).scalar()
+        attempts = db.session.query(func.count(Attempt.id)).scalar()
+        rolled = db.session.query(func.sum(DailyActivity.attempts)).scalar() or 0
+        xp = db.session.query(func.sum(XpEvent.amount)).scalar() or 0
+        rolled_xp = db.session.query(func.sum(DailyActivity.xp_earned)).scalar() or 0
+        ok = stale == 0 and attempts == rolled and xp == rolled_xp
+        print(f'check: {stale} stale streaks, attempts {rolled:,}/{attempts:,}, XP {rolled_xp:,}/{xp:,} '
+              f"{'OK' if ok else 'MISMATCH'}")
+        if not ok:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
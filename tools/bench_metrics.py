@@ -0,0 +1,67 @@
+"""
+Metrics overhead benchmark
+Replays the same requests with request metrics disabled and enabled and reports
+the added latency per request, next to the overhead the hooks measure themselves
+(calcuingo_metrics_overhead_seconds_total).
+
+Usage: DATABASE_URL=sqlite:////tmp/metrics.db python tools/bench_metrics.py [--requests 1000] [--rounds 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app import app, db
+from config import METRICS_CONFIG
+from models import Lesson
+from services.metrics import registry
+from services.schema import ensure_schema
+
+PATHS = ('/learning-path', '/lessons/1', '/progress/user-stats', '/leaderboard/global')
+
+
+def replay(client, count):
+    started = time.perf_counter()
+    for i in range(count):
+        client.get(PATHS[i % len(PATHS)])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure request metrics overhead')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=5, help='Alternating off/on rounds; the fastest counts')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        ensure_schema()
+        if Lesson.query.count() == 0:
+            from dummy_data import create_dummy_data
+            create_dummy_data()
+
+    client = app.test_client()
+    client.post('/auth/register', data={'username': f'bench-metrics-{time.time_ns()}', 'password': 'x'})
+    replay(client, 200)  # Warm up caches
+
+    timings = {}
+    for enabled in (False, True) * args.rounds:
+        METRICS_CONFIG['enabled'] = enabled
+        registry.reset()
+        timings.setdefault(enabled, []).append(replay(client, args.requests))
+
+    baseline = min(timings[False]) / args.requests
+    instrumented = min(timings[True]) / args.requests
+    measured = registry.overhead_seconds / args.requests
+    print(f'metrics off   {baseline * 1e6:>9.1f} us/request')
+    print(f'metrics on    {instrumented * 1e6:>9.1f} us/request')
+    print(f'added         {(instrumented - baseline) * 1e6:>9.1f} us/request '
+          f'({(instrumented - baseline) / baseline:.1%})')
+    print(f'self-measured {measured * 1e6:>9.1f} us/request (SQL event and teardown hooks)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Page cache benchmark
+Requests the learning path and a lesson page three ways and reports the time per
+request: fully rendered (fragment cache cleared before every request), rendered
+with cached fragments, and revalidated with If-None-Match (304, nothing rendered).
+
+Usage: DATABASE_URL=sqlite:////tmp/pages.db python tools/bench_page_cache.py [--requests 500]
+"""
+import argparse
+import os
+import sys
+import time
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app import app, db
+from models import Lesson
+from services.pagecache import fragments
+from services.schema import ensure_schema
+
+PATHS = ('/learning-path', '/lessons/1')
+
+
+def timed(client, path, count, headers=None, before=None):
+    started = time.perf_counter()
+    for _ in range(count):
+        if before:
+            before()
+        response = client.get(path, headers=headers)
+    return (time.perf_counter() - started) / count, response.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure rendered-fragment caching and 304 revalidation')
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        ensure_schema()
+        if Lesson.query.count() == 0:
+            from dummy_data import create_dummy_data
+            create_dummy_data()
+
+    client = app.test_client()
+    client.post('/auth/register', data={'username': f'bench-pages-{time.time_ns()}', 'password': 'x'})
+    for path in PATHS:
+        client.get(path)  # Warm up templates and consume the welcome flash
+
+    for path in PATHS:
+        etag = client.get(path).headers['ETag']
+        uncached, _ = timed(client, path, args.requests, before=fragments.clear)
+        cached, _ = timed(client, path, args.requests)
+        revalidated, status = timed(client, path, args.requests, headers={'If-None-Match': etag})
+        print(f'{path}')
+        print(f'  full render        {uncached * 1e6:>9.1f} us/request')
+        print(f'  cached fragments   {cached * 1e6:>9.1f} us/request ({cached / uncached - 1:+.0%})')
+        print(f'  304 revalidation   {revalidated * 1e6:>9.1f} us/request ({revalidated / uncached - 1:+.0%}, '
+              f'status {status})')
+    print(f'fragment cache: {len(fragments)} entries, {fragments.size:,} bytes')
+
+
+if __name__ == '__main__':
+    main()
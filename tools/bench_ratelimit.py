@@ -0,0 +1,149 @@
+"""
+Rate limiting overhead benchmark
+Replays the same limited request (a failed login: one indexed read, no write) with
+the rate limits disabled and enabled, for the memory and the sqlite bucket store,
+and reports the added latency per request. The limits are raised so that nothing is
+rejected. It also times the bare checks (two bucket takes plus a write slot).
+
+With --flood, T threads then submit answers with only --slots write slots: the
+requests that find no free slot get their 429 within write_wait_seconds instead of
+queueing, so the slowest accepted request stays close to the time of one write.
+
+Usage: DATABASE_URL=sqlite:////tmp/ratelimit.db python tools/bench_ratelimit.py [--requests 2000] [--flood]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from config import RATE_LIMIT_CONFIG
+
+UNLIMITED = (1e9, 1e9)
+
+
+def replay(client, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        client.post('/auth/login', data={'username': 'bench-ratelimit-nobody', 'password': 'x'})
+    return time.perf_counter() - started
+
+
+def time_checks(store, count):
+    """Seconds per admit_request + release_slot"""
+    from services.ratelimit import admit_request
+
+    limits = {'user': UNLIMITED, 'ip': UNLIMITED}
+    started = time.perf_counter()
+    for i in range(count):
+        store.release_slot(admit_request(store, 'bench', limits, i % 1000, '10.0.0.1'))
+    return (time.perf_counter() - started) / count
+
+
+def flood(app, threads, submissions, exercises):
+    """Submit from `threads` logged-in users at once; returns (accepted, rejected, slowest accepted seconds)"""
+    from models import db, User
+    from werkzeug.security import generate_password_hash
+
+    run_id = time.time_ns()
+    with app.app_context():
+        password = generate_password_hash('x')
+        db.session.add_all([User(username=f'bench-ratelimit-{run_id}-{i}', password=password, xp=0, streak=0)
+                            for i in range(threads)])
+        db.session.commit()
+    clients = []
+    for i in range(threads):
+        client = app.test_client()
+        client.post('/auth/login', data={'username': f'bench-ratelimit-{run_id}-{i}', 'password': 'x'})
+        clients.append(client)
+
+    results = []
+    barrier = threading.Barrier(threads)
+
+    def writer(client, seed):
+        barrier.wait()
+        for n in range(submissions):
+            lesson_id, exercise_id = exercises[(seed + n) % len(exercises)]
+            started = time.perf_counter()
+            response = client.post(f'/lessons/{lesson_id}/submit', data={'exercise_id': exercise_id, 'answer': 'x'})
+            results.append((response.status_code, time.perf_counter() - started))
+
+    workers = [threading.Thread(target=writer, args=(client, i)) for i, client in enumerate(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    accepted = [seconds for status, seconds in results if status != 429]
+    return len(accepted), len(results) - len(accepted), max(accepted, default=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the rate limiting overhead per request')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5, help='Alternating off/on rounds; the fastest counts')
+    parser.add_argument('--flood', action='store_true', help='Also flood the submit endpoint from many threads')
+    parser.add_argument('--threads', type=int, default=32, help='Flood: concurrent users')
+    parser.add_argument('--slots', type=int, default=2, help='Flood: max_concurrent_writes')
+    args = parser.parse_args()
+
+    # Nothing may be rejected while measuring the overhead
+    RATE_LIMIT_CONFIG['limits'] = {endpoint: {kind: UNLIMITED for kind in limits}
+                                   for endpoint, limits in RATE_LIMIT_CONFIG['limits'].items()}
+
+    from app import create_app
+    from models import Exercise, Lesson, db
+    from services.ratelimit import RATE_LIMITS, MemoryRateLimits, SqliteRateLimits
+    from services.schema import ensure_schema
+
+    directory = tempfile.mkdtemp(prefix='calcuingo-ratelimit-')
+    stores = {
+        'memory': MemoryRateLimits(RATE_LIMIT_CONFIG['max_buckets'], RATE_LIMIT_CONFIG['max_concurrent_writes']),
+        'sqlite': SqliteRateLimits(os.path.join(directory, 'ratelimit.db'), RATE_LIMIT_CONFIG['max_concurrent_writes']),
+    }
+    app = create_app()
+    try:
+        with app.app_context():
+            db.create_all()
+            ensure_schema()
+            if Lesson.query.count() == 0:
+                from dummy_data import create_dummy_data
+                create_dummy_data()
+            exercises = db.session.query(Exercise.lesson_id, Exercise.id).all()
+
+        client = app.test_client()
+        replay(client, 200)  # Warm up caches
+        for name, store in stores.items():
+            app.extensions[RATE_LIMITS] = store
+            timings = {}
+            for enabled in (False, True) * args.rounds:
+                RATE_LIMIT_CONFIG['enabled'] = enabled
+                timings.setdefault(enabled, []).append(replay(client, args.requests))
+            baseline = min(timings[False]) / args.requests
+            limited = min(timings[True]) / args.requests
+            check = time_checks(store, args.requests)
+            print(f'{name:<7} limits off {baseline * 1e6:>8.1f} us/request, on {limited * 1e6:>8.1f} us/request, '
+                  f'added {(limited - baseline) * 1e6:>6.1f} us ({(limited - baseline) / baseline:.1%}); '
+                  f'bare check {check * 1e6:.1f} us')
+
+        if args.flood:
+            RATE_LIMIT_CONFIG['enabled'] = True
+            for name in stores:
+                if name == 'memory':
+                    store = MemoryRateLimits(RATE_LIMIT_CONFIG['max_buckets'], args.slots)
+                else:
+                    store = SqliteRateLimits(os.path.join(directory, 'flood.db'), args.slots)
+                app.extensions[RATE_LIMITS] = store
+                accepted, rejected, slowest = flood(app, args.threads, 20, exercises)
+                print(f'{name:<7} flood: {accepted} accepted, {rejected} got 429 with {args.slots} write slots '
+                      f'and {args.threads} threads; slowest accepted {slowest * 1000:.0f} ms')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
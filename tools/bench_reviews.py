@@ -0,0 +1,154 @@
+"""
+Spaced-repetition scheduler benchmark
+Fills review_item with N synthetic schedules (10M by default, spread over
+N / --per-user users) and times what the scheduler does at that size:
+
+- bulk load throughput, with the due-queue index in place
+- "next K due items" for random users (due_reviews), p50/p95/p99
+- rescheduling a submitted batch of answers (schedule_reviews + commit)
+- the nightly recompute: every schedule read, recomputed and upserted in chunks of users
+
+DATABASE_URL must point at a scratch database: the users, a benchmark lesson and
+the review items are added to it and left in place.
+
+Usage: DATABASE_URL=sqlite:////tmp/reviews.db python tools/bench_reviews.py [--rows 10000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import insert, select, text
+
+from tools.loadtest import percentile
+
+BATCH_ROWS = 50_000
+
+
+def seed(db, rows, per_user, rng):
+    """Create the users, the exercises and `rows` review items; returns (user_ids, exercise_ids)"""
+    from models import Exercise, Lesson, ReviewItem, User, utcnow
+
+    run_id = time.time_ns()
+    users = rows // per_user
+    lesson = Lesson(title=f'bench-reviews-{run_id}', order=10_000, xp_reward=0, prerequisites='[]')
+    db.session.add(lesson)
+    db.session.flush()
+    db.session.execute(insert(Exercise), [
+        {'lesson_id': lesson.id, 'type': 'fill_blank', 'question': f'bench {i}', 'answer': str(i), 'order': i}
+        for i in range(per_user)
+    ])
+    db.session.execute(insert(User), [
+        {'username': f'bench-review-{run_id}-{i}', 'password': '-', 'xp': 0, 'streak': 0} for i in range(users)
+    ])
+    db.session.commit()
+    exercise_ids = [exercise_id for (exercise_id,) in db.session.query(Exercise.id).filter_by(lesson_id=lesson.id)]
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(
+        User.username.like(f'bench-review-{run_id}-%')).order_by(User.id)]
+
+    now = utcnow()
+    started = time.perf_counter()
+    batch = []
+    for user_id in user_ids:
+        for exercise_id in exercise_ids:
+            interval = rng.choice((1, 6, 15, 37, 90))
+            batch.append({
+                'user_id': user_id, 'exercise_id': exercise_id, 'ease': 2.5, 'interval_days': interval,
+                'repetitions': 3, 'lapses': 0, 'last_reviewed_at': now - timedelta(days=interval),
+                # Between a month overdue and three months ahead
+                'next_due': now + timedelta(minutes=rng.randrange(-30 * 1440, 90 * 1440))
+            })
+            if len(batch) == BATCH_ROWS:
+                db.session.connection().execute(insert(ReviewItem.__table__), batch)
+                db.session.commit()
+                batch = []
+    if batch:
+        db.session.connection().execute(insert(ReviewItem.__table__), batch)
+        db.session.commit()
+    elapsed = time.perf_counter() - started
+    loaded = len(user_ids) * len(exercise_ids)
+    print(f'load         {loaded:>12,} rows in {elapsed:.1f}s ({loaded / elapsed:,.0f} rows/s)')
+    return user_ids, exercise_ids
+
+
+def report(label, samples):
+    samples.sort()
+    print(f'{label:<12} p50 {percentile(samples, 0.5) * 1000:.2f} ms, p95 {percentile(samples, 0.95) * 1000:.2f} ms, '
+          f'p99 {percentile(samples, 0.99) * 1000:.2f} ms ({len(samples):,} runs)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the review scheduler at scale')
+    parser.add_argument('--rows', type=int, default=10_000_000, help='Review items to load')
+    parser.add_argument('--per-user', type=int, default=100, help='Review items per user')
+    parser.add_argument('--limit', type=int, default=20, help='K in "next K due items"')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--submissions', type=int, default=500, help='Batches of 10 answers to reschedule')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Users per chunk in the recompute')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        raise SystemExit('Set DATABASE_URL to a scratch database (review items are added to it)')
+
+    from app import app, db
+    from models import ReviewItem, utcnow
+    from services.dbutil import upsert_rows
+    from services.reviews import ReviewState, STATE_FIELDS, due_reviews, next_state, schedule_reviews
+    from services.schema import ensure_schema
+
+    rng = random.Random(42)
+    with app.app_context():
+        db.create_all()
+        ensure_schema()
+        user_ids, exercise_ids = seed(db, args.rows, args.per_user, rng)
+
+        if db.engine.dialect.name == 'sqlite':
+            plan = db.session.execute(text('EXPLAIN QUERY PLAN SELECT * FROM review_item WHERE user_id = 1 '
+                                           'AND next_due <= CURRENT_TIMESTAMP ORDER BY next_due LIMIT 20')).all()
+            print(f"plan         {' / '.join(row[-1] for row in plan)}")
+
+        samples = []
+        for _ in range(args.queries):
+            started = time.perf_counter()
+            due_reviews(rng.choice(user_ids), args.limit)
+            samples.append(time.perf_counter() - started)
+        db.session.rollback()
+        report(f'next {args.limit} due', samples)
+
+        samples = []
+        for _ in range(args.submissions):
+            answers = [(exercise_id, rng.random() < 0.7, rng.randrange(2000, 90000))
+                       for exercise_id in rng.sample(exercise_ids, min(10, len(exercise_ids)))]
+            started = time.perf_counter()
+            schedule_reviews(db.session, rng.choice(user_ids), answers, utcnow())
+            db.session.commit()
+            samples.append(time.perf_counter() - started)
+        report('reschedule', samples)
+
+        # The nightly job's shape: keyset over users, one read and one upsert per chunk
+        now = utcnow()
+        started = time.perf_counter()
+        items = 0
+        for start in range(0, len(user_ids), args.chunk_size):
+            chunk = user_ids[start:start + args.chunk_size]
+            rows = []
+            for user_id, exercise_id, *state in db.session.execute(select(
+                    ReviewItem.user_id, ReviewItem.exercise_id, *(getattr(ReviewItem, field) for field in STATE_FIELDS)
+            ).where(ReviewItem.user_id.between(chunk[0], chunk[-1]))):
+                rows.append({'user_id': user_id, 'exercise_id': exercise_id,
+                             **next_state(ReviewState(*state), rng.random() < 0.7, None, now)._asdict()})
+            upsert_rows(db.session, ReviewItem, rows, ['user_id', 'exercise_id'])
+            db.session.commit()
+            items += len(rows)
+        elapsed = time.perf_counter() - started
+        print(f'recompute    {items:>12,} items in {elapsed:.1f}s ({items / elapsed:,.0f} items/s, '
+              f'chunks of {args.chunk_size} users)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Shard write-throughput benchmark
+For each shard count (1, 2 and 4 by default) a child process builds a fresh
+primary plus N-1 shard databases next to DATABASE_URL, adds the users (each with
+some answers already logged), spreads them evenly over the shards with the same
+online move `flask shards move` runs, then starts writer processes that submit
+answers through the app for a fixed time. It prints the rows moved per second and
+the successful submissions per second for every shard count.
+
+SQLite allows one writer per database file, so the writers of different shards
+no longer queue behind each other; the gain is clearest with --synchronous FULL,
+where every commit waits for an fsync while holding its file's write lock. XP
+awards still go to the primary, so they stay serialized whatever the shard count.
+
+Usage: DATABASE_URL=sqlite:////tmp/shards.db python tools/bench_shards.py [--shards 1 2 4] [--writers 8]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from config import DATABASE_CONFIG, RATE_LIMIT_CONFIG, SHARD_CONFIG
+
+PASSWORD = 'bench-password'
+
+
+def database_urls(url, count):
+    """Primary and shard URLs of the run with `count` shards, as files next to DATABASE_URL"""
+    base = os.path.splitext(url[len('sqlite:///'):])[0]
+    return [f'sqlite:///{base}-{count}x.db'] + [f'sqlite:///{base}-{count}x-shard{n}.db' for n in range(1, count)]
+
+
+def remove_databases(urls):
+    for url in urls:
+        for suffix in ('', '-wal', '-shm'):
+            path = url[len('sqlite:///'):] + suffix
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def setup(users, answers):
+    """Schema, lessons and `users` users with `answers` logged answers each, all on shard 0"""
+    from werkzeug.security import generate_password_hash
+
+    from models import Lesson, User, db
+    from services.catalog import get_catalog
+    from services.database import using_shard
+    from services.schema import ensure_schema
+    from services.shards import create_shard_tables
+    from services.submissions import record_submission
+
+    db.create_all()
+    ensure_schema()
+    create_shard_tables()
+    if Lesson.query.count() == 0:
+        from dummy_data import create_dummy_data
+        create_dummy_data()
+    password = generate_password_hash(PASSWORD)
+    db.session.add_all([User(username=f'bench-shard-{i}', password=password, xp=0, streak=0) for i in range(users)])
+    db.session.commit()
+    exercises = [(lesson, exercise) for lesson in get_catalog().lessons for exercise in lesson.exercises]
+    rng = random.Random(0)
+    with using_shard(0):
+        for user_id, in db.session.query(User.id).order_by(User.id):
+            for _ in range(answers):
+                lesson, exercise = rng.choice(exercises)
+                record_submission(user_id, lesson, exercise, rng.random() < 0.5)
+            db.session.commit()
+    return [(lesson.id, exercise.id, exercise.answer) for lesson, exercise in exercises]
+
+
+def spread(count):
+    """Move equal user id ranges to shards 1..count-1; returns (rows moved, seconds)"""
+    from models import User, db
+    from services.shards import move
+
+    user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id)]
+    share = -(-len(user_ids) // count)
+    rows = 0
+    started = time.perf_counter()
+    for shard in range(1, count):
+        group = user_ids[shard * share:(shard + 1) * share]
+        if group:
+            rows += sum(step.rows for step in move(group[0], group[-1], shard, SHARD_CONFIG['move_chunk_users']))
+    return rows, time.perf_counter() - started
+
+
+def writer(usernames, exercises, seconds, seed, results):
+    """Submit answers for `usernames` in turn until `seconds` have passed; puts (ok, failed) on `results`"""
+    from app import app
+    from models import db
+
+    with app.app_context():
+        # Connections opened by the parent must not be shared with it after the fork
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    clients = []
+    for username in usernames:
+        client = app.test_client()
+        client.post('/auth/login', data={'username': username, 'password': PASSWORD})
+        clients.append(client)
+    rng = random.Random(seed)
+    ok = failed = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        lesson_id, exercise_id, answer = rng.choice(exercises)
+        # Visiting the lesson first makes the submission grade against the variant shown
+        client = rng.choice(clients)
+        client.get(f'/lessons/{lesson_id}')
+        response = client.post(f'/lessons/{lesson_id}/submit',
+                               data={'exercise_id': exercise_id, 'answer': answer if rng.random() < 0.5 else 'x'})
+        if response.status_code >= 400:
+            failed += 1
+        else:
+            ok += 1
+    results.put((ok, failed))
+
+
+def run(args):
+    """One shard count, in this (child) process; DATABASE_URL / DATABASE_SHARD_URLS are already set"""
+    from app import app
+    from models import db
+
+    count = len(os.environ.get('DATABASE_SHARD_URLS', '').split()) + 1
+    with app.app_context():
+        exercises = setup(args.users, args.answers)
+        rows, seconds = spread(count)
+        usernames = [f'bench-shard-{i}' for i in range(args.users)]
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [
+        context.Process(target=writer, args=(usernames[n::args.writers], exercises, args.seconds, n, results))
+        for n in range(args.writers)
+    ]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    ok = sum(ok for ok, _ in totals)
+    failed = sum(failed for _, failed in totals)
+    moved = f'{rows:,} rows moved in {seconds:.1f}s ({rows / seconds:,.0f} rows/s)' if rows else 'nothing moved'
+    print(f'{count} shard(s): {ok / args.seconds:>8,.0f} submissions/s from {args.writers} writers, '
+          f'{failed} failed; {moved}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark submission throughput over 1, 2 and 4 shards')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4], help='Shard counts to compare')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--answers', type=int, default=20, help='Answers logged per user before the move')
+    parser.add_argument('--writers', type=int, default=8, help='Writer processes')
+    parser.add_argument('--seconds', type=float, default=10.0, help='How long the writers run')
+    parser.add_argument('--synchronous', choices=['OFF', 'NORMAL', 'FULL'], default='NORMAL',
+                        help='SQLite synchronous pragma on every database (FULL fsyncs each commit)')
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)  # one shard count, in a child
+    args = parser.parse_args()
+
+    # Must happen before the app (and its engine options) are imported
+    DATABASE_CONFIG['sqlite_pragmas']['synchronous'] = args.synchronous
+    SHARD_CONFIG['move_grace_seconds'] = 0  # Nothing is serving the scratch databases during the move
+    RATE_LIMIT_CONFIG['enabled'] = False  # Measures the shards, not the admission limits
+    if args.run:
+        run(args)
+        return
+
+    url = os.environ.get('DATABASE_URL', '')
+    if not url.startswith('sqlite:///'):
+        raise SystemExit('Set DATABASE_URL to a scratch SQLite database (the shard files are created next to it)')
+    options = ['--users', str(args.users), '--answers', str(args.answers), '--writers', str(args.writers),
+               '--seconds', str(args.seconds), '--synchronous', args.synchronous]
+    for count in args.shards:
+        urls = database_urls(url, count)
+        remove_databases(urls)
+        try:
+            subprocess.run([sys.executable, __file__, '--run', *options], check=True,
+                           env={**os.environ, 'DATABASE_URL': urls[0], 'DATABASE_SHARD_URLS': ' '.join(urls[1:])})
+        finally:
+            remove_databases(urls)
+
+
+if __name__ == '__main__':
+    main()
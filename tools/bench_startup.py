@@ -0,0 +1,153 @@
+"""
+Worker startup benchmark
+Starts N workers three ways and reports, per worker, the time from process start
+(or fork) to its first response (GET /learning-path) and to the end of its first
+round of pages:
+
+  cold      a new interpreter per worker with an empty template bytecode cache
+            (every worker imports the app and compiles the templates itself)
+  bytecode  a new interpreter per worker with the bytecode cache already filled
+            (gunicorn without --preload, after `flask templates compile`)
+  preload   this process boots like wsgi.py (app built and warmed up), then forks
+            the workers (gunicorn --preload)
+
+The run fails (exit status 1) if a preload worker's first response takes longer
+than the budget, so CI can run it after every change. The database is set up
+with `flask db setup` first.
+
+DATABASE_URL must point at a scratch database.
+
+Usage: DATABASE_URL=sqlite:////tmp/startup.db python tools/bench_startup.py [--workers 4] [--budget-ms 500]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The first page, then pages rendering the other templates and reading the database
+PATHS = ('/learning-path', '/lessons/1', '/auth/login', '/leaderboard/global')
+
+
+def first_responses(app):
+    """Request PATHS once; returns the wall-clock times of the first response and of the last"""
+    client = app.test_client()
+    first = None
+    for path in PATHS:
+        response = client.get(path)
+        if response.status_code != 200:
+            raise SystemExit(f'GET {path} returned {response.status_code}')
+        first = first or time.time()
+    return first, time.time()
+
+
+def worker(cache_dir):
+    """Body of a spawned worker: boot like a gunicorn worker without --preload and serve"""
+    from config import STARTUP_CONFIG
+    STARTUP_CONFIG['bytecode_cache_dir'] = cache_dir
+    from app import create_app
+    print(json.dumps(first_responses(create_app())))
+
+
+def spawn_workers(count, cache_dirs):
+    """Start `count` interpreters at once; returns [(first, last)] in ms since each one started"""
+    children = []
+    for number in range(count):
+        started = time.time()
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', cache_dirs[number]],
+                                 cwd=ROOT, stdout=subprocess.PIPE, text=True)
+        children.append((started, child))
+    results = []
+    for started, child in children:
+        output, _ = child.communicate()
+        if child.returncode:
+            raise SystemExit('a worker failed')
+        first, last = json.loads(output)
+        results.append(((first - started) * 1000, (last - started) * 1000))
+    return results
+
+
+def fork_workers(app, count):
+    """Fork `count` workers from this (warmed up) process; returns [(first, last)] in ms since each fork"""
+    children = []
+    for _ in range(count):
+        read_end, write_end = os.pipe()
+        started = time.time()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            try:
+                os.write(write_end, json.dumps(first_responses(app)).encode())
+            finally:
+                os._exit(0)
+        os.close(write_end)
+        children.append((started, pid, read_end))
+    results = []
+    for started, pid, read_end in children:
+        with os.fdopen(read_end) as pipe:
+            output = pipe.read()
+        _, status = os.waitpid(pid, 0)
+        if status or not output:
+            raise SystemExit('a forked worker failed')
+        first, last = json.loads(output)
+        results.append(((first - started) * 1000, (last - started) * 1000))
+    return results
+
+
+def report(mode, results):
+    for number, (first, last) in enumerate(results, 1):
+        print(f'{mode:<9} worker {number}  first response {first:>8.1f} ms   all {len(PATHS)} pages {last:>8.1f} ms')
+    return max(first for first, _ in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure each worker's time to first response")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--budget-ms', type=float, help="Slowest preload worker's first response allowed "
+                                                         "(default: STARTUP_CONFIG['budget_ms'])")
+    parser.add_argument('--worker', metavar='CACHE_DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args.worker)
+    if not os.environ.get('DATABASE_URL'):
+        raise SystemExit('Set DATABASE_URL to a scratch database (it is set up with `flask db setup`)')
+
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'db', 'setup'], cwd=ROOT, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    scratch = tempfile.mkdtemp(prefix='calcuingo-startup-')
+    try:
+        cold_dirs = [os.path.join(scratch, f'cold-{number}') for number in range(args.workers)]
+        cold = report('cold', spawn_workers(args.workers, cold_dirs))
+
+        shared = os.path.join(scratch, 'bytecode')
+        spawn_workers(1, [shared])  # Fills the cache, like `flask templates compile`
+        warm = report('bytecode', spawn_workers(args.workers, [shared] * args.workers))
+
+        # Boot the master as wsgi.py does, with the filled bytecode cache
+        from config import STARTUP_CONFIG
+        STARTUP_CONFIG['bytecode_cache_dir'] = shared
+        started = time.perf_counter()
+        from wsgi import app
+        print(f'preload   master boot (import, create_app, warm_up) {(time.perf_counter() - started) * 1000:.1f} ms')
+        preload = report('preload', fork_workers(app, args.workers))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    budget = args.budget_ms if args.budget_ms is not None else STARTUP_CONFIG['budget_ms']
+    print(f'slowest first response: cold {cold:.1f} ms, bytecode {warm:.1f} ms, preload {preload:.1f} ms')
+    print(f"budget: preload workers {preload:.1f} ms / {budget:.0f} ms {'OK' if preload <= budget else 'EXCEEDED'}")
+    if preload > budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
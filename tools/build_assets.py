@@ -0,0 +1,225 @@
+"""
+Static asset build
+Concatenates and minifies each bundle in config.ASSETS_CONFIG, writes it to
+static/dist under a content-hashed name, precompresses it (gzip, plus brotli when
+the `brotli` package is installed) and records the names in static/dist/manifest.json.
+Files referenced from CSS with url() (fonts, images) are fingerprinted too and the
+references rewritten, so the whole of static/dist can be cached forever.
+
+With --vendor the third-party files (Bootstrap, Font Awesome and the fonts its CSS
+references) are first downloaded into static/vendor, after which the site needs
+no CDN. Without them the vendor bundles are skipped with a warning and pages keep
+linking the CDN copies. Run this as part of a deploy; the app serves static/dist at /assets.
+
+Usage: python tools/build_assets.py [--vendor] [--clean]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import sys
+import urllib.parse
+import urllib.request
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import ASSETS_CONFIG
+from services.assets import ENCODINGS, MANIFEST
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only .gz copies are written
+    brotli = None
+
+STATIC = os.path.join(ROOT, 'static')
+OUTPUT = os.path.join(STATIC, ASSETS_CONFIG['output_dir'])
+
+# Text formats worth precompressing; woff2 and images are compressed already
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ttf', '.eot', '.json', '.txt'}
+
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+
+
+def minify_css(text):
+    """Drop comments and insignificant whitespace; a space before ':' is kept, as in selectors it matters"""
+    text = CSS_COMMENT.sub('', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    """
+    Line-level minification: strip indentation, blank lines and whole-line // comments
+    Safe without a JavaScript parser; already minified vendor files pass through unchanged.
+    """
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def fingerprint(name, data):
+    """app.css + content -> app.<12 hex digits of sha256>.css"""
+    stem, extension = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+
+
+def write_output(name, data):
+    """Write a built file and its precompressed copies; returns the number of bytes written"""
+    path = os.path.join(OUTPUT, name)
+    with open(path, 'wb') as output:
+        output.write(data)
+    written = len(data)
+    if os.path.splitext(name)[1] not in COMPRESSIBLE or len(data) < ASSETS_CONFIG['compress_min_bytes']:
+        return written
+
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}  # mtime=0: reproducible builds
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(data) * 0.95:
+            with open(path + suffix, 'wb') as output:
+                output.write(compressed)
+            written += len(compressed)
+    return written
+
+
+def is_local_reference(reference):
+    return not (reference.startswith(('data:', '#', '/')) or urllib.parse.urlsplit(reference).scheme)
+
+
+def emit_referenced_file(source_path, reference, emitted):
+    """Fingerprint a file referenced from CSS; returns its built name, or None if missing"""
+    parts = urllib.parse.urlsplit(reference)
+    path = os.path.normpath(os.path.join(os.path.dirname(source_path), parts.path))
+    if path not in emitted:
+        if not os.path.isfile(path):
+            print(f'warning: {os.path.relpath(source_path, STATIC)} references missing {reference}')
+            return None
+        with open(path, 'rb') as referenced:
+            data = referenced.read()
+        emitted[path] = fingerprint(os.path.basename(path), data)
+        write_output(emitted[path], data)
+    return emitted[path] + (f'#{parts.fragment}' if parts.fragment else '')
+
+
+def rewrite_css_urls(text, source_path, emitted):
+    """Point relative url() references at fingerprinted copies next to the bundle"""
+    def replace(match):
+        reference = match.group(2).strip()
+        if not is_local_reference(reference):
+            return match.group(0)
+        built = emit_referenced_file(source_path, reference, emitted)
+        return f'url({built})' if built else match.group(0)
+    return CSS_URL.sub(replace, text)
+
+
+def build_bundle(bundle, sources, emitted):
+    """Concatenate, rewrite and minify one bundle; returns (built name, size in bytes)"""
+    extension = os.path.splitext(bundle)[1]
+    parts = []
+    for source in sources:
+        path = os.path.join(STATIC, source)
+        if not os.path.isfile(path):
+            raise SystemExit(f'error: {bundle} source {source} does not exist')
+        with open(path, encoding='utf-8') as source_file:
+            text = source_file.read()
+        if extension == '.css':
+            parts.append(minify_css(rewrite_css_urls(text, path, emitted)))
+        else:
+            parts.append(minify_js(text))
+
+    # ';' keeps concatenated scripts apart even if one lacks a trailing semicolon
+    data = ('\n' if extension == '.css' else ';\n').join(parts).encode('utf-8')
+    name = fingerprint(bundle, data)
+    write_output(name, data)
+    return name, len(data)
+
+
+def download(url, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read()
+    except OSError as error:
+        raise SystemExit(f'error: could not download {url}: {error}')
+    with open(path, 'wb') as output:
+        output.write(data)
+    return data
+
+
+def vendor():
+    """Download third-party files, and the fonts/images their CSS references, into static/"""
+    for source, url in ASSETS_CONFIG['vendor'].items():
+        path = os.path.join(STATIC, source)
+        data = download(url, path)
+        print(f'vendored {source} ({len(data):,} bytes)')
+        if not source.endswith('.css'):
+            continue
+        references = {match.group(2).strip() for match in CSS_URL.finditer(data.decode('utf-8'))}
+        for reference in sorted(filter(is_local_reference, references)):
+            relative = urllib.parse.urlsplit(reference).path
+            target = os.path.normpath(os.path.join(os.path.dirname(path), relative))
+            if not target.startswith(os.path.join(STATIC, 'vendor')):
+                continue  # Never write outside static/vendor
+            if not os.path.exists(target):
+                download(urllib.parse.urljoin(url, relative), target)
+                print(f'vendored {posixpath.normpath(posixpath.join(posixpath.dirname(source), relative))}')
+
+
+def clean(keep):
+    """Remove built files that the new manifest no longer references"""
+    removed = 0
+    for name in os.listdir(OUTPUT):
+        base = name
+        for _, suffix in ENCODINGS:
+            base = base[:-len(suffix)] if base.endswith(suffix) else base
+        if name != MANIFEST and base not in keep:
+            os.remove(os.path.join(OUTPUT, name))
+            removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build fingerprinted, precompressed static assets')
+    parser.add_argument('--vendor', action='store_true', help='Download third-party CSS/JS/fonts first')
+    parser.add_argument('--clean', action='store_true',
+                        help='Delete built files from earlier builds (keep them during rolling deploys)')
+    args = parser.parse_args()
+
+    if args.vendor:
+        vendor()
+
+    os.makedirs(OUTPUT, exist_ok=True)
+    manifest = {}
+    emitted = {}  # Source path of a url() reference -> built name
+    for bundle, sources in ASSETS_CONFIG['bundles'].items():
+        missing = [source for source in sources if source in ASSETS_CONFIG['vendor']
+                   and not os.path.isfile(os.path.join(STATIC, source))]
+        if missing:
+            # Left out of the manifest, so pages keep loading this bundle from the CDN
+            print(f'warning: skipped {bundle}: {", ".join(missing)} not downloaded (run with --vendor)')
+            continue
+        manifest[bundle], size = build_bundle(bundle, sources, emitted)
+        print(f'{bundle:<12} -> {manifest[bundle]} ({size:,} bytes)')
+
+    # Written last and atomically, so workers never see names of files not yet written
+    temporary = os.path.join(OUTPUT, MANIFEST + '.tmp')
+    with open(temporary, 'w', encoding='utf-8') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    os.replace(temporary, os.path.join(OUTPUT, MANIFEST))
+
+    if args.clean:
+        print(f'removed {clean(set(manifest.values()) | set(emitted.values()))} stale file(s)')
+    if brotli is None:
+        print('note: install `brotli` to also write .br files')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Badge award check for thresholds crossed without a new lesson completion
+XP and correct_attempts rules must be checked on every correct answer, not only
+when a lesson is completed for the first time. On a scratch database this
+completes a lesson, then:
+
+- raises the user's XP to the 'Math Master' threshold (as an import would) and
+  answers the completed lesson again: the badge must be awarded by that answer;
+- answers until a correct_attempts rule added for the check is met: the badge
+  must appear with the answer that reaches the threshold, and a wrong answer
+  must not award anything.
+
+Usage: python tools/check_badges.py
+Exits with status 1 if a badge is missing or awarded too early.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import BADGE_RULES, RATE_LIMIT_CONFIG
+
+XP_BADGE = next(rule for rule in BADGE_RULES if rule['metric'] == 'xp')
+ANSWERS_BADGE = {'name': 'Check: Three Correct', 'events': ['completion'], 'metric': 'correct_attempts',
+                 'threshold': 3}
+
+# Must happen before the badge rules are indexed (when services.badges is imported)
+BADGE_RULES.append(ANSWERS_BADGE)
+RATE_LIMIT_CONFIG['enabled'] = False  # All answers come from one client in a burst
+
+
+def main():
+    from sqlalchemy import update
+
+    from app import create_app
+    from models import Lesson, User, UserBadge, db
+    from services.catalog import get_catalog
+    from services.schema import ensure_schema
+
+    directory = tempfile.mkdtemp(prefix='calcuingo-badges-')
+    failures = []
+    try:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'badges.db')}",
+                          'SQLALCHEMY_BINDS': {}})
+        with app.app_context():
+            db.create_all()
+            ensure_schema()
+            if db.session.query(Lesson.id).first() is None:
+                from dummy_data import create_dummy_data
+                create_dummy_data()
+            lesson, exercise = next((lesson, exercise) for lesson in get_catalog().lessons
+                                    for exercise in lesson.exercises if not exercise.generator)
+
+        client = app.test_client()
+        client.post('/auth/register', data={'username': 'check-badges', 'password': 'check-badges'})
+        client.post('/auth/login', data={'username': 'check-badges', 'password': 'check-badges'})
+
+        def answer(text):
+            client.get(f'/lessons/{lesson.id}')
+            client.post(f'/lessons/{lesson.id}/submit', data={'exercise_id': exercise.id, 'answer': text})
+            with app.app_context():
+                user_id = db.session.query(User.id).filter_by(username='check-badges').scalar()
+                return user_id, {name for (name,) in db.session.query(UserBadge.badge).filter_by(user_id=user_id)}
+
+        def expect(step, badges, name, awarded):
+            ok = (name in badges) == awarded
+            if not ok:
+                failures.append(f"{step}: {name!r} {'missing' if awarded else 'awarded too early'}")
+            print(f"{'OK  ' if ok else 'FAIL'} {step:<48} {name!r} {'awarded' if awarded else 'not yet'}")
+
+        user_id, badges = answer(exercise.answer)  # First completion: 1 correct answer
+        expect('first completion', badges, XP_BADGE['name'], False)
+        expect('first completion', badges, ANSWERS_BADGE['name'], False)
+
+        with app.app_context():
+            db.session.execute(update(User).where(User.id == user_id).values(xp=XP_BADGE['threshold']))
+            db.session.commit()
+        _, badges = answer('not the answer')
+        expect('wrong answer after an XP import', badges, XP_BADGE['name'], False)
+        _, badges = answer(exercise.answer)  # 2 correct answers
+        expect('repeat correct answer after an XP import', badges, XP_BADGE['name'], True)
+        expect('second correct answer', badges, ANSWERS_BADGE['name'], False)
+        _, badges = answer(exercise.answer)  # 3 correct answers
+        expect('third correct answer (repeat)', badges, ANSWERS_BADGE['name'], True)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print('FAILED' if failures else 'PASSED')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Query plan check for the hot queries
+Runs EXPLAIN on the queries behind the learning path, lessons, submissions,
+stats, badges, leaderboards and review queues and fails if any of them stops using its index
+(for example after a migration or model change drops it). Meant for CI.
+
+Usage: DATABASE_URL=sqlite:////tmp/plans.db python tools/check_query_plans.py
+Works on SQLite (EXPLAIN QUERY PLAN) and PostgreSQL (EXPLAIN with sequential
+scans disabled, so small test tables still show which index would be used).
+Exits with status 1 if any query does not use its expected index.
+"""
+import json
+import os
+import sys
+from datetime import datetime
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import select, text
+
+from app import app, db
+from models import Attempt, Exercise, Lesson, Progress, ReviewItem, UserBadge, XpEvent
+from services.schema import ensure_schema
+
+# (description, statement, index that must appear in the plan)
+HOT_QUERIES = [
+    ('progress row for a submission',
+     select(Progress).where(Progress.user_id == 1, Progress.lesson_id == 1), 'uq_progress_user_lesson'),
+    ('progress for the learning path',
+     select(Progress).where(Progress.user_id == 1), 'uq_progress_user_lesson'),
+    ('progress per lesson',
+     select(Progress.user_id).where(Progress.lesson_id == 1), 'ix_progress_lesson_id'),
+    ('exercises of a lesson in order',
+     select(Exercise).where(Exercise.lesson_id == 1).order_by(Exercise.order), 'ix_exercise_lesson_order'),
+    ('exercise by content key',
+     select(Exercise.id).where(Exercise.key == 'limits-1'), 'uq_exercise_key'),
+    ('lesson by content key',
+     select(Lesson.id).where(Lesson.slug == 'limits'), 'uq_lesson_slug'),
+    ('attempt log of a user',
+     select(Attempt).where(Attempt.user_id == 1, Attempt.id > 0).order_by(Attempt.id), 'ix_attempt_user_id'),
+    ('badges of a user',
+     select(UserBadge.badge).where(UserBadge.user_id == 1), 'uq_user_badge'),
+    ('this week\'s XP events',
+     select(XpEvent.user_id, XpEvent.amount).where(XpEvent.created_at >= datetime(2024, 1, 1)),
+     'ix_xp_event_created_at'),
+    ('next review items due',
+     select(ReviewItem).where(ReviewItem.user_id == 1, ReviewItem.next_due <= datetime(2024, 1, 1))
+     .order_by(ReviewItem.next_due).limit(10), 'ix_review_item_due'),
+]
+
+
+def compile_sql(statement):
+    return str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+
+
+def sqlite_plan(connection, sql):
+    rows = connection.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()
+    return '\n'.join(row[-1] for row in rows)
+
+
+def postgresql_plan(connection, sql):
+    connection.execute(text('SET LOCAL enable_seqscan = off'))
+    plan = connection.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+    plan = plan if isinstance(plan, list) else json.loads(plan)
+    return json.dumps(plan)
+
+
+def main():
+    failed = False
+    with app.app_context():
+        db.create_all()
+        ensure_schema()
+        explain = postgresql_plan if db.engine.dialect.name == 'postgresql' else sqlite_plan
+
+        with db.engine.connect() as connection:
+            for description, statement, index in HOT_QUERIES:
+                with connection.begin():
+                    plan = explain(connection, compile_sql(statement))
+                ok = index in plan
+                failed = failed or not ok
+                print(f"{'OK  ' if ok else 'FAIL'} {description:<34} expects {index}")
+                if not ok:
+                    print('      plan: ' + plan.replace('\n', '\n            '))
+
+    print('FAILED' if failed else 'PASSED')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
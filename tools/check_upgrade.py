@@ -0,0 +1,81 @@
+"""
+Schema upgrade check against a database from before the versioned migrations
+Copies instance/calcuingo.db (the database the project shipped with, older than
+every migration in services/schema.py) to a scratch file, runs the same steps as
+`flask db upgrade` on it, then reads a full row of every model and upgrades a
+second time. Fails if a migration errors (for example an early migration reading
+a column that only a later one adds), if the upgraded schema is missing a model
+column, or if the second upgrade is not a no-op. Meant for CI.
+
+Usage: python tools/check_upgrade.py [--database instance/calcuingo.db]
+Exits with status 1 if the upgrade fails.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import create_app
+from models import Exercise, Lesson, db
+from services.schema import MIGRATIONS, applied_versions, upgrade
+
+
+def check(app):
+    """Upgrade the app's database; returns the failures found"""
+    failures = []
+    with app.app_context():
+        db.create_all()
+        upgrade(echo=print)
+
+        missing = sorted({version for version, _ in MIGRATIONS} - applied_versions())
+        if missing:
+            failures.append(f'migrations not recorded as applied: {missing}')
+        for mapper in sorted(db.Model.registry.mappers, key=lambda mapper: mapper.class_.__name__):
+            try:
+                db.session.query(mapper.class_).first()  # Selects every mapped column
+            except Exception as error:
+                db.session.rollback()
+                failures.append(f'{mapper.class_.__name__}: {str(error).splitlines()[0]}')
+        if db.session.query(Lesson.id).filter(Lesson.slug.is_(None)).first() is not None:
+            failures.append('lessons left without a slug')
+        if db.session.query(Exercise.id).filter(Exercise.key.is_(None)).first() is not None:
+            failures.append('exercises left without a key')
+        again = upgrade()
+        if again:
+            failures.append(f'second upgrade applied {again} again')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Upgrade a copy of a pre-migration database')
+    parser.add_argument('--database', default=os.path.join(ROOT, 'instance', 'calcuingo.db'),
+                        help='SQLite database to upgrade a copy of (default: the shipped instance/calcuingo.db)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='calcuingo-upgrade-')
+    try:
+        path = os.path.join(directory, 'upgrade.db')
+        shutil.copyfile(args.database, path)
+        print(f'Upgrading a copy of {args.database}')
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'SQLALCHEMY_BINDS': {}})
+        try:
+            failures = check(app)
+        except Exception:
+            failures = ['upgrade raised:\n' + traceback.format_exc()]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    print('FAILED' if failures else 'PASSED')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
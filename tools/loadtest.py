@@ -0,0 +1,323 @@
+"""
+Load test for the core learner journeys
+Seeds M lessons (plus optional background users) into the target database,
+starts a local server on it and drives concurrent simulated learners through:
+register -> login -> learning path -> lesson -> submit answer -> user stats.
+Reports throughput and p50/p95/p99 latency per endpoint and can save the
+results as JSON for later comparison.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/load.db python tools/loadtest.py run --users 50 --output before.json
+    DATABASE_URL=postgresql://localhost/calcuingo_load python tools/loadtest.py run --server gunicorn
+    python tools/loadtest.py compare before.json after.json [--tolerance 0.15]
+
+`run --url http://host:port` targets an already running server instead (it must
+use the same DATABASE_URL, which is still needed for seeding, and run with
+RATE_LIMIT_BACKEND=off, since all simulated learners share one address).
+`compare` exits with status 1 if any endpoint's p95 or throughput regressed by
+more than the tolerance.
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'loadtest-password'
+ENDPOINTS = ('register', 'login', 'learning_path', 'lesson_detail', 'submit_exercise', 'user_stats')
+
+
+def seed(lesson_count, exercises_per_lesson, background_users):
+    """Create the load-test lessons and background users; returns [(lesson_id, [(exercise_id, answer)])]"""
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+
+    from app import app, db
+    from models import Exercise, Lesson, User
+    from services.content import import_content
+    from services.schema import ensure_schema
+
+    lessons = [{'slug': f'loadtest-{i}', 'title': f'Load test lesson {i}', 'order': 10_000 + i,
+                'xp_reward': 5, 'prerequisites': [f'loadtest-{i - 1}'] if i else []}
+               for i in range(lesson_count)]
+    exercises = [{'key': f'loadtest-{i}-{j}', 'lesson': f'loadtest-{i}', 'type': 'fill_blank',
+                  'question': f'{i} + {j} = ___', 'answer': str(i + j), 'order': j}
+                 for i in range(lesson_count) for j in range(exercises_per_lesson)]
+
+    with app.app_context():
+        db.create_all()
+        ensure_schema()
+        import_content(lessons, exercises)
+
+        existing = User.query.filter(User.username.like('loadtest-bg-%')).count()
+        if background_users > existing:
+            password = generate_password_hash(PASSWORD)
+            db.session.execute(insert(User), [
+                {'username': f'loadtest-bg-{i}', 'password': password, 'xp': random.randrange(500), 'streak': 0}
+                for i in range(existing, background_users)
+            ])
+        db.session.commit()
+
+        slugs = {lesson['slug'] for lesson in lessons}
+        plan = {}
+        for lesson_id, exercise_id, answer in db.session.query(Lesson.id, Exercise.id, Exercise.answer) \
+                .join(Exercise, Exercise.lesson_id == Lesson.id).filter(Lesson.slug.in_(slugs)):
+            plan.setdefault(lesson_id, []).append((exercise_id, answer))
+        db.session.remove()
+    return sorted(plan.items())
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Measure the POST itself, not the page it redirects to"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Learner:
+    """One simulated learner with its own cookie jar"""
+
+    def __init__(self, base_url, results):
+        self.base_url = base_url
+        self.results = results
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    def fetch(self, path, data=None):
+        """Status code of one request (0 if the connection failed)"""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(self.base_url + path, body, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code  # 3xx lands here because redirects are not followed
+        except OSError:
+            return 0
+
+    def request(self, endpoint, path, data=None):
+        started = time.perf_counter()
+        status = self.fetch(path, data)
+        elapsed = time.perf_counter() - started
+        self.results.append((endpoint, elapsed, 0 < status < 400))
+
+    def run(self, plan, iterations, rng):
+        username = f'loadtest-{uuid.uuid4().hex[:12]}'
+        credentials = {'username': username, 'password': PASSWORD}
+        self.request('register', '/auth/register', credentials)
+        self.fetch('/auth/logout')
+        self.request('login', '/auth/login', credentials)
+        for _ in range(iterations):
+            lesson_id, exercises = rng.choice(plan)
+            exercise_id, answer = rng.choice(exercises)
+            self.request('learning_path', '/learning-path')
+            self.request('lesson_detail', f'/lessons/{lesson_id}')
+            submitted = answer if rng.random() < 0.7 else 'wrong'
+            self.request('submit_exercise', f'/lessons/{lesson_id}/submit',
+                         {'exercise_id': exercise_id, 'answer': submitted})
+            self.request('user_stats', '/progress/user-stats')
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(results, wall_seconds):
+    summary = {}
+    for endpoint in ENDPOINTS:
+        latencies = sorted(elapsed for name, elapsed, _ in results if name == endpoint)
+        errors = sum(1 for name, _, ok in results if name == endpoint and not ok)
+        if not latencies:
+            continue
+        summary[endpoint] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'throughput_rps': round(len(latencies) / wall_seconds, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    return summary
+
+
+def start_server(kind, port, workers, database_url):
+    # Every simulated learner connects from 127.0.0.1, so the per-IP rate limits would throttle the run
+    env = {**os.environ, 'DATABASE_URL': database_url, 'FLASK_APP': 'app.py', 'RATE_LIMIT_BACKEND': 'off'}
+    if kind == 'gunicorn':
+        command = ['gunicorn', '-w', str(workers), '--threads', '4', '--preload', '-b', f'127.0.0.1:{port}',
+                   'wsgi:app']
+    elif kind == 'uvicorn':
+        command = ['uvicorn', 'asgi:application', '--workers', str(workers), '--port', str(port), '--no-access-log']
+    else:
+        command = [sys.executable, '-m', 'flask', 'run', '--port', str(port), '--no-reload', '--with-threads']
+    log = tempfile.TemporaryFile()  # A pipe would fill up with access logs and stall the server
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise SystemExit(f'server exited: {log.read().decode()[-2000:]}')
+        try:
+            urllib.request.urlopen(base_url + '/learning-path', timeout=2).close()
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('server did not start within 30s')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_command(args):
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        raise SystemExit('Set DATABASE_URL to the database to load test (it is seeded with test data)')
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    plan = seed(args.lessons, args.exercises_per_lesson, args.background_users)
+
+    process = None
+    base_url = args.url
+    if not base_url:
+        process, base_url = start_server(args.server, args.port, args.workers, database_url)
+
+    results = []  # list.append is atomic, so threads share one list
+    learners = [(Learner(base_url, results), random.Random(rng.random())) for _ in range(args.users)]
+    queue = list(learners)
+    lock = threading.Lock()
+
+    def drive():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                learner, learner_rng = queue.pop()
+            learner.run(plan, args.iterations, learner_rng)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=drive) for _ in range(min(args.concurrency, args.users))]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        wall_seconds = time.perf_counter() - started
+        if process:
+            process.terminate()
+            process.wait()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'database': database_url.split(':', 1)[0],
+            'server': 'external' if args.url else args.server,
+            'python': platform.python_version(),
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'iterations': args.iterations,
+            'lessons': args.lessons,
+            'exercises_per_lesson': args.exercises_per_lesson,
+            'background_users': args.background_users,
+            'wall_seconds': round(wall_seconds, 2),
+            'total_rps': round(len(results) / wall_seconds, 2),
+        },
+        'endpoints': summarize(results, wall_seconds),
+    }
+
+    print(f"{'endpoint':<18}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<18}{row['requests']:>9}{row['errors']:>8}{row['throughput_rps']:>9.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}")
+    print(f"total {len(results)} requests in {wall_seconds:.1f}s ({report['meta']['total_rps']:.1f} req/s)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2)
+        print(f'results written to {args.output}')
+    return 1 if any(row['errors'] for row in report['endpoints'].values()) else 0
+
+
+def compare_command(args):
+    with open(args.baseline, encoding='utf-8') as handle:
+        baseline = json.load(handle)['endpoints']
+    with open(args.candidate, encoding='utf-8') as handle:
+        candidate = json.load(handle)['endpoints']
+
+    regressed = False
+    print(f"{'endpoint':<18}{'p95 before':>11}{'p95 after':>11}{'rps before':>11}{'rps after':>11}  status")
+    for endpoint in ENDPOINTS:
+        before, after = baseline.get(endpoint), candidate.get(endpoint)
+        if not before or not after:
+            continue
+        slower = after['p95_ms'] > before['p95_ms'] * (1 + args.tolerance)
+        fewer = after['throughput_rps'] < before['throughput_rps'] * (1 - args.tolerance)
+        status = 'REGRESSED' if slower or fewer else 'ok'
+        regressed = regressed or status != 'ok'
+        print(f"{endpoint:<18}{before['p95_ms']:>11.1f}{after['p95_ms']:>11.1f}"
+              f"{before['throughput_rps']:>11.1f}{after['throughput_rps']:>11.1f}  {status}")
+    return 1 if regressed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the core learner journeys')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Seed the database and run the load test')
+    run.add_argument('--users', type=int, default=20, help='Simulated learners (each registers a new account)')
+    run.add_argument('--concurrency', type=int, default=10, help='Learners active at the same time')
+    run.add_argument('--iterations', type=int, default=10, help='Lesson/submit rounds per learner')
+    run.add_argument('--lessons', type=int, default=20)
+    run.add_argument('--exercises-per-lesson', type=int, default=5)
+    run.add_argument('--background-users', type=int, default=0, help='Extra users inserted to grow the tables')
+    run.add_argument('--server', choices=('werkzeug', 'gunicorn', 'uvicorn'), default='werkzeug',
+                     help='uvicorn runs the async serving mode (asgi.py)')
+    run.add_argument('--workers', type=int, default=4, help='gunicorn/uvicorn worker processes')
+    run.add_argument('--port', type=int, default=5055)
+    run.add_argument('--url', help='Target a running server instead of starting one')
+    run.add_argument('--seed', type=int, default=1234, help='Random seed for a reproducible request mix')
+    run.add_argument('--output', help='Write the results to this JSON file')
+    run.set_defaults(func=run_command)
+
+    compare = commands.add_parser('compare', help='Compare two result files')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--tolerance', type=float, default=0.15, help='Allowed relative regression')
+    compare.set_defaults(func=compare_command)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Concurrency stress test for the XP write path
+Many threads submit correct answers (and mark lessons complete) for the same
+users at the same time. Every lesson must award its XP exactly once, so the
+final XP of each user has to equal the sum of the lesson rewards.
+
+Usage: DATABASE_URL=sqlite:////tmp/stress.db python tools/stress_xp.py [--threads 16] [--rounds 20]
+Exits with status 1 if any XP total is wrong.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+
+# Ensure project root is on sys.path so imports like `from app import app` work
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app import app, db
+from config import RATE_LIMIT_CONFIG
+from models import User, Lesson, Progress, Attempt, UserStats, UserBadge
+from services.catalog import get_catalog
+from services.schema import ensure_schema
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'stress-password'
+
+
+def setup(user_count):
+    """Create lessons (if needed) and a fresh set of stress users"""
+    db.create_all()
+    ensure_schema()
+    if Lesson.query.count() == 0:
+        from dummy_data import create_dummy_data
+        create_dummy_data()
+
+    usernames = [f'stress-user-{i}' for i in range(user_count)]
+    old_ids = [u.id for u in User.query.filter(User.username.in_(usernames))]
+    if old_ids:
+        for model in (Progress, Attempt, UserStats, UserBadge):
+            model.query.filter(model.user_id.in_(old_ids)).delete(synchronize_session=False)
+        User.query.filter(User.id.in_(old_ids)).delete(synchronize_session=False)
+    password = generate_password_hash(PASSWORD)
+    db.session.add_all([User(username=name, password=password, xp=0, streak=0) for name in usernames])
+    db.session.commit()
+    return usernames
+
+
+def worker(username, rounds, errors):
+    """Log in and hammer every lesson with correct submissions in random order"""
+    client = app.test_client()
+    client.post('/auth/login', data={'username': username, 'password': PASSWORD})
+    with app.app_context():
+        lessons = get_catalog().lessons
+    for _ in range(rounds):
+        lesson = random.choice(lessons)
+        if lesson.exercises and random.random() < 0.8:
+            exercise = random.choice(lesson.exercises)
+            response = client.post(f'/lessons/{lesson.id}/submit',
+                                   data={'exercise_id': exercise.id, 'answer': exercise.answer})
+        else:
+            response = client.post(f'/progress/update-lesson-status/{lesson.id}')
+        if response.status_code >= 400:
+            errors.append((username, response.status_code))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress test concurrent XP awards')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=16, help='Threads per user')
+    parser.add_argument('--rounds', type=int, default=20, help='Submissions per thread')
+    args = parser.parse_args()
+    RATE_LIMIT_CONFIG['enabled'] = False  # The threads hammer each user on purpose
+
+    with app.app_context():
+        usernames = setup(args.users)
+
+    errors = []
+    threads = [
+        threading.Thread(target=worker, args=(username, args.rounds, errors))
+        for username in usernames for _ in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failed = bool(errors)
+    with app.app_context():
+        rewards = {lesson.id: lesson.xp_reward for lesson in get_catalog().lessons}
+        for user in User.query.filter(User.username.in_(usernames)):
+            records = Progress.query.filter_by(user_id=user.id).all()
+            expected = sum(rewards[p.lesson_id] for p in records if p.completed)
+            duplicates = len(records) - len({p.lesson_id for p in records})
+            status = 'OK' if user.xp == expected and not duplicates else 'MISMATCH'
+            failed = failed or status != 'OK'
+            print(f'{user.username}: xp={user.xp} expected={expected} duplicate_rows={duplicates} {status}')
+
+    if errors:
+        print(f'{len(errors)} requests failed, first: {errors[0]}')
+    print('FAILED' if failed else 'PASSED')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,7 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from app import app, db
-from models import User, Lesson, Exercise, Progress
-from datetime import datetime
+from models import User, Lesson, Exercise, Progress, utcnow
 
 with app.app_context():
     db.create_all()
@@ -33,7 +32,7 @@ with app.app_context():
     print('Before:', p.attempts, p.score)
     # Simulate increment
     p.attempts = (p.attempts or 0) + 1
-    p.last_attempt = datetime.utcnow()
+    p.last_attempt = utcnow()
     p.score = max(float(p.score or 0.0), 1.0)
     db.session.commit()
     p2 = Progress.query.get(p.id)
@@ -0,0 +1,19 @@
+"""
+WSGI entry point for production servers
+    gunicorn --preload -w 4 -b 0.0.0.0:5000 wsgi:app
+
+With --preload gunicorn imports this module once, in the master: the app is built
+and warmed up (templates compiled, catalog loaded) before the workers are forked,
+so every worker serves its first request without that work. Without --preload
+each worker does the same when it starts. Database connections are never shared:
+warm_up() closes its own and services/startup.py resets the pools in each worker.
+
+The schema is not checked on boot; run `flask --app app db setup` (or
+`flask --app app db upgrade`) when deploying.
+"""
+
+from app import create_app
+from services.startup import warm_up
+
+app = create_app()
+warm_up(app)